@@ -0,0 +1,391 @@
+"""
+Benchmark de carga de la API de reservas.
+
+Siembra N canchas y M reservas a través de la propia API y mide la latencia (p50/p90/p99) y el rendimiento
+de los endpoints de consulta, creación bajo contención y borrado. Los resultados se emiten en JSON para
+poder compararlos entre versiones.
+
+Se ejecuta desde ./backend/ contra la BDD de POSTGRES_URI (la aplicación se monta en el mismo proceso)
+o contra un servidor ya iniciado con --url. Las canchas sembradas se llaman "bench-*" y se eliminan,
+junto con sus reservas, antes de cada ejecución. Usar una BDD dedicada: no hay un reemplazo en SQLite,
+ya que el esquema depende de TSRANGE y de restricciones de exclusión de Postgres.
+
+	python -m benchmarks.benchmark_api --canchas 20 --reservas 5000 --salida resultados.json
+	python -m benchmarks.benchmark_api --url http://127.0.0.1:8000 --concurrencia 16
+	python -m benchmarks.benchmark_api --comparar anterior.json resultados.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import re
+import subprocess
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from itertools import combinations
+from statistics import fmean, quantiles
+from time import perf_counter
+from typing import Callable, Optional
+import httpx
+
+_PREFIJO_CANCHAS = 'bench-'
+_DÍA_BASE = date(2030, 1, 1)
+_HORA_INICIAL = 8
+_HORAS_POR_DÍA = 16
+_TAMAÑO_LOTE_SIEMBRA = 1000
+
+@dataclass
+class Siembra:
+	ids_cancha: list[int]
+	días: int
+	teléfonos: list[str]
+
+@dataclass
+class Escenario:
+	nombre: str
+	método: str
+	ruta: Callable[[int], str]
+	repeticiones: int
+	concurrencia: int
+	calentamiento: int = 0
+
+def _teléfono(i: int) -> str:
+	return f'343{(i * 7919) % 10_000_000:07d}'
+
+async def limpiar(cliente: httpx.AsyncClient):
+	"""Elimina las canchas sembradas por ejecuciones anteriores junto con sus reservas"""
+
+	respuesta = await cliente.delete('/reservas/q', params={'nom_cancha': f'{_PREFIJO_CANCHAS}*'})
+	respuesta.raise_for_status()
+	respuesta = await cliente.delete('/canchas/q', params={'nombre': f'{_PREFIJO_CANCHAS}*'})
+	respuesta.raise_for_status()
+
+async def sembrar(cliente: httpx.AsyncClient, canchas: int, reservas: int) -> Siembra:
+	"""Crea las canchas y reservas del benchmark, sin solapamientos, en lotes a través de POST /reservas/lote"""
+
+	ids_cancha = []
+
+	for i in range(canchas):
+		respuesta = await cliente.post('/canchas/', params={'nombre': f'{_PREFIJO_CANCHAS}{i}', 'techada': i % 2 == 0})
+		respuesta.raise_for_status()
+		ids_cancha.append(respuesta.json()['id'])
+
+	lote = []
+	teléfonos = []
+
+	for i in range(reservas):
+		turno = i // canchas
+		teléfono = _teléfono(i)
+		teléfonos.append(teléfono)
+		lote.append({
+			'id_cancha': ids_cancha[i % canchas],
+			'dia': (_DÍA_BASE + timedelta(days=turno // _HORAS_POR_DÍA)).isoformat(),
+			'hora': _HORA_INICIAL + turno % _HORAS_POR_DÍA,
+			'duración_minutos': 60,
+			'teléfono': teléfono,
+			'nombre_contacto': f'Contacto {i % 500}',
+		})
+
+		if len(lote) == _TAMAÑO_LOTE_SIEMBRA or i == reservas - 1:
+			respuesta = await cliente.post('/reservas/lote', json=lote)
+			respuesta.raise_for_status()
+			rechazadas = [r for r in respuesta.json() if r['status_code'] != 201]
+
+			if len(rechazadas) > 0:
+				raise RuntimeError(f'La siembra rechazó {len(rechazadas)} reservas. Primera: {rechazadas[0]}')
+
+			lote = []
+
+	días = -(-reservas // (canchas * _HORAS_POR_DÍA)) if reservas > 0 else 1
+	return Siembra(ids_cancha=ids_cancha, días=max(días, 1), teléfonos=teléfonos or [_teléfono(0)])
+
+def _filtros_reservas(siembra: Siembra) -> dict[str, Callable[[int], str]]:
+	n = len(siembra.ids_cancha)
+
+	return {
+		'id_cancha': lambda i: str(siembra.ids_cancha[i % n]),
+		'dia': lambda i: (_DÍA_BASE + timedelta(days=i % siembra.días)).isoformat(),
+		'hora': lambda i: str(_HORA_INICIAL + i % _HORAS_POR_DÍA),
+		'dur_mins': lambda i: '60',
+		'tel': lambda i: siembra.teléfonos[i % len(siembra.teléfonos)],
+		'nom_contacto': lambda i: f'Contacto {i % 50}*',
+		'nom_cancha': lambda i: f'{_PREFIJO_CANCHAS}{i % n}',
+	}
+
+def _ruta_con_filtros(base: str, filtros: dict[str, Callable[[int], str]]) -> Callable[[int], str]:
+	return lambda i: str(httpx.URL(base, params={nombre: valor(i) for nombre, valor in filtros.items()}))
+
+def escenarios(
+	siembra: Siembra,
+	repeticiones: int,
+	concurrencia: int,
+	calentamiento: int,
+	slots_disputados: int,
+) -> list[Escenario]:
+	"""Arma los escenarios en orden de ejecución. Los que modifican datos van al final"""
+
+	n = len(siembra.ids_cancha)
+	lista = []
+
+	# GET /reservas/q con cada combinación de filtros
+	filtros = _filtros_reservas(siembra)
+
+	for tamaño in range(0, len(filtros) + 1):
+		for combinación in combinations(filtros, tamaño):
+			nombre = '+'.join(combinación) if tamaño > 0 else 'sin filtros'
+			lista.append(Escenario(
+				nombre=f'GET /reservas/q [{nombre}]',
+				método='GET',
+				ruta=_ruta_con_filtros('/reservas/q', {f: filtros[f] for f in combinación}),
+				repeticiones=repeticiones,
+				concurrencia=concurrencia,
+				calentamiento=calentamiento,
+			))
+
+	# GET /canchas/q
+	filtros_canchas = {
+		'sin filtros': {},
+		'nombre': {'nombre': lambda i: f'{_PREFIJO_CANCHAS}{i % n}*'},
+		'techada': {'techada': lambda i: str(i % 2 == 0).lower()},
+		'rango': {'qmin': lambda i: '0', 'qmax': lambda i: str(max(n // 2, 1))},
+		'limite': {'limite': lambda i: '10'},
+	}
+
+	for nombre, filtros_cancha in filtros_canchas.items():
+		lista.append(Escenario(
+			nombre=f'GET /canchas/q [{nombre}]',
+			método='GET',
+			ruta=_ruta_con_filtros('/canchas/q', filtros_cancha),
+			repeticiones=repeticiones,
+			concurrencia=concurrencia,
+			calentamiento=calentamiento,
+		))
+
+	# POST /reservas/cancha/{id} con varios clientes disputando pocos horarios, posteriores a los sembrados
+	día_disputado = (_DÍA_BASE + timedelta(days=siembra.días + 1)).isoformat()
+
+	def ruta_disputada(i: int) -> str:
+		slot = i % max(slots_disputados, 1)
+		return str(httpx.URL(f'/reservas/cancha/{siembra.ids_cancha[slot % n]}', params={
+			'dia': día_disputado,
+			'hora': _HORA_INICIAL + slot // n % _HORAS_POR_DÍA,
+			'dur_mins': 90,
+			'tel': _teléfono(i),
+			'nom_contacto': f'Disputa {i}',
+		}))
+
+	lista.append(Escenario(
+		nombre='POST /reservas/cancha/{id} [contención]',
+		método='POST',
+		ruta=ruta_disputada,
+		repeticiones=repeticiones,
+		concurrencia=concurrencia,
+	))
+
+	# DELETE /reservas/q sobre pares (cancha, día) distintos para que cada petición borre reservas
+	pares = n * siembra.días
+	lista.append(Escenario(
+		nombre='DELETE /reservas/q [id_cancha+dia]',
+		método='DELETE',
+		ruta=lambda i: str(httpx.URL('/reservas/q', params={
+			'id_cancha': siembra.ids_cancha[i % n],
+			'dia': (_DÍA_BASE + timedelta(days=i // n)).isoformat(),
+		})),
+		repeticiones=min(repeticiones, pares),
+		concurrencia=concurrencia,
+	))
+
+	return lista
+
+def _resumir_latencias(latencias: list[float]) -> dict[str, float]:
+	if len(latencias) == 0:
+		return {}
+
+	ms = sorted(latencia * 1000 for latencia in latencias)
+
+	if len(ms) == 1:
+		percentiles = [ms[0]] * 99
+	else:
+		percentiles = quantiles(ms, n=100, method='inclusive')
+
+	return {
+		'p50': round(percentiles[49], 3),
+		'p90': round(percentiles[89], 3),
+		'p99': round(percentiles[98], 3),
+		'media': round(fmean(ms), 3),
+		'mín': round(ms[0], 3),
+		'máx': round(ms[-1], 3),
+	}
+
+async def ejecutar_escenario(cliente: httpx.AsyncClient, escenario: Escenario) -> dict:
+	"""Ejecuta las peticiones de un escenario con la concurrencia indicada y resume sus mediciones"""
+
+	for i in range(escenario.calentamiento):
+		await cliente.request(escenario.método, escenario.ruta(i))
+
+	latencias: list[float] = []
+	estados: Counter[int] = Counter()
+	errores = 0
+	siguiente = iter(range(escenario.repeticiones))
+
+	async def trabajador():
+		nonlocal errores
+
+		for i in siguiente:
+			inicio = perf_counter()
+
+			try:
+				respuesta = await cliente.request(escenario.método, escenario.ruta(i))
+			except httpx.HTTPError:
+				errores += 1
+				continue
+
+			latencias.append(perf_counter() - inicio)
+			estados[respuesta.status_code] += 1
+
+	inicio = perf_counter()
+	await asyncio.gather(*(trabajador() for _ in range(max(escenario.concurrencia, 1))))
+	duración = perf_counter() - inicio
+
+	return {
+		'nombre': escenario.nombre,
+		'método': escenario.método,
+		'peticiones': len(latencias),
+		'concurrencia': escenario.concurrencia,
+		'errores_de_conexión': errores,
+		'status': {str(código): cantidad for código, cantidad in sorted(estados.items())},
+		'latencia_ms': _resumir_latencias(latencias),
+		'rendimiento_rps': round(len(latencias) / duración, 3) if duración > 0 else None,
+		'duración_s': round(duración, 3),
+	}
+
+def _revisión_git() -> Optional[str]:
+	try:
+		return subprocess.run(
+			['git', 'rev-parse', '--short', 'HEAD'],
+			capture_output=True, text=True, check=True,
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+async def _correr(args: argparse.Namespace, cliente: httpx.AsyncClient) -> dict:
+	await limpiar(cliente)
+
+	inicio = perf_counter()
+	siembra = await sembrar(cliente, args.canchas, args.reservas)
+	duración_siembra = perf_counter() - inicio
+
+	filtro = re.compile(args.escenarios) if args.escenarios else None
+	resultados = []
+
+	for escenario in escenarios(siembra, args.repeticiones, args.concurrencia, args.calentamiento, args.slots_disputados):
+		if filtro is not None and filtro.search(escenario.nombre) is None:
+			continue
+
+		resultado = await ejecutar_escenario(cliente, escenario)
+		resultados.append(resultado)
+		print(
+			f"{resultado['nombre']}: p50={resultado['latencia_ms'].get('p50')} ms "
+			f"p99={resultado['latencia_ms'].get('p99')} ms {resultado['rendimiento_rps']} rps",
+			file=sys.stderr,
+		)
+
+	if not args.conservar:
+		await limpiar(cliente)
+
+	return {
+		'metadatos': {
+			'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+			'revisión': _revisión_git(),
+			'python': platform.python_version(),
+			'destino': args.url or 'en proceso',
+			'canchas': args.canchas,
+			'reservas': args.reservas,
+			'repeticiones': args.repeticiones,
+			'concurrencia': args.concurrencia,
+			'siembra_s': round(duración_siembra, 3),
+		},
+		'escenarios': resultados,
+	}
+
+async def correr(args: argparse.Namespace) -> dict:
+	tiempo_de_espera = httpx.Timeout(60)
+
+	if args.url is not None:
+		async with httpx.AsyncClient(base_url=args.url, timeout=tiempo_de_espera) as cliente:
+			return await _correr(args, cliente)
+
+	from main import app
+
+	async with app.router.lifespan_context(app):
+		transporte = httpx.ASGITransport(app=app)
+
+		async with httpx.AsyncClient(transport=transporte, base_url='http://bench', timeout=tiempo_de_espera) as cliente:
+			return await _correr(args, cliente)
+
+def comparar(ruta_anterior: str, ruta_nueva: str):
+	"""Imprime la variación de p50, p99 y rendimiento de cada escenario entre 2 ejecuciones"""
+
+	with open(ruta_anterior, encoding='utf-8') as archivo:
+		anterior = {e['nombre']: e for e in json.load(archivo)['escenarios']}
+
+	with open(ruta_nueva, encoding='utf-8') as archivo:
+		nuevo = {e['nombre']: e for e in json.load(archivo)['escenarios']}
+
+	def variación(antes: Optional[float], después: Optional[float]) -> str:
+		if not antes or después is None:
+			return '-'
+		return f'{(después - antes) / antes * 100:+.1f}%'
+
+	for nombre, escenario in nuevo.items():
+		previo = anterior.get(nombre)
+
+		if previo is None:
+			print(f'{nombre}: nuevo')
+			continue
+
+		print(
+			f"{nombre}: "
+			f"p50 {variación(previo['latencia_ms'].get('p50'), escenario['latencia_ms'].get('p50'))} "
+			f"p99 {variación(previo['latencia_ms'].get('p99'), escenario['latencia_ms'].get('p99'))} "
+			f"rps {variación(previo['rendimiento_rps'], escenario['rendimiento_rps'])}"
+		)
+
+def main(argv: Optional[list[str]] = None):
+	parser = argparse.ArgumentParser(description='Benchmark de carga de la API de reservas')
+	parser.add_argument('--url', help='URL de un servidor ya iniciado. Por defecto, la aplicación se monta en el proceso')
+	parser.add_argument('--canchas', type=int, default=10, help='Canchas a sembrar (N)')
+	parser.add_argument('--reservas', type=int, default=2000, help='Reservas a sembrar (M)')
+	parser.add_argument('--repeticiones', type=int, default=50, help='Peticiones medidas por escenario')
+	parser.add_argument('--concurrencia', type=int, default=8, help='Peticiones simultáneas por escenario')
+	parser.add_argument('--calentamiento', type=int, default=3,
+		help='Peticiones no medidas antes de cada escenario de lectura')
+	parser.add_argument('--slots-disputados', type=int, default=4,
+		help='Horarios que se disputan en el escenario de contención')
+	parser.add_argument('--escenarios', help='Expresión regular para ejecutar solo los escenarios cuyo nombre coincida')
+	parser.add_argument('--salida', help='Archivo JSON de resultados. Por defecto, la salida estándar')
+	parser.add_argument('--conservar', action='store_true', help='No eliminar los datos sembrados al terminar')
+	parser.add_argument('--comparar', nargs=2, metavar=('ANTERIOR', 'NUEVO'), help='Compara 2 archivos de resultados')
+	args = parser.parse_args(argv)
+
+	if args.comparar is not None:
+		comparar(*args.comparar)
+		return
+
+	if args.canchas <= 0:
+		parser.error('--canchas debe ser positivo')
+
+	resultados = asyncio.run(correr(args))
+	texto = json.dumps(resultados, ensure_ascii=False, indent='\t')
+
+	if args.salida is None:
+		print(texto)
+	else:
+		with open(args.salida, 'w', encoding='utf-8') as archivo:
+			archivo.write(texto + '\n')
+
+if __name__ == '__main__':
+	main()
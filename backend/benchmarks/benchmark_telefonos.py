@@ -0,0 +1,96 @@
+"""
+Micro-benchmark de la validación y normalización de teléfonos.
+
+Compara el costo por llamada de la implementación anterior (re.match con el patrón como literal en cada llamada)
+con el patrón precompilado, con la normalización memoizada y con normalizar_varios sobre un lote. Los teléfonos
+se eligen de un conjunto de --distintos números, para simular clientes que repiten su número. No usa la BDD.
+
+	python -m benchmarks.benchmark_telefonos --llamadas 200000 --distintos 500
+"""
+
+import argparse
+import json
+import platform
+import re
+from timeit import repeat
+from typing import Callable, Optional
+from fastapi import HTTPException, status
+from db.telefonos import NormalizadorTeléfonos, _normalizar
+
+def _normalizar_anterior(teléfono) -> str:
+	"""Copia de la implementación anterior de crud.verificar_y_normalizar_teléfono, como referencia"""
+
+	if not isinstance(teléfono, str):
+		raise HTTPException(status.HTTP_400_BAD_REQUEST, 'El número de teléfono debe ser un string')
+
+	teléfono = teléfono.strip()
+
+	if len(teléfono) == 0:
+		raise HTTPException(status.HTTP_400_BAD_REQUEST, 'El número de teléfono debe ser un string y no puede estar vacío')
+
+	partes = re.match(
+		pattern=r'^(?:(\+\d{1,2})\s?)?(?:(\d)\s?)?\(?(\d{3})\)?[\s.-]?(\d{3})[\s.-]?(\d{4})$',
+		string=teléfono,
+	)
+
+	if partes is None:
+		raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, f'"{teléfono}" no es un número de teléfono válido')
+
+	return ''.join(partes[i] if partes[i] is not None else '' for i in range(1, 6))
+
+def _teléfonos(llamadas: int, distintos: int) -> list[str]:
+	formatos = ('+54 9 343 {0:03d}-{1:04d}', '343 {0:03d} {1:04d}', '(343) {0:03d}.{1:04d}', '9 343{0:03d}{1:04d}')
+	números = [formatos[i % len(formatos)].format(i // 10_000 % 1000, i % 10_000) for i in range(distintos)]
+	return [números[(i * 7919) % distintos] for i in range(llamadas)]
+
+def _medir(función: Callable[[], object], llamadas: int, repeticiones: int) -> float:
+	"""Devuelve el mejor tiempo por teléfono, en nanosegundos"""
+	return min(repeat(función, number=1, repeat=repeticiones)) / llamadas * 1e9
+
+def correr(llamadas: int, distintos: int, repeticiones: int) -> dict:
+	teléfonos = _teléfonos(llamadas, distintos)
+	normalizador = NormalizadorTeléfonos(capacidad=max(distintos, 1))
+
+	# Todas las variantes deben coincidir con la implementación anterior
+	muestra = teléfonos[:distintos]
+	assert [normalizador.normalizar(t) for t in muestra] == [_normalizar_anterior(t) for t in muestra]
+
+	def una_por_una(normalizar: Callable[[str], str]) -> Callable[[], list[str]]:
+		return lambda: [normalizar(teléfono) for teléfono in teléfonos]
+
+	variantes = {
+		'anterior': una_por_una(_normalizar_anterior),
+		'precompilado': una_por_una(_normalizar),
+		'memoizado': una_por_una(normalizador.normalizar),
+		'normalizar_varios': lambda: normalizador.normalizar_varios(teléfonos),
+	}
+
+	resultados = {nombre: round(_medir(función, llamadas, repeticiones), 1) for nombre, función in variantes.items()}
+
+	return {
+		'metadatos': {
+			'python': platform.python_version(),
+			'llamadas': llamadas,
+			'distintos': distintos,
+			'repeticiones': repeticiones,
+		},
+		'ns_por_llamada': resultados,
+		'aceleración': {
+			nombre: round(resultados['anterior'] / ns, 2) for nombre, ns in resultados.items() if nombre != 'anterior'
+		},
+	}
+
+def main(argv: Optional[list[str]] = None):
+	parser = argparse.ArgumentParser(description='Micro-benchmark de la normalización de teléfonos')
+	parser.add_argument('--llamadas', type=int, default=100_000, help='Teléfonos normalizados por repetición')
+	parser.add_argument('--distintos', type=int, default=500, help='Números distintos entre los teléfonos normalizados')
+	parser.add_argument('--repeticiones', type=int, default=5, help='Repeticiones medidas. Se informa la mejor')
+	args = parser.parse_args(argv)
+
+	if args.llamadas <= 0 or args.distintos <= 0:
+		parser.error('--llamadas y --distintos deben ser positivos')
+
+	print(json.dumps(correr(args.llamadas, args.distintos, args.repeticiones), ensure_ascii=False, indent='\t'))
+
+if __name__ == '__main__':
+	main()
@@ -1,19 +1,241 @@
+from functools import cache
 from os import getenv
+from typing import Annotated, AsyncIterator
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from fastapi import Depends
+from sqlalchemy import URL, Engine, create_engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 load_dotenv()
-pg_uri = getenv('POSTGRES_URI')
 
-if pg_uri is None:
-	raise LookupError('No se encontró POSTGRES_URI en el environment')
+def getenv_int(nombre: str, predeterminado: int) -> int:
+	"""Lee un entero del environment. Si la variable no está o está vacía, devuelve el valor predeterminado"""
 
-engine = create_engine(pg_uri)
-MakeSession = sessionmaker(bind=engine, expire_on_commit=False)
-Base = declarative_base()
+	valor = getenv(nombre)
+
+	if valor is None or len(valor.strip()) == 0:
+		return predeterminado
+
+	try:
+		return int(valor)
+	except ValueError as exc:
+		raise ValueError(f'{nombre} debe ser un entero. Recibido: {valor}') from exc
+
+def getenv_bool(nombre: str, predeterminado: bool) -> bool:
+	"""Lee un booleano del environment (0, false y no son falsos). Si no está o está vacía, devuelve el predeterminado"""
+
+	valor = getenv(nombre)
+
+	if valor is None or len(valor.strip()) == 0:
+		return predeterminado
+
+	return valor.strip().lower() not in ('0', 'false', 'no')
+
+def _opciones_pool() -> dict:
+	"""Opciones del pool de conexiones, configurables desde el environment"""
+
+	return {
+		'pool_size': getenv_int('POSTGRES_POOL_SIZE', 5),
+		'max_overflow': getenv_int('POSTGRES_MAX_OVERFLOW', 10),
+		'pool_timeout': getenv_int('POSTGRES_POOL_TIMEOUT', 30),
+		'pool_recycle': getenv_int('POSTGRES_POOL_RECYCLE', -1),
+		'pool_pre_ping': getenv_bool('POSTGRES_POOL_PRE_PING', True),
+	}
+
+def _statement_timeout() -> int:
+	"""Tiempo máximo de ejecución de cada sentencia en milisegundos. 0 deja el límite del servidor"""
+	return getenv_int('POSTGRES_STATEMENT_TIMEOUT_MS', 0)
+
+def obtener_pg_uri() -> str:
+	pg_uri = getenv('POSTGRES_URI')
+
+	if pg_uri is None:
+		raise LookupError('No se encontró POSTGRES_URI en el environment')
+
+	return pg_uri
+
+def obtener_pg_async_uri() -> str | URL:
+	# Por defecto, el engine asíncrono usa la misma BDD que POSTGRES_URI a través de asyncpg
+	return getenv('POSTGRES_ASYNC_URI') or make_url(obtener_pg_uri()).set(drivername='postgresql+asyncpg')
+
+def obtener_pg_read_uri() -> str | None:
+	"""URI de la réplica de lectura, o None si las lecturas van a la BDD principal"""
+	return getenv('POSTGRES_READ_URI') or None
+
+def obtener_pg_read_async_uri() -> str | URL | None:
+	pg_read_uri = obtener_pg_read_uri()
+
+	if pg_read_uri is None:
+		return None
+
+	return getenv('POSTGRES_READ_ASYNC_URI') or make_url(pg_read_uri).set(drivername='postgresql+asyncpg')
+
+# Los engines se construyen recién al usarse por primera vez, de modo que importar los módulos
+# (servidor, pruebas o herramientas) no requiere una BDD disponible
+
+def _crear_engine(pg_uri: str | URL) -> Engine:
+	statement_timeout = _statement_timeout()
+
+	return create_engine(
+		pg_uri,
+		connect_args={'options': f'-c statement_timeout={statement_timeout}'} if statement_timeout > 0 else {},
+		**_opciones_pool(),
+	)
+
+def _crear_engine_asíncrono(pg_async_uri: str | URL) -> AsyncEngine:
+	statement_timeout = _statement_timeout()
+
+	return create_async_engine(
+		pg_async_uri,
+		connect_args={'server_settings': {'statement_timeout': str(statement_timeout)}} if statement_timeout > 0 else {},
+		**_opciones_pool(),
+	)
+
+@cache
+def obtener_engine() -> Engine:
+	return _crear_engine(obtener_pg_uri())
+
+@cache
+def obtener_engine_asíncrono() -> AsyncEngine:
+	return _crear_engine_asíncrono(obtener_pg_async_uri())
+
+def hay_réplica() -> bool:
+	return obtener_pg_read_uri() is not None
+
+@cache
+def obtener_engine_lectura() -> Engine:
+	"""Engine de la réplica de lectura. Sin POSTGRES_READ_URI, es el mismo engine de la BDD principal"""
+
+	if not hay_réplica():
+		return obtener_engine()
+
+	return _crear_engine(obtener_pg_read_uri())
+
+@cache
+def obtener_engine_lectura_asíncrono() -> AsyncEngine:
+	if not hay_réplica():
+		return obtener_engine_asíncrono()
+
+	return _crear_engine_asíncrono(obtener_pg_read_async_uri())
+
+# Las sesiones de la réplica se marcan en Session.info, para que crud no guarde en las cachés del proceso
+# datos que pueden estar atrasados respecto de la BDD principal
+CLAVE_RÉPLICA = 'réplica'
+
+@cache
+def _fábrica_sesiones() -> sessionmaker[Session]:
+	return sessionmaker(bind=obtener_engine(), expire_on_commit=False)
+
+@cache
+def _fábrica_sesiones_asíncronas() -> async_sessionmaker[AsyncSession]:
+	return async_sessionmaker(bind=obtener_engine_asíncrono(), expire_on_commit=False)
+
+@cache
+def _fábrica_sesiones_lectura() -> sessionmaker[Session]:
+	if not hay_réplica():
+		return _fábrica_sesiones()
+
+	return sessionmaker(bind=obtener_engine_lectura(), expire_on_commit=False, info={CLAVE_RÉPLICA: True})
+
+@cache
+def _fábrica_sesiones_lectura_asíncronas() -> async_sessionmaker[AsyncSession]:
+	if not hay_réplica():
+		return _fábrica_sesiones_asíncronas()
+
+	return async_sessionmaker(bind=obtener_engine_lectura_asíncrono(), expire_on_commit=False, info={CLAVE_RÉPLICA: True})
+
+def MakeSession(**opciones) -> Session:
+	"""Abre una sesión sincrónica sobre el engine de POSTGRES_URI"""
+	return _fábrica_sesiones()(**opciones)
+
+def MakeAsyncSession(**opciones) -> AsyncSession:
+	"""Abre una sesión asíncrona sobre el engine de POSTGRES_ASYNC_URI"""
+	return _fábrica_sesiones_asíncronas()(**opciones)
+
+def MakeReadSession(**opciones) -> Session:
+	"""Abre una sesión sincrónica de solo lectura sobre la réplica de POSTGRES_READ_URI, o la BDD principal si no hay"""
+	return _fábrica_sesiones_lectura()(**opciones)
+
+def MakeAsyncReadSession(**opciones) -> AsyncSession:
+	"""Abre una sesión asíncrona de solo lectura sobre la réplica de POSTGRES_READ_URI, o la BDD principal si no hay"""
+	return _fábrica_sesiones_lectura_asíncronas()(**opciones)
+
+def __getattr__(nombre: str):
+	# Los nombres que antes se creaban al importar el módulo ahora se construyen al accederlos
+	perezosos = {
+		'engine': obtener_engine,
+		'async_engine': obtener_engine_asíncrono,
+		'pg_uri': obtener_pg_uri,
+		'pg_async_uri': obtener_pg_async_uri,
+		'pg_read_uri': obtener_pg_read_uri,
+		'statement_timeout': _statement_timeout,
+	}
+
+	if nombre in perezosos:
+		return perezosos[nombre]()
+
+	raise AttributeError(f'module {__name__!r} has no attribute {nombre!r}')
+
+async def obtener_sesion() -> AsyncIterator[AsyncSession]:
+	"""Dependencia de FastAPI que presta una sesión del pool por petición y la cierra al terminar, incluso ante errores"""
+
+	async with MakeAsyncSession() as session:
+		yield session
+
+async def obtener_sesion_lectura() -> AsyncIterator[AsyncSession]:
+	"""Como obtener_sesion, pero sobre la réplica de lectura. Solo para endpoints que no escriben en la BDD"""
+
+	async with MakeAsyncReadSession() as session:
+		yield session
+
+SesiónBDD = Annotated[AsyncSession, Depends(obtener_sesion)]
+SesiónLectura = Annotated[AsyncSession, Depends(obtener_sesion_lectura)]
+
+def _estado_pool(engine_pool: Engine) -> dict[str, int]:
+	pool = engine_pool.pool
+
+	return {
+		'tamaño': pool.size(),
+		'disponibles': pool.checkedin(),
+		'en_uso': pool.checkedout(),
+		'desborde': pool.overflow(),
+	}
+
+def estado_pools() -> dict[str, dict[str, int]]:
+	"""Devuelve el uso actual de los pools de conexiones sincrónico y asíncrono, y los de la réplica de lectura si hay"""
+
+	estado = {
+		'sincrónico': _estado_pool(obtener_engine()),
+		'asíncrono': _estado_pool(obtener_engine_asíncrono().sync_engine),
+	}
+
+	if hay_réplica():
+		estado['réplica_sincrónico'] = _estado_pool(obtener_engine_lectura())
+		estado['réplica_asíncrono'] = _estado_pool(obtener_engine_lectura_asíncrono().sync_engine)
+
+	return estado
 
 def create_models():
-	"""Crea todos los modelos definidos para la base de datos"""
-	Base.metadata.create_all(engine)
+	"""
+	Crea todos los modelos definidos para la base de datos que todavía no existan.
+	En BDDs administradas con migraciones, usar `alembic upgrade head` en su lugar
+	"""
+	from .models import Base as BaseModelos
+	BaseModelos.metadata.create_all(obtener_engine())
+
+async def cerrar_engines():
+	"""Cierra las conexiones de los pools de los engines que se hayan construido"""
+
+	if hay_réplica():
+		if obtener_engine_lectura_asíncrono.cache_info().currsize > 0:
+			await obtener_engine_lectura_asíncrono().dispose()
+
+		if obtener_engine_lectura.cache_info().currsize > 0:
+			obtener_engine_lectura().dispose()
+
+	if obtener_engine_asíncrono.cache_info().currsize > 0:
+		await obtener_engine_asíncrono().dispose()
+
+	if obtener_engine.cache_info().currsize > 0:
+		obtener_engine().dispose()
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional
+from . import getenv_int
+from .schemas import CanchaSchema
+
+class CachéCanchas:
+	"""
+	Caché en memoria del proceso de las Canchas leídas de la BDD, con vencimiento por tiempo (TTL)
+	y desalojo de la entrada usada hace más tiempo (LRU) al superar la capacidad máxima.
+	Guarda instantáneas inmutables (CanchaSchema) para que puedan compartirse entre sesiones.
+	"""
+
+	def __init__(self, ttl_segundos: float, capacidad: int, reloj: Callable[[], float] = monotonic):
+		self.ttl_segundos = ttl_segundos
+		self.capacidad = capacidad
+		self._reloj = reloj
+		self._entradas: OrderedDict[int, tuple[float, CanchaSchema]] = OrderedDict()
+		self._lock = Lock()
+
+	def obtener(self,
+		id_cancha: int,
+		cargar: Callable[[int], Optional[CanchaSchema]],
+		guardar: bool = True,
+	) -> CanchaSchema | None:
+		"""
+		Devuelve la Cancha de la caché o, si no está o venció, la carga con la función indicada y la guarda.
+		Con guardar en False, la Cancha cargada no se guarda (p.ej.: si se leyó de una réplica que puede estar atrasada)
+		"""
+
+		cancha = self.consultar(id_cancha)
+
+		if cancha is not None:
+			return cancha
+
+		cancha = cargar(id_cancha)
+
+		# Las Canchas inexistentes no se guardan, para no ocultar una que se cree luego desde otro proceso
+		if cancha is not None and guardar:
+			self.guardar(cancha)
+
+		return cancha
+
+	def consultar(self, id_cancha: int) -> CanchaSchema | None:
+		"""Devuelve la Cancha de la caché, o None si no está o venció"""
+
+		with self._lock:
+			entrada = self._entradas.get(id_cancha)
+
+			if entrada is None:
+				return None
+
+			vencimiento, cancha = entrada
+
+			if vencimiento > self._reloj():
+				self._entradas.move_to_end(id_cancha)
+				return cancha
+
+			del self._entradas[id_cancha]
+			return None
+
+	def guardar(self, cancha: CanchaSchema):
+		"""Guarda o reemplaza la instantánea de una Cancha"""
+
+		if self.capacidad <= 0 or self.ttl_segundos <= 0:
+			return
+
+		with self._lock:
+			self._entradas[cancha.id] = (self._reloj() + self.ttl_segundos, cancha)
+			self._entradas.move_to_end(cancha.id)
+
+			while len(self._entradas) > self.capacidad:
+				self._entradas.popitem(last=False)
+
+	def invalidar(self, id_cancha: int):
+		"""Descarta la entrada de una Cancha modificada o eliminada"""
+
+		with self._lock:
+			self._entradas.pop(id_cancha, None)
+
+	def limpiar(self):
+		"""Vacía la caché"""
+
+		with self._lock:
+			self._entradas.clear()
+
+	def __len__(self) -> int:
+		return len(self._entradas)
+
+caché_canchas = CachéCanchas(
+	ttl_segundos=getenv_int('CACHE_CANCHAS_TTL_SEGUNDOS', 300),
+	capacidad=getenv_int('CACHE_CANCHAS_CAPACIDAD', 1024),
+)
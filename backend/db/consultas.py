@@ -0,0 +1,387 @@
+"""
+Sentencias parametrizadas para los filtros de Canchas, Reservas y series de Reservas.
+Cada sentencia depende solo de la forma de los filtros (cuáles se usan y si son un valor o un rango), así que se
+construye una vez por forma y se reutiliza con distintos parámetros. Al reutilizar el mismo objeto, SQLAlchemy
+tampoco vuelve a calcular su clave de caché ni a compilarla
+"""
+
+from datetime import date, datetime
+from functools import cache
+from typing import Literal, NamedTuple, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import Delete, Select, and_, bindparam, delete, select, tuple_
+from .models import Cancha, Reserva, SerieReserva
+from .schemas import CanchaSchema, ReservaSchema
+
+TipoCriterio = Optional[Literal['valor', 'rango']]
+# Qué devuelve un borrado: las entidades del ORM, filas planas con los campos del esquema o solo las IDs
+TipoDevolución = Literal['entidades', 'filas', 'ids']
+
+# Columnas que se leen como filas planas, en el orden de los campos de sus esquemas
+CAMPOS_RESERVA = tuple(ReservaSchema.model_fields)
+CAMPOS_CANCHA = tuple(CanchaSchema.model_fields)
+
+_DESCRIPCIÓN_TIPOS = {
+	int: ('un entero', 'dos enteros'),
+	date: ('una fecha', 'dos fechas'),
+}
+
+def patrón_ilike(texto: str) -> str:
+	"""Traduce el comodín * de las búsquedas por nombre al % de ILIKE, escapando los _ para que no actúen como comodín"""
+	return str(texto).replace('*', '%').replace('_', r'\_')
+
+def tipo_criterio(argumento, tipo: type) -> TipoCriterio:
+	"""Verifica que un criterio sea un valor del tipo indicado o una tupla de 2 (rango) e indica cuál de los 2 es"""
+
+	if argumento is None:
+		return None
+
+	uno, dos = _DESCRIPCIÓN_TIPOS[tipo]
+
+	if isinstance(argumento, tuple):
+		if len(argumento) != 2 or not isinstance(argumento[0], tipo) or not isinstance(argumento[1], tipo):
+			raise HTTPException(
+				status.HTTP_400_BAD_REQUEST,
+				f'Este criterio debe ser {uno} o una tupla de {dos} (rango). Recibido: {argumento=}',
+			)
+
+		return 'rango'
+
+	if isinstance(argumento, tipo):
+		return 'valor'
+
+	raise HTTPException(
+		status.HTTP_400_BAD_REQUEST,
+		f'Este criterio debe ser {uno} o una tupla de {dos} (rango). Recibido: {argumento=}',
+	)
+
+def _a_fecha(valor: date) -> date:
+	# Los días pueden llegar como datetime desde la consulta, pero la columna es de tipo fecha
+	return valor.date() if isinstance(valor, datetime) else valor
+
+class FiltrosReservas(NamedTuple):
+	"""Forma de los filtros de Reservas o series: qué criterios se usan y, si lo admiten, si son un valor o un rango"""
+
+	id_cancha: bool = False
+	dia: TipoCriterio = None
+	hora: TipoCriterio = None
+	duración_minutos: TipoCriterio = None
+	teléfono: bool = False
+	nombre_contacto: bool = False
+	nombre_cancha: bool = False
+
+def filtros_reservas(
+	id_cancha: Optional[int] = None,
+	dia: Optional[date | tuple[date, date]] = None,
+	hora: Optional[int | tuple[int, int]] = None,
+	duración_minutos: Optional[int | tuple[int, int]] = None,
+	teléfono: Optional[str] = None,
+	nombre_contacto: Optional[str] = None,
+	nombre_cancha: Optional[str] = None,
+) -> tuple[FiltrosReservas, dict]:
+	"""
+	Devuelve la forma de los filtros indicados y los parámetros con los que se ejecuta la sentencia correspondiente.
+	El teléfono ya debe estar normalizado
+	"""
+
+	parámetros = {}
+	filtros = FiltrosReservas(
+		id_cancha=id_cancha is not None,
+		dia=tipo_criterio(dia, date),
+		hora=tipo_criterio(hora, int),
+		duración_minutos=tipo_criterio(duración_minutos, int),
+		teléfono=teléfono is not None,
+		nombre_contacto=nombre_contacto is not None,
+		nombre_cancha=nombre_cancha is not None,
+	)
+
+	if filtros.id_cancha:
+		parámetros['id_cancha'] = id_cancha
+
+	if filtros.dia == 'rango':
+		parámetros['dia_min'], parámetros['dia_max'] = _a_fecha(dia[0]), _a_fecha(dia[1])
+	elif filtros.dia == 'valor':
+		parámetros['dia_min'] = parámetros['dia_max'] = _a_fecha(dia)
+
+	for nombre, argumento, tipo in (
+		('hora', hora, filtros.hora),
+		('duracion', duración_minutos, filtros.duración_minutos),
+	):
+		if tipo == 'rango':
+			parámetros[f'{nombre}_min'], parámetros[f'{nombre}_max'] = argumento
+		elif tipo == 'valor':
+			parámetros[nombre] = argumento
+
+	if filtros.teléfono:
+		parámetros['telefono'] = teléfono
+
+	if filtros.nombre_contacto:
+		parámetros['nombre_contacto'] = patrón_ilike(nombre_contacto)
+
+	if filtros.nombre_cancha:
+		parámetros['nombre_cancha'] = patrón_ilike(nombre_cancha)
+
+	return filtros, parámetros
+
+def parámetros_rango(rango: tuple[int, int]) -> dict:
+	"""Parámetros de desplazamiento y cantidad de un rango de resultados (qmin, qmax)"""
+	return {'desplazamiento': rango[0], 'cantidad': rango[1] - rango[0]}
+
+def _criterio_rango_u_valor(columna, nombre: str, tipo: TipoCriterio):
+	if tipo == 'rango':
+		return and_(columna >= bindparam(f'{nombre}_min'), columna <= bindparam(f'{nombre}_max'))
+
+	return columna == bindparam(nombre)
+
+def _criterios(filtros: FiltrosReservas, modelo: type[Reserva] | type[SerieReserva]) -> list:
+	"""Criterios comunes a Reservas y series, salvo el de día, que se compara distinto en cada una"""
+
+	criterios = []
+
+	if filtros.id_cancha:
+		criterios.append(modelo.id_cancha == bindparam('id_cancha'))
+
+	if filtros.hora:
+		criterios.append(_criterio_rango_u_valor(modelo.hora, 'hora', filtros.hora))
+
+	if filtros.duración_minutos:
+		criterios.append(_criterio_rango_u_valor(modelo.duración_minutos, 'duracion', filtros.duración_minutos))
+
+	if filtros.teléfono:
+		criterios.append(modelo.teléfono == bindparam('telefono'))
+
+	if filtros.nombre_contacto:
+		criterios.append(modelo.nombre_contacto.ilike(bindparam('nombre_contacto'), escape='\\'))
+
+	if filtros.nombre_cancha:
+		criterios.append(Cancha.nombre.ilike(bindparam('nombre_cancha'), escape='\\'))
+
+	return criterios
+
+def _criterios_reservas(filtros: FiltrosReservas) -> list:
+	criterios = _criterios(filtros, Reserva)
+
+	if filtros.dia:
+		criterios.append(and_(Reserva.dia >= bindparam('dia_min'), Reserva.dia <= bindparam('dia_max')))
+
+	return criterios
+
+@cache
+def sentencia_reservas(
+	filtros: FiltrosReservas,
+	full: bool = False,
+	rango: bool = False,
+	paginada: bool = False,
+	después_de: bool = False,
+	filas: bool = False,
+) -> Select:
+	"""
+	Consulta de Reservas para una forma de filtros. Con rango, recibe además desplazamiento y cantidad.
+	Paginada, recibe límite y, con después_de, la clave despues_dia, despues_hora, despues_id.
+	Con filas, selecciona las columnas de CAMPOS_RESERVA (y de CAMPOS_CANCHA si es full) en lugar de entidades
+	"""
+
+	if filas:
+		columnas = [getattr(Reserva, campo) for campo in CAMPOS_RESERVA]
+
+		if full:
+			columnas += [getattr(Cancha, campo).label(f'cancha_{campo}') for campo in CAMPOS_CANCHA]
+
+		stmt = select(*columnas)
+
+		if full or filtros.nombre_cancha:
+			stmt = stmt.join(Reserva.cancha)
+	else:
+		stmt = select(Reserva) if not full and not filtros.nombre_cancha else (
+			select(Reserva, Cancha)
+			.join(Reserva.cancha)
+		)
+
+	criterios = _criterios_reservas(filtros)
+
+	if len(criterios) > 0:
+		stmt = stmt.where(and_(*criterios))
+
+	if rango:
+		stmt = (stmt
+			.order_by(Reserva.id)
+			.offset(bindparam('desplazamiento'))
+			.limit(bindparam('cantidad'))
+		)
+
+	if paginada:
+		if después_de:
+			stmt = stmt.where(
+				tuple_(Reserva.dia, Reserva.hora, Reserva.id)
+				> tuple_(bindparam('despues_dia'), bindparam('despues_hora'), bindparam('despues_id'))
+			)
+
+		stmt = stmt.order_by(Reserva.dia, Reserva.hora, Reserva.id).limit(bindparam('limite'))
+
+	return stmt
+
+def _limitar_borrado(subselect: Select, modelo: type[Reserva] | type[Cancha], rango: bool, lote: bool) -> Select:
+	if rango:
+		subselect = (subselect
+			.order_by(modelo.id)
+			.offset(bindparam('desplazamiento'))
+			.limit(bindparam('cantidad'))
+		)
+
+	if lote:
+		subselect = subselect.order_by(modelo.id).limit(bindparam('lote'))
+
+	return subselect
+
+def _devolución_borrado(
+	subselect: Select,
+	modelo: type[Reserva] | type[Cancha],
+	campos: tuple[str, ...],
+	devolver: TipoDevolución,
+) -> Delete:
+	stmt = delete(modelo).where(modelo.id.in_(subselect))
+
+	if devolver == 'entidades':
+		return stmt.returning(modelo).execution_options(synchronize_session='fetch')
+
+	# Sin entidades no hay objetos de la sesión que sincronizar
+	columnas = [getattr(modelo, campo) for campo in campos] if devolver == 'filas' else [modelo.id]
+	return stmt.returning(*columnas).execution_options(synchronize_session=False)
+
+@cache
+def sentencia_borrar_reservas(
+	filtros: FiltrosReservas,
+	rango: bool = False,
+	lote: bool = False,
+	devolver: TipoDevolución = 'entidades',
+) -> Delete:
+	"""
+	Borrado de las Reservas que coinciden con una forma de filtros, que devuelve lo indicado en devolver.
+	Con lote, borra como mucho el parámetro lote de Reservas, las de menor ID
+	"""
+
+	subselect = select(Reserva.id)
+
+	if filtros.nombre_cancha:
+		subselect = subselect.join(Cancha, Cancha.id == Reserva.id_cancha)
+
+	criterios = _criterios_reservas(filtros)
+
+	if len(criterios) > 0:
+		subselect = subselect.where(and_(*criterios))
+
+	return _devolución_borrado(_limitar_borrado(subselect, Reserva, rango, lote), Reserva, CAMPOS_RESERVA, devolver)
+
+@cache
+def sentencia_series(filtros: FiltrosReservas) -> Select:
+	"""Consulta de las series, junto a su Cancha, con alguna ocurrencia que pueda cumplir unos filtros de Reservas"""
+
+	stmt = select(SerieReserva, Cancha).join(SerieReserva.cancha)
+	criterios = _criterios(filtros, SerieReserva)
+
+	if filtros.dia:
+		criterios.append(and_(SerieReserva.dia_inicio <= bindparam('dia_max'), SerieReserva.hasta >= bindparam('dia_min')))
+
+	if len(criterios) > 0:
+		stmt = stmt.where(and_(*criterios))
+
+	return stmt
+
+@cache
+def sentencia_reservas_por_teléfono(próximas: bool) -> Select:
+	"""
+	Reservas de un teléfono desde el día indicado, en orden cronológico, o anteriores a él,
+	de la más reciente a la más antigua.
+	Ambas recorren ix_reservas_telefono_dia_hora en un sentido y se detienen al alcanzar el límite
+	"""
+
+	stmt = select(Reserva).where(Reserva.teléfono == bindparam('telefono'))
+
+	if próximas:
+		stmt = stmt.where(Reserva.dia >= bindparam('desde')).order_by(Reserva.dia, Reserva.hora)
+	else:
+		stmt = stmt.where(Reserva.dia < bindparam('desde')).order_by(Reserva.dia.desc(), Reserva.hora.desc())
+
+	return stmt.limit(bindparam('limite'))
+
+class FiltrosCanchas(NamedTuple):
+	nombre: bool = False
+	techada: bool = False
+
+def filtros_canchas(nombre: Optional[str] = None, techada: Optional[bool] = None) -> tuple[FiltrosCanchas, dict]:
+	"""Devuelve la forma de los filtros de Canchas indicados y los parámetros de la sentencia correspondiente"""
+
+	filtros = FiltrosCanchas(nombre=nombre is not None, techada=techada is not None)
+	parámetros = {}
+
+	if filtros.nombre:
+		parámetros['nombre'] = patrón_ilike(nombre)
+
+	if filtros.techada:
+		parámetros['techada'] = techada
+
+	return filtros, parámetros
+
+def _criterios_canchas(filtros: FiltrosCanchas) -> list:
+	criterios = []
+
+	if filtros.nombre:
+		criterios.append(Cancha.nombre.ilike(bindparam('nombre'), escape='\\'))
+
+	if filtros.techada:
+		criterios.append(Cancha.techada == bindparam('techada'))
+
+	return criterios
+
+@cache
+def sentencia_canchas(
+	filtros: FiltrosCanchas,
+	rango: bool = False,
+	paginada: bool = False,
+	después_de: bool = False,
+) -> Select:
+	"""
+	Consulta de Canchas para una forma de filtros. Con rango, recibe además desplazamiento y cantidad.
+	Paginada, recibe límite y, con después_de, la ID despues_id
+	"""
+
+	stmt = select(Cancha)
+	criterios = _criterios_canchas(filtros)
+
+	if len(criterios) > 0:
+		stmt = stmt.where(and_(*criterios))
+
+	if rango:
+		stmt = (stmt
+			.order_by(Cancha.id)
+			.offset(bindparam('desplazamiento'))
+			.limit(bindparam('cantidad'))
+		)
+
+	if paginada:
+		if después_de:
+			stmt = stmt.where(Cancha.id > bindparam('despues_id'))
+
+		stmt = stmt.order_by(Cancha.id).limit(bindparam('limite'))
+
+	return stmt
+
+@cache
+def sentencia_borrar_canchas(
+	filtros: FiltrosCanchas,
+	rango: bool = False,
+	lote: bool = False,
+	devolver: TipoDevolución = 'entidades',
+) -> Delete:
+	"""
+	Borrado de las Canchas que coinciden con una forma de filtros, que devuelve lo indicado en devolver.
+	Con lote, borra como mucho el parámetro lote de Canchas, las de menor ID. Sus Reservas y series se borran en cascada
+	"""
+
+	subselect = select(Cancha.id)
+	criterios = _criterios_canchas(filtros)
+
+	if len(criterios) > 0:
+		subselect = subselect.where(and_(*criterios))
+
+	return _devolución_borrado(_limitar_borrado(subselect, Cancha, rango, lote), Cancha, CAMPOS_CANCHA, devolver)
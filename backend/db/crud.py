@@ -1,11 +1,38 @@
-import re
-from datetime import date, timedelta
-from typing import Optional
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime, time, timedelta
+from functools import cache, partial
+from typing import Callable, Iterable, Iterator, Optional
 from fastapi import HTTPException, status
-from sqlalchemy import select, delete, and_, or_
-from sqlalchemy.orm import Session as _Session, Mapped as _Mapped
-from .models import Cancha, Reserva, ReservaCompleta
-from .schemas import CanchaCreate, ReservaCreate
+from sqlalchemy import (
+	ColumnElement, Date, DateTime, Delete, Integer, Row, Select, select, insert, update, and_, cast, column, exists,
+	extract, func, literal, true, tuple_,
+)
+from sqlalchemy.dialects.postgresql import TSRANGE, Range, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as _Session, make_transient_to_detached
+from . import CLAVE_RÉPLICA, consultas, series_reservas
+from .cache import caché_canchas
+from .models import Cancha, OcurrenciaSerie, Reserva, ReservaCompleta, SerieReserva, VersiónTabla
+from .ocupacion import MINUTOS_DIA, buscar_solapamientos, minuto_absoluto
+from .schemas import (
+	CanchaCreate, CanchaSchema, ReservaCreate, SerieReservaCreate, ResultadoReservaLote, DisponibilidadCancha,
+	HuecoDisponible, EstadísticaOcupación, GrillaCancha, GrillaDía,
+)
+from .telefonos import normalizador_teléfonos, verificar_y_normalizar_teléfono
+
+_MÁXIMO_INTERVALO_DISPONIBILIDAD = timedelta(days=31)
+_MÁXIMO_RESERVAS_POR_TELÉFONO = 100
+AGRUPAMIENTOS_ESTADÍSTICAS = ('cancha', 'dia', 'dia_semana', 'hora')
+# Divisores de los minutos de un día, para que las franjas de la grilla no crucen la medianoche
+RESOLUCIONES_GRILLA = (1, 5, 10, 15, 30, 60)
+
+# SQLSTATE que devuelve Postgres cuando se viola una restricción EXCLUDE (reservas_sin_solapamiento)
+_PGCODE_VIOLACIÓN_EXCLUSIÓN = '23P01'
+# SQLSTATE de una clave foránea inexistente, p.ej.: una Cancha eliminada desde otro proceso
+_PGCODE_VIOLACIÓN_CLAVE_FORÁNEA = '23503'
+# Primera clave de los bloqueos consultivos sobre los horarios de una Cancha. La segunda es la ID de la Cancha
+_CLASE_BLOQUEO_HORARIOS = 1
 
 def qparams_a_rango(qmin: Optional[int] = None, qmax: Optional[int] = None) -> tuple[int, int] | None:
 	if qmax is None and qmin is None:
@@ -25,161 +52,225 @@ def qparams_a_rango(qmin: Optional[int] = None, qmax: Optional[int] = None) -> t
 
 	return (qmin, qmax)
 
-def verificar_horario_reserva(
-	session: _Session,
-	id_cancha: int,
-	dia: date,
-	hora: int,
-	duración_minutos: int,
-	id_reserva: Optional[int] = None,
-):
-	if not isinstance(id_cancha, int):
+def canchas_a_ids(canchas: Optional[str]) -> list[int] | None:
+	"""Interpreta una lista de IDs de Canchas separadas por comas, como la del parámetro canchas de los endpoints"""
+
+	if canchas is None:
+		return None
+
+	try:
+		return [int(id_cancha) for id_cancha in canchas.split(',')]
+	except ValueError as exc:
 		raise HTTPException(
 			status.HTTP_400_BAD_REQUEST,
-			'Debes especificar el la ID de la cancha que se reserva como un entero',
-		)
+			f'Las canchas deben indicarse como IDs enteras separadas por comas ({canchas=})',
+		) from exc
 
-	if not isinstance(dia, date):
+def verificar_devolución_borrado(devolver: str, permitidas: tuple[str, ...]):
+	if devolver not in permitidas:
 		raise HTTPException(
 			status.HTTP_400_BAD_REQUEST,
-			'Debes especificar el día de la reserva como un entero',
+			f'devolver debe ser uno de: {", ".join(permitidas)}. Recibido: {devolver}',
 		)
 
-	if session.query(Cancha).get(id_cancha) is None:
-		raise HTTPException(
-			status.HTTP_404_NOT_FOUND,
-			'La ID de cancha especificada no existe',
-		)
+def clave_a_cursor(*clave: int | date) -> str:
+	"""Codifica la clave de ordenamiento del último elemento de una página como un cursor opaco"""
 
-	if not isinstance(hora, int) or hora < 0 or hora >= 24:
-		raise HTTPException(
-			status.HTTP_400_BAD_REQUEST,
-			'La hora de reserva debe seguir el formato de 24 horas (0 <= x < 24)',
-		)
+	valores = [valor.isoformat() if isinstance(valor, date) else valor for valor in clave]
+	return urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+def cursor_a_clave(cursor: Optional[str], tipos: tuple[type, ...]) -> tuple | None:
+	"""Decodifica un cursor generado por clave_a_cursor, verificando que sus valores sean de los tipos indicados"""
+
+	if cursor is None:
+		return None
+
+	try:
+		valores = json.loads(urlsafe_b64decode(cursor.encode()))
 
-	dia_entero_minutos: int = 60 * 24
+		if not isinstance(valores, list) or len(valores) != len(tipos):
+			raise ValueError(valores)
 
-	if not isinstance(duración_minutos, int) or duración_minutos <= 0 or duración_minutos >= dia_entero_minutos:
+		return tuple(
+			date.fromisoformat(valor) if tipo is date else tipo(valor)
+			for tipo, valor in zip(tipos, valores)
+		)
+	except (ValueError, TypeError) as exc:
 		raise HTTPException(
 			status.HTTP_400_BAD_REQUEST,
-			'La duración en minutos debe ser un número positivo y no puede ser un día entero o más',
-		)
+			f'El cursor de paginación recibido no es válido ({cursor=})',
+		) from exc
 
-	minuto_inicio = 60 * hora
-	minuto_fin = minuto_inicio + duración_minutos
-	dia_siguiente = dia + timedelta(days=1)
+def _verificar_paginación(rango: Optional[tuple[int, int]], límite: Optional[int], después_de) -> bool:
+	"""Indica si se pidió paginar por cursor, verificando que no se combine con un rango por desplazamiento"""
 
-	termina_mismo_dia = minuto_fin < dia_entero_minutos
+	if límite is None:
+		if después_de is not None:
+			raise HTTPException(
+				status.HTTP_400_BAD_REQUEST,
+				'Debes indicar un límite de resultados por página para paginar con un cursor',
+			)
 
-	conflicto_mismo_dia = and_(
-		Reserva.dia == dia,
-		(60 * Reserva.hora) < minuto_fin,
-		(60 * Reserva.hora + Reserva.duración_minutos) > minuto_inicio,
-	)
-	conflicto_entre_dias = and_(
-		Reserva.dia == dia_siguiente,
-		Reserva.hora < minuto_fin - dia_entero_minutos,
-		(60 * Reserva.hora + Reserva.duración_minutos) > minuto_inicio - dia_entero_minutos,
-	)
+		return False
 
-	stmt = (
-		select(Reserva)
-		.filter(Reserva.id_cancha == id_cancha)
-	)
+	if not isinstance(límite, int) or límite <= 0:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El límite de resultados por página debe ser un entero positivo',
+		)
 
-	if termina_mismo_dia:
-		stmt = stmt.filter(conflicto_mismo_dia)
-	else:
-		stmt = stmt.filter(or_(conflicto_mismo_dia, conflicto_entre_dias))
+	if rango is not None:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'No puedes combinar un rango de resultados (qmin/qmax) con la paginación por cursor',
+		)
 
-	if id_reserva is not None:
-		stmt = stmt.filter(Reserva.id != id_reserva)
+	return True
 
-	conflictos = list(session.execute(stmt).scalars().all())
+def _verificar_valores_horario(
+	id_cancha: Optional[int],
+	dia: Optional[date],
+	hora: Optional[int],
+	duración_minutos: Optional[int],
+	parcial: bool = False,
+):
+	"""Verifica los valores del horario de una Reserva. Si parcial es True, los valores None no se verifican"""
 
-	if len(conflictos) > 0:
+	if not isinstance(id_cancha, int) and not (parcial and id_cancha is None):
 		raise HTTPException(
-			status.HTTP_409_CONFLICT,
-			'Registrar esta reserva haría que 2 reservas se solapen temporalmente',
+			status.HTTP_400_BAD_REQUEST,
+			'Debes especificar el la ID de la cancha que se reserva como un entero',
 		)
 
-def verificar_y_normalizar_teléfono(teléfono) -> str:
-	if not isinstance(teléfono, str):
+	if not isinstance(dia, date) and not (parcial and dia is None):
 		raise HTTPException(
 			status.HTTP_400_BAD_REQUEST,
-			'El número de teléfono debe ser un string',
+			'Debes especificar el día de la reserva como un entero',
 		)
 
-	teléfono = teléfono.strip()
+	if (not isinstance(hora, int) or hora < 0 or hora >= 24) and not (parcial and hora is None):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'La hora de reserva debe seguir el formato de 24 horas (0 <= x < 24)',
+		)
 
-	if len(teléfono) == 0:
+	if (
+		(not isinstance(duración_minutos, int) or duración_minutos <= 0 or duración_minutos >= MINUTOS_DIA)
+		and not (parcial and duración_minutos is None)
+	):
 		raise HTTPException(
 			status.HTTP_400_BAD_REQUEST,
-			'El número de teléfono debe ser un string y no puede estar vacío',
+			'La duración en minutos debe ser un número positivo y no puede ser un día entero o más',
 		)
 
-	partes = re.match(
-		pattern=r'^(?:(\+\d{1,2})\s?)?(?:(\d)\s?)?\(?(\d{3})\)?[\s.-]?(\d{3})[\s.-]?(\d{4})$',
-		string=teléfono,
+def _insertar_reservas_lote(session: _Session, aceptadas: list[tuple[int, ReservaCreate, str]]) -> list[int]:
+	"""
+	Inserta las Reservas aceptadas de un lote, confirma la transacción y devuelve sus IDs en el mismo orden.
+	Si la restricción de exclusión de Reserva.periodo rechaza el INSERT, deshace la transacción y propaga el error
+	"""
+
+	valores = [
+		{
+			'id_cancha': reserva.id_cancha,
+			'dia': reserva.dia,
+			'hora': reserva.hora,
+			'duración_minutos': reserva.duración_minutos,
+			'teléfono': teléfono,
+			'nombre_contacto': reserva.nombre_contacto,
+		}
+		for _, reserva, teléfono in aceptadas
+	]
+
+	try:
+		# Un único INSERT para todo el lote. SQLAlchemy lo agrupa en sentencias de múltiples filas con RETURNING
+		stmt = insert(Reserva).returning(Reserva.id, sort_by_parameter_order=True)
+		ids = session.execute(stmt, valores).scalars().all()
+
+		_registrar_cambios(session, Reserva.__tablename__)
+		session.commit()
+	except IntegrityError as exc:
+		session.rollback()
+
+		if getattr(exc.orig, 'pgcode', None) == _PGCODE_VIOLACIÓN_CLAVE_FORÁNEA:
+			# La caché todavía tenía una Cancha que ya no existe en la BDD
+			for _, reserva, _ in aceptadas:
+				caché_canchas.invalidar(reserva.id_cancha)
+
+			raise HTTPException(
+				status.HTTP_404_NOT_FOUND,
+				'La ID de cancha especificada no existe',
+			) from exc
+
+		raise
+
+	return ids
+
+@cache
+def _sentencia_registrar_cambios(tablas: tuple[str, ...]):
+	stmt = pg_insert(VersiónTabla).values([
+		{'tabla': tabla, 'versión': 1, 'modificada': func.clock_timestamp()}
+		for tabla in tablas
+	])
+
+	return stmt.on_conflict_do_update(
+		index_elements=[VersiónTabla.tabla],
+		set_={'versión': VersiónTabla.versión + 1, 'modificada': stmt.excluded.modificada},
 	)
 
-	if partes is None:
-		raise HTTPException(
-			status.HTTP_422_UNPROCESSABLE_ENTITY,
-			f'"{teléfono}" no es un número de teléfono válido. Debe seguir la forma "(+XX)? (X)? XXX XXX-XXXX" o similares',
-		)
+def _sentencia_registrar_cambios_si(tabla: str, condición: ColumnElement[bool]):
+	"""Como _sentencia_registrar_cambios, pero solo incrementa la versión si se cumple la condición (p.ej.: en un CTE)"""
 
-	return ''.join(partes[i] if partes[i] is not None else '' for i in range(1, 6))
+	stmt = pg_insert(VersiónTabla).from_select(
+		['tabla', 'versión', 'modificada'],
+		select(literal(tabla), literal(1), func.clock_timestamp()).where(condición),
+	)
 
-def _agregar_criterio_de_rango_u_valor_int(
-	criterios: list,
-	columna: _Mapped[int],
-	argumento: Optional[int | tuple[int, int]] = None,
-):
-	if argumento is None:
-		return
+	return stmt.on_conflict_do_update(
+		index_elements=[VersiónTabla.tabla],
+		set_={'versión': VersiónTabla.versión + 1, 'modificada': stmt.excluded.modificada},
+	)
 
-	if isinstance(argumento, tuple):
-		if(not isinstance(argumento[0], int)
-		or not isinstance(argumento[1], int)):
-			raise HTTPException(
-				status.HTTP_400_BAD_REQUEST,
-				f'Este criterio debe ser un entero o una tupla de dos enteros (rango). Recibido: {argumento=}',
-			)
+def _registrar_cambios(session: _Session, *tablas: str):
+	"""
+	Incrementa la versión de las tablas indicadas en la transacción de la escritura. Se llama justo antes de confirmarla,
+	para retener poco el bloqueo de las filas de versiones, y la versión nueva se vuelve visible junto con los datos
+	"""
 
-		criterios.append(and_(argumento[0] <= columna, columna <= argumento[1]))
-	elif isinstance(argumento, int):
-		criterios.append(columna == argumento)
-	else:
-		raise HTTPException(
-			status.HTTP_400_BAD_REQUEST,
-			f'Este criterio debe ser un entero o una tupla de dos enteros (rango). Recibido: {argumento=}'
-		)
+	# Ordenar las tablas evita que 2 escrituras concurrentes bloqueen sus filas en orden inverso
+	session.execute(_sentencia_registrar_cambios(tuple(sorted(set(tablas)))))
 
-def _agregar_criterio_de_rango_u_valor_date(
-	criterios: list,
-	columna: _Mapped[date],
-	argumento: Optional[date | tuple[date, date]] = None,
-):
-	if argumento is None:
-		return
+def get_versiones(session: _Session, *tablas: str) -> dict[str, tuple[int, datetime | None]]:
+	"""
+	Devuelve la versión y el momento del último cambio de cada tabla indicada. Las que nunca cambiaron tienen versión 0
+	"""
 
-	if isinstance(argumento, tuple):
-		if(not isinstance(argumento[0], date)
-		or not isinstance(argumento[1], date)):
-			raise HTTPException(
-				status.HTTP_400_BAD_REQUEST,
-				f'Este criterio debe ser una fecha o una tupla de dos fechas (rango). Recibido: {argumento=}',
-			)
+	versiones = {tabla: (0, None) for tabla in tablas}
+	stmt = select(VersiónTabla).where(VersiónTabla.tabla.in_(tablas))
 
-		criterios.append(and_(argumento[0] <= columna, columna <= argumento[1]))
-	elif isinstance(argumento, date):
-		criterios.append(columna == argumento)
-	else:
-		raise HTTPException(
-			status.HTTP_400_BAD_REQUEST,
-			f'Este criterio debe ser una fecha o una tupla de dos fechas (rango). Recibido: {argumento=}'
-		)
+	for versión in session.execute(stmt).scalars():
+		versiones[versión.tabla] = (versión.versión, versión.modificada)
+
+	return versiones
+
+def _bloquear_horarios(session: _Session, ids_cancha: Iterable[int], exclusivo: bool = False) -> list[int]:
+	"""
+	Bloquea los horarios de las Canchas indicadas hasta el fin de la transacción y devuelve, ordenadas, las IDs de las
+	que existen. La restricción de exclusión no cubre las ocurrencias de las series, así que las escrituras de Reservas
+	toman el bloqueo compartido y las de series, exclusivo. Se toma en una sentencia propia, antes de buscar conflictos,
+	para que la búsqueda vea todo lo confirmado mientras se esperaba el bloqueo
+	"""
+
+	bloquear = func.pg_advisory_xact_lock if exclusivo else func.pg_advisory_xact_lock_shared
+	# FOR KEY SHARE impide que se eliminen las Canchas, y se toma antes que el bloqueo de las filas de versiones
+	# que incrementa la escritura, en el mismo orden que las eliminaciones de Canchas
+	stmt = (
+		select(Cancha.id, bloquear(_CLASE_BLOQUEO_HORARIOS, Cancha.id))
+		.where(Cancha.id.in_(sorted(set(ids_cancha))))
+		.order_by(Cancha.id)
+		.with_for_update(read=True, key_share=True)
+	)
+
+	return list(session.execute(stmt).scalars())
 
 def create_cancha(session: _Session,
 	cancha: CanchaCreate
@@ -188,49 +279,393 @@ def create_cancha(session: _Session,
 
 	db_cancha = Cancha(nombre=cancha.nombre, techada=cancha.techada)
 	session.add(db_cancha)
+	_registrar_cambios(session, Cancha.__tablename__)
 	session.commit()
+	caché_canchas.guardar(CanchaSchema.model_validate(db_cancha))
 
 	return db_cancha
 
 def create_reserva(session: _Session,
 	reserva: ReservaCreate,
 ) -> Reserva:
-	"""Crea una nueva Reserva en la BDD y devuelve el objeto que la representa"""
+	"""
+	Crea una nueva Reserva en la BDD y devuelve el objeto que la representa.
+	La existencia de la Cancha, la búsqueda de solapamientos, la inserción y el incremento de la versión de la tabla
+	se resuelven en una sola sentencia, precedida solo por el bloqueo de los horarios de la Cancha.
+	Si hay solapamientos, las IDs de las Reservas en conflicto se informan en la cabecera X-Reservas-En-Conflicto
+	"""
+
+	_verificar_valores_horario(reserva.id_cancha, reserva.dia, reserva.hora, reserva.duración_minutos)
+	teléfono = verificar_y_normalizar_teléfono(reserva.teléfono)
+	stmt = _sentencia_crear_reserva(reserva, teléfono)
+
+	# Si otra transacción confirma una reserva solapada entre la búsqueda y la inserción, la restricción de exclusión
+	# rechaza la inserción. Al repetir la sentencia, esa reserva ya es visible y se informa como conflicto
+	for intento in range(2):
+		try:
+			_bloquear_horarios(session, [reserva.id_cancha])
+			fila = session.execute(stmt).one()
+			session.commit()
+			break
+		except IntegrityError as exc:
+			session.rollback()
+			pgcode = getattr(exc.orig, 'pgcode', None)
+
+			if pgcode == _PGCODE_VIOLACIÓN_EXCLUSIÓN and intento == 0:
+				continue
+
+			if pgcode == _PGCODE_VIOLACIÓN_CLAVE_FORÁNEA:
+				caché_canchas.invalidar(reserva.id_cancha)
+				raise HTTPException(status.HTTP_404_NOT_FOUND, 'La ID de cancha especificada no existe') from exc
+
+			if pgcode == _PGCODE_VIOLACIÓN_EXCLUSIÓN:
+				raise _conflicto_de_horario([]) from exc
+
+			raise
+
+	if not fila.existe_cancha:
+		caché_canchas.invalidar(reserva.id_cancha)
+		raise HTTPException(status.HTTP_404_NOT_FOUND, 'La ID de cancha especificada no existe')
+
+	if fila.id is None:
+		raise _conflicto_de_horario(fila.conflictos or [], fila.conflictos_series or [])
 
-	verificar_horario_reserva(session,
-		dia=reserva.dia,
-		hora=reserva.hora,
-		duración_minutos=reserva.duración_minutos,
-		id_cancha=reserva.id_cancha,
+	db_reserva = Reserva(**{columna.key: getattr(fila, columna.key) for columna in Reserva.__table__.columns})
+	make_transient_to_detached(db_reserva)
+	session.add(db_reserva)
+
+	return db_reserva
+
+def _sentencia_crear_reserva(reserva: ReservaCreate, teléfono: str) -> Select:
+	"""
+	WITH conflictos AS (SELECT id FROM reservas WHERE id_cancha = :id AND periodo && :periodo),
+	conflictos_series AS (SELECT id FROM series_reservas WHERE id_cancha = :id AND <alguna ocurrencia se solapa>),
+	insertada AS (INSERT INTO reservas (...) SELECT ... FROM canchas WHERE id = :id AND NOT EXISTS (conflictos...)
+		RETURNING *),
+	versión_tabla AS (INSERT INTO versiones_tablas ... SELECT ... WHERE EXISTS (SELECT FROM insertada)
+		ON CONFLICT DO UPDATE ...)
+	SELECT insertada.*, EXISTS (cancha) AS existe_cancha, (SELECT array_agg(id) FROM conflictos...) AS conflictos...
+	"""
+
+	inicio = datetime.combine(reserva.dia, time()) + timedelta(hours=reserva.hora)
+	periodo = literal(Range(inicio, inicio + timedelta(minutes=reserva.duración_minutos), bounds='[)'), TSRANGE)
+
+	conflictos = (
+		select(Reserva.id)
+		.where(Reserva.id_cancha == reserva.id_cancha, Reserva.periodo.overlaps(periodo))
+		.cte('conflictos')
 	)
 
-	if session.query(Cancha).get(reserva.id_cancha) is None:
-		raise HTTPException(
-			status.HTTP_404_NOT_FOUND,
-			f'La ID de Cancha especificada para la Reserva ({reserva.id_cancha}) no existe'
+	minuto_inicio = 60 * reserva.hora
+	conflictos_series = (
+		select(SerieReserva.id)
+		.where(series_reservas.condición_conflicto(
+			reserva.id_cancha,
+			reserva.dia,
+			minuto_inicio,
+			minuto_inicio + reserva.duración_minutos,
+		))
+		.cte('conflictos_series')
+	)
+
+	origen = (
+		select(
+			Cancha.id,
+			literal(reserva.dia, Reserva.dia.type),
+			literal(reserva.hora, Reserva.hora.type),
+			literal(reserva.duración_minutos, Reserva.duración_minutos.type),
+			literal(teléfono, Reserva.teléfono.type),
+			literal(reserva.nombre_contacto, Reserva.nombre_contacto.type),
 		)
+		.where(
+			Cancha.id == reserva.id_cancha,
+			~exists(select(conflictos.c.id)),
+			~exists(select(conflictos_series.c.id)),
+		)
+	)
 
-	teléfono = verificar_y_normalizar_teléfono(reserva.teléfono)
+	insertada = (
+		insert(Reserva)
+		.from_select(['id_cancha', 'dia', 'hora', 'duración_minutos', 'teléfono', 'nombre_contacto'], origen)
+		.returning(*Reserva.__table__.columns)
+		.cte('insertada')
+	)
 
-	db_reserva = Reserva(
-		id_cancha=reserva.id_cancha,
-		dia=reserva.dia,
-		hora=reserva.hora,
-		duración_minutos=reserva.duración_minutos,
-		teléfono=teléfono,
-		nombre_contacto=reserva.nombre_contacto,
+	versión_tabla = (
+		_sentencia_registrar_cambios_si(Reserva.__tablename__, exists(select(insertada.c.id)))
+		.cte('versión_tabla')
 	)
-	session.add(db_reserva)
-	session.commit()
 
-	return db_reserva
+	# Una fila fija garantiza un resultado aunque no se haya insertado nada
+	fila_fija = select(literal(1).label('fila')).subquery('fila_fija')
+
+	return (
+		select(
+			*insertada.c,
+			exists(select(Cancha.id).where(Cancha.id == reserva.id_cancha)).label('existe_cancha'),
+			select(func.array_agg(conflictos.c.id)).scalar_subquery().label('conflictos'),
+			select(func.array_agg(conflictos_series.c.id)).scalar_subquery().label('conflictos_series'),
+		)
+		.select_from(fila_fija.outerjoin(insertada, true()))
+		# Postgres ejecuta el INSERT de versión_tabla aunque la consulta principal no lo lea
+		.add_cte(versión_tabla)
+	)
+
+def _conflicto_de_horario(ids_conflicto: list[int], ids_series_conflicto: Optional[list[int]] = None) -> HTTPException:
+	cabeceras = {'X-Reservas-En-Conflicto': ','.join(str(id_conflicto) for id_conflicto in sorted(ids_conflicto))}
+
+	if ids_series_conflicto:
+		cabeceras['X-Series-En-Conflicto'] = ','.join(str(id_serie) for id_serie in sorted(ids_series_conflicto))
+
+	return HTTPException(
+		status.HTTP_409_CONFLICT,
+		'Registrar esta reserva haría que 2 reservas se solapen temporalmente',
+		headers=cabeceras,
+	)
+
+
+def create_reservas_lote(session: _Session,
+	reservas: list[ReservaCreate],
+	posiciones: Optional[list[int]] = None,
+) -> list[ResultadoReservaLote]:
+	"""
+	Crea varias Reservas en una sola transacción y devuelve el resultado de cada una, en el orden recibido.
+	Las Reservas inválidas o que se solapan con otras (ya registradas o anteriores del mismo lote) se descartan.
+	Si se indican posiciones, se usan para identificar a cada Reserva en lugar de su índice en la lista
+	"""
+
+	if posiciones is None:
+		posiciones = list(range(len(reservas)))
+
+	resultados: list[ResultadoReservaLote] = []
+	válidas: list[tuple[int, ReservaCreate, str]] = []
+
+	teléfonos = normalizador_teléfonos.normalizar_varios(reserva.teléfono for reserva in reservas)
+
+	for posición, reserva, teléfono in zip(posiciones, reservas, teléfonos):
+		try:
+			_verificar_valores_horario(reserva.id_cancha, reserva.dia, reserva.hora, reserva.duración_minutos)
+
+			if isinstance(teléfono, HTTPException):
+				raise teléfono
+		except HTTPException as exc:
+			resultados.append(ResultadoReservaLote(posición=posición, status_code=exc.status_code, detalle=exc.detail))
+			continue
+
+		válidas.append((posición, reserva, teléfono))
+
+	if len(válidas) == 0:
+		return resultados
+
+	# Si otra transacción confirma una reserva solapada entre la búsqueda y la inserción, la restricción de exclusión
+	# rechaza el INSERT. Al repetir la búsqueda, esa reserva ya es visible y solo se rechazan las Reservas afectadas
+	for intento in range(2):
+		rechazadas, aceptadas = _clasificar_reservas_lote(session, válidas)
+
+		if len(aceptadas) == 0:
+			# Libera los bloqueos de los horarios de las Canchas
+			session.rollback()
+			ids = []
+			break
+
+		try:
+			ids = _insertar_reservas_lote(session, aceptadas)
+			break
+		except IntegrityError as exc:
+			if getattr(exc.orig, 'pgcode', None) != _PGCODE_VIOLACIÓN_EXCLUSIÓN:
+				raise
+
+			if intento == 0:
+				continue
+
+			rechazadas.extend(
+				ResultadoReservaLote(
+					posición=posición,
+					status_code=status.HTTP_409_CONFLICT,
+					detalle='La reserva se solaparía con otra registrada al mismo tiempo',
+				)
+				for posición, _, _ in aceptadas
+			)
+			aceptadas, ids = [], []
+
+	resultados.extend(rechazadas)
+
+	for (posición, _, _), id_reserva in zip(aceptadas, ids):
+		resultados.append(ResultadoReservaLote(posición=posición, status_code=status.HTTP_201_CREATED, id=id_reserva))
+
+	resultados.sort(key=lambda resultado: resultado.posición)
+
+	return resultados
+
+def _clasificar_reservas_lote(session: _Session,
+	válidas: list[tuple[int, ReservaCreate, str]],
+) -> tuple[list[ResultadoReservaLote], list[tuple[int, ReservaCreate, str]]]:
+	"""
+	Bloquea los horarios de las Canchas del lote y separa las Reservas válidas en rechazadas (por Cancha inexistente o
+	por solaparse) y aceptadas, con la posición y el teléfono normalizado de cada una
+	"""
+
+	resultados: list[ResultadoReservaLote] = []
+	ids_cancha_existentes = set(_bloquear_horarios(session, {reserva.id_cancha for _, reserva, _ in válidas}))
+
+	# Una reserva dura menos de un día, así que solo puede solaparse con otras que empiecen el día anterior,
+	# el mismo día o el día siguiente. Se traen todas esas reservas de una sola vez
+	claves = {
+		(reserva.id_cancha, reserva.dia + timedelta(days=desfase))
+		for _, reserva, _ in válidas
+		if reserva.id_cancha in ids_cancha_existentes
+		for desfase in (-1, 0, 1)
+	}
+	ocupados: dict[int, list[tuple[int, int, int]]] = {}
+
+	if len(claves) > 0:
+		stmt = (
+			select(Reserva.id, Reserva.id_cancha, Reserva.dia, Reserva.hora, Reserva.duración_minutos)
+			.where(tuple_(Reserva.id_cancha, Reserva.dia).in_(claves))
+		)
+
+		for fila in session.execute(stmt):
+			inicio = minuto_absoluto(fila.dia, fila.hora)
+			ocupados.setdefault(fila.id_cancha, []).append((inicio, inicio + fila.duración_minutos, fila.id))
+
+		# Las ocurrencias de series se agregan con la ID de su serie negada
+		días = [dia for _, dia in claves]
+		for ocurrencia in series_reservas.ocurrencias_en_ventana(session, ids_cancha_existentes, min(días), max(días)):
+			inicio = minuto_absoluto(ocurrencia.dia, ocurrencia.hora)
+			fin = inicio + ocurrencia.duración_minutos
+			ocupados.setdefault(ocurrencia.id_cancha, []).append((inicio, fin, -ocurrencia.id_serie))
+
+	for intervalos in ocupados.values():
+		intervalos.sort()
+
+	# Se recorren las reservas de cada cancha en orden cronológico. Las ya aceptadas del lote son disjuntas y
+	# ordenadas, por lo que basta compararse con la última aceptada de la misma cancha
+	aceptadas: list[tuple[int, ReservaCreate, str]] = []
+	última_aceptada: dict[int, tuple[int, int]] = {}
+
+	for posición, reserva, teléfono in sorted(
+		válidas,
+		key=lambda v: (v[1].id_cancha, minuto_absoluto(v[1].dia, v[1].hora), v[0]),
+	):
+		if reserva.id_cancha not in ids_cancha_existentes:
+			resultados.append(ResultadoReservaLote(
+				posición=posición,
+				status_code=status.HTTP_404_NOT_FOUND,
+				detalle=f'La ID de Cancha especificada para la Reserva ({reserva.id_cancha}) no existe',
+			))
+			continue
+
+		inicio = minuto_absoluto(reserva.dia, reserva.hora)
+		fin = inicio + reserva.duración_minutos
+		conflictos = buscar_solapamientos(ocupados.get(reserva.id_cancha, []), inicio, fin)
+
+		if len(conflictos) > 0:
+			ids_reservas = sorted(id_conflicto for id_conflicto in conflictos if id_conflicto > 0)
+			ids_series = sorted(-id_conflicto for id_conflicto in conflictos if id_conflicto < 0)
+			detalle = 'La reserva se solaparía con ' + ' y con '.join(
+				texto for texto, ids in (
+					(f'las reservas registradas de ID: {ids_reservas}', ids_reservas),
+					(f'las series de reservas de ID: {ids_series}', ids_series),
+				)
+				if len(ids) > 0
+			)
+			resultados.append(ResultadoReservaLote(
+				posición=posición,
+				status_code=status.HTTP_409_CONFLICT,
+				detalle=detalle,
+			))
+			continue
+
+		anterior = última_aceptada.get(reserva.id_cancha)
+
+		if anterior is not None and anterior[1] > inicio:
+			resultados.append(ResultadoReservaLote(
+				posición=posición,
+				status_code=status.HTTP_409_CONFLICT,
+				detalle=f'La reserva se solaparía con la reserva en la posición {anterior[0]} del lote',
+			))
+			continue
+
+		última_aceptada[reserva.id_cancha] = (posición, fin)
+		aceptadas.append((posición, reserva, teléfono))
+
+	return resultados, aceptadas
+
+def create_serie(session: _Session,
+	serie: SerieReservaCreate,
+) -> SerieReserva:
+	"""
+	Crea una serie de Reservas que se repite cada semanas_intervalo semanas hasta el día indicado
+	y devuelve el objeto que la representa.
+	Se guarda una sola fila, y los solapamientos de todas sus ocurrencias se buscan de una vez
+	"""
+
+	_verificar_valores_horario(serie.id_cancha, serie.dia_inicio, serie.hora, serie.duración_minutos)
+	series_reservas.verificar_periodo(serie)
+
+	db_serie = SerieReserva(
+		id_cancha=serie.id_cancha,
+		dia_inicio=serie.dia_inicio,
+		hasta=serie.hasta,
+		semanas_intervalo=serie.semanas_intervalo,
+		hora=serie.hora,
+		duración_minutos=serie.duración_minutos,
+		teléfono=verificar_y_normalizar_teléfono(serie.teléfono),
+		nombre_contacto=serie.nombre_contacto,
+	)
+	fechas = db_serie.fechas()
+	db_serie.hasta = fechas[-1]
 
+	# El bloqueo exclusivo espera a las escrituras de Reservas y series en curso sobre la Cancha y demora las siguientes
+	# hasta confirmar la transacción
+	if len(_bloquear_horarios(session, [serie.id_cancha], exclusivo=True)) == 0:
+		session.rollback()
+		caché_canchas.invalidar(serie.id_cancha)
+		raise HTTPException(status.HTTP_404_NOT_FOUND, 'La ID de cancha especificada no existe')
+
+	conflictos_reservas, conflictos_series = series_reservas.conflictos(session, db_serie, fechas)
+
+	if len(conflictos_reservas) > 0 or len(conflictos_series) > 0:
+		session.rollback()
+		raise _conflicto_de_horario(conflictos_reservas, list(conflictos_series))
+
+	session.add(db_serie)
+	_registrar_cambios(session, SerieReserva.__tablename__)
+	session.commit()
+
+	return db_serie
 
 def get_cancha(session: _Session,
 	id_cancha: int,
-) -> Cancha | None:
-	"""Busca una Cancha en la BDD con la ID especificada y la devuelve"""
-	return session.query(Cancha).get(id_cancha)
+	caché: bool = True,
+) -> CanchaSchema | None:
+	"""
+	Busca una Cancha con la ID especificada, primero en la caché y luego en la BDD, y la devuelve.
+	Con caché en False, la lee siempre de la BDD (p.ej.: para el ETag que luego se compara con If-Match) y renueva la caché
+	"""
+
+	guardar = not session.info.get(CLAVE_RÉPLICA, False)
+
+	if caché:
+		return caché_canchas.obtener(id_cancha, partial(_cargar_cancha, session), guardar=guardar)
+
+	cancha = _cargar_cancha(session, id_cancha)
+
+	if cancha is None:
+		caché_canchas.invalidar(id_cancha)
+	elif guardar:
+		caché_canchas.guardar(cancha)
+
+	return cancha
+
+def _cargar_cancha(session: _Session, id_cancha: int) -> CanchaSchema | None:
+	# populate_existing evita devolver la instancia del identity map, que puede estar desactualizada
+	db_cancha = session.get(Cancha, id_cancha, populate_existing=True)
+
+	if db_cancha is None:
+		return None
+
+	return CanchaSchema.model_validate(db_cancha)
 
 def get_reserva(session: _Session,
 	id_reserva: Optional[int] = None,
@@ -292,35 +727,25 @@ def get_canchas(session: _Session,
 	rango: Optional[tuple[int, int]] = None,
 	nombre: Optional[str] = None,
 	techada: Optional[bool] = None,
+	límite: Optional[int] = None,
+	después_de: Optional[int] = None,
 ) -> list[Cancha]:
-	"""Devuelve una lista de objetos que representan Canchas encontradas en la BDD"""
+	"""
+	Devuelve una lista de objetos que representan Canchas encontradas en la BDD.
+	Si se indica un límite, devuelve como mucho esa cantidad de Canchas ordenadas por ID,
+	empezando después de la ID indicada en después_de
+	"""
 
-	criterios = []
+	if nombre is not None and len(nombre) == 0:
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='No puedes buscar un nombre vacío')
 
-	if nombre is not None:
-		if len(nombre) == 0:
-			raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='No puedes buscar un nombre vacío')
-
-		nombre_maqueta = (
-			nombre
-			.replace('*', '%')
-			.replace('_', r'\_')
+	if techada is not None and not isinstance(techada, bool):
+		raise HTTPException(
+			status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+			detail='El criterio de si la cancha está techada debe ser True, False o None',
 		)
-		criterios.append(Cancha.nombre.ilike(nombre_maqueta, escape='\\'))
-
-	if techada is not None:
-		if not isinstance(techada, bool):
-			raise HTTPException(
-				status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-				detail='El criterio de si la cancha está techada debe ser True, False o None',
-			)
-
-		criterios.append(Cancha.techada == techada)
-
-	stmt = select(Cancha)
 
-	if len(criterios) > 0:
-		stmt = stmt.where(and_(*criterios))
+	filtros, parámetros = consultas.filtros_canchas(nombre=nombre, techada=techada)
 
 	if rango is not None:
 		if (
@@ -333,77 +758,440 @@ def get_canchas(session: _Session,
 				detail='El rango debe ser una tupla de 2 enteros',
 			)
 
-		stmt = (stmt
-			.order_by(Cancha.id)
-			.offset(rango[0])
-			.limit(rango[1] - rango[0])
-		)
+		parámetros.update(consultas.parámetros_rango(rango))
+
+	paginada = _verificar_paginación(rango, límite, después_de)
 
-	resultado = session.execute(stmt).scalars().all()
+	if paginada:
+		parámetros['limite'] = límite
+
+		if después_de is not None:
+			parámetros['despues_id'] = después_de
+
+	stmt = consultas.sentencia_canchas(filtros,
+		rango=rango is not None,
+		paginada=paginada,
+		después_de=después_de is not None,
+	)
+	resultado = session.execute(stmt, parámetros).scalars().all()
 
 	return list(resultado)
 
-def get_reservas(session: _Session,
+def _ids_canchas_existentes(session: _Session, ids_cancha: Optional[list[int]]) -> list[int]:
+	"""
+	Devuelve, ordenadas, las IDs de las Canchas indicadas (o de todas). Lanza 404 si alguna no existe.
+	Las Canchas indicadas se buscan primero en la caché, y solo las que no están se consultan juntas en la BDD
+	"""
+
+	if ids_cancha is None:
+		return list(session.execute(select(Cancha.id).order_by(Cancha.id)).scalars())
+
+	pedidas = set(ids_cancha)
+	ids_existentes = {id_cancha for id_cancha in pedidas if caché_canchas.consultar(id_cancha) is not None}
+	por_cargar = pedidas - ids_existentes
+
+	if len(por_cargar) > 0:
+		guardar = not session.info.get(CLAVE_RÉPLICA, False)
+
+		for db_cancha in session.execute(select(Cancha).where(Cancha.id.in_(por_cargar))).scalars():
+			ids_existentes.add(db_cancha.id)
+
+			if guardar:
+				caché_canchas.guardar(CanchaSchema.model_validate(db_cancha))
+
+	if len(ids_existentes) != len(pedidas):
+		raise HTTPException(
+			status.HTTP_404_NOT_FOUND,
+			f'No existen canchas con las IDs: {sorted(pedidas - ids_existentes)}',
+		)
+
+	return sorted(ids_existentes)
+
+def get_disponibilidad(session: _Session,
+	desde: datetime,
+	hasta: datetime,
+	duración_minutos: int,
+	ids_cancha: Optional[list[int]] = None,
+) -> list[DisponibilidadCancha]:
+	"""
+	Calcula los huecos libres de al menos duración_minutos entre desde y hasta para las Canchas indicadas
+	(o todas), junto con los horarios en punto en los que puede empezar una Reserva de esa duración
+	"""
+
+	if not isinstance(desde, datetime) or not isinstance(hasta, datetime):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El intervalo de búsqueda debe indicarse con dos fechas y horas',
+		)
+
+	if desde.tzinfo is not None or hasta.tzinfo is not None:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El intervalo de búsqueda debe expresarse en horario local, sin zona horaria',
+		)
+
+	if desde >= hasta:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El inicio del intervalo de búsqueda debe ser anterior a su fin',
+		)
+
+	if hasta - desde > _MÁXIMO_INTERVALO_DISPONIBILIDAD:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			f'El intervalo de búsqueda no puede superar los {_MÁXIMO_INTERVALO_DISPONIBILIDAD.days} días',
+		)
+
+	if not isinstance(duración_minutos, int) or duración_minutos <= 0 or duración_minutos >= MINUTOS_DIA:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'La duración en minutos debe ser un número positivo y no puede ser un día entero o más',
+		)
+
+	ids_existentes = _ids_canchas_existentes(session, ids_cancha)
+
+	# Una sola consulta por rango, resuelta con el índice GiST de la restricción de exclusión sobre periodo
+	stmt = (
+		select(Reserva.id_cancha, Reserva.dia, Reserva.hora, Reserva.duración_minutos)
+		.where(Reserva.periodo.overlaps(Range(desde, hasta)))
+		.order_by(Reserva.id_cancha, Reserva.dia, Reserva.hora)
+	)
+
+	if ids_cancha is not None:
+		stmt = stmt.where(Reserva.id_cancha.in_(ids_existentes))
+
+	ocupados: dict[int, list[tuple[datetime, datetime]]] = {id_cancha: [] for id_cancha in ids_existentes}
+
+	for fila in session.execute(stmt):
+		inicio = datetime.combine(fila.dia, time(fila.hora))
+		ocupados[fila.id_cancha].append((inicio, inicio + timedelta(minutes=fila.duración_minutos)))
+
+	ocurrencias = series_reservas.ocurrencias_en_ventana(
+		session,
+		ids_existentes if ids_cancha is not None else None,
+		desde.date() - timedelta(days=1),
+		hasta.date(),
+	)
+
+	if len(ocurrencias) > 0:
+		for ocurrencia in ocurrencias:
+			inicio = datetime.combine(ocurrencia.dia, time(ocurrencia.hora))
+			fin = inicio + timedelta(minutes=ocurrencia.duración_minutos)
+
+			if inicio < hasta and fin > desde and ocurrencia.id_cancha in ocupados:
+				ocupados[ocurrencia.id_cancha].append((inicio, fin))
+
+		for intervalos in ocupados.values():
+			intervalos.sort()
+
+	duración = timedelta(minutes=duración_minutos)
+	disponibilidades = []
+
+	for id_cancha, intervalos in ocupados.items():
+		huecos = []
+		horarios = []
+		cursor = desde
+
+		# Barrido de los intervalos ocupados en orden cronológico; cada espacio entre ellos es un hueco libre
+		for inicio, fin in intervalos + [(hasta, hasta)]:
+			inicio = min(inicio, hasta)
+
+			if inicio - cursor >= duración:
+				huecos.append(HuecoDisponible(desde=cursor, hasta=inicio))
+				horarios.extend(_horarios_en_punto(cursor, inicio, duración))
+
+			cursor = max(cursor, fin)
+
+		disponibilidades.append(DisponibilidadCancha(
+			id_cancha=id_cancha,
+			huecos=huecos,
+			horarios_reservables=horarios,
+		))
+
+	return disponibilidades
+
+def _horarios_en_punto(desde: datetime, hasta: datetime, duración: timedelta) -> list[datetime]:
+	"""Devuelve las horas en punto en las que empieza un intervalo de la duración indicada contenido en [desde, hasta)"""
+
+	horario = desde.replace(minute=0, second=0, microsecond=0)
+
+	if horario < desde:
+		horario += timedelta(hours=1)
+
+	horarios = []
+
+	while horario + duración <= hasta:
+		horarios.append(horario)
+		horario += timedelta(hours=1)
+
+	return horarios
+
+def get_estadísticas(session: _Session,
+	desde: date,
+	hasta: date,
+	agrupar: tuple[str, ...] = ('cancha',),
 	id_cancha: Optional[int] = None,
-	rango: Optional[tuple[int, int]] = None,
-	dia: Optional[date | tuple[date, date]] = None,
-	hora: Optional[int | tuple[int, int]] = None,
-	duración_minutos: Optional[int | tuple[int, int]] = None,
-	teléfono: Optional[str] = None,
-	nombre_contacto: Optional[str] = None,
-	nombre_cancha: Optional[str] = None,
-	full: bool = False,
-) -> list[Reserva] | list[ReservaCompleta]:
-	"""Devuelve una lista de objetos que representan Canchas encontradas en la BDD"""
+	series: bool = True,
+) -> list[EstadísticaOcupación]:
+	"""
+	Calcula en la BDD los minutos reservados y la cantidad de Reservas entre desde y hasta (ambos inclusive),
+	agrupados por cualquier combinación de cancha, dia, dia_semana (1 = lunes) y hora.
+	La ocupación es el porcentaje de minutos reservados sobre los disponibles del grupo, contando días enteros.
+	Al agrupar por hora, cada Reserva se reparte entre las horas que ocupa; si no, se cuenta entera en su día de inicio
+	"""
+
+	if not isinstance(desde, date) or not isinstance(hasta, date) or desde > hasta:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El período de las estadísticas debe indicarse con dos fechas, la primera no posterior a la segunda',
+		)
 
-	criterios = []
+	desconocidos = [criterio for criterio in agrupar if criterio not in AGRUPAMIENTOS_ESTADÍSTICAS]
 
-	if id_cancha:
-		if not isinstance(id_cancha, int):
-			raise HTTPException(
-				status_code=status.HTTP_400_BAD_REQUEST,
-				detail='La ID de Cancha debe ser un entero',
+	if len(desconocidos) > 0 or len(set(agrupar)) != len(agrupar):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			f'Solo se puede agrupar, sin repetir, por: {", ".join(AGRUPAMIENTOS_ESTADÍSTICAS)}. Recibido: {", ".join(agrupar)}',
+		)
+
+	por_hora = 'hora' in agrupar
+	# Al repartir por hora, las Reservas del día anterior pueden ocupar las primeras horas de desde
+	inicio = desde - timedelta(days=1) if por_hora else desde
+
+	reservas = select(
+		Reserva.id_cancha,
+		Reserva.dia,
+		Reserva.hora,
+		Reserva.duración_minutos,
+	).where(Reserva.dia.between(inicio, hasta))
+
+	if id_cancha is not None:
+		reservas = reservas.where(Reserva.id_cancha == id_cancha)
+
+	ocupadas = reservas
+
+	if series:
+		# Las ocurrencias de las series se expanden en la BDD, solo dentro del período
+		ocurrencias = (
+			func.generate_series(
+				cast(SerieReserva.dia_inicio, DateTime),
+				cast(func.least(SerieReserva.hasta, hasta), DateTime),
+				func.make_interval(0, 0, SerieReserva.semanas_intervalo),
+			)
+			.table_valued(column('inicio', DateTime))
+			.render_derived(name='ocurrencias')
+			.lateral()
+		)
+		dia_ocurrencia = cast(ocurrencias.c.inicio, Date)
+		series_ocupadas = (
+			select(
+				SerieReserva.id_cancha,
+				dia_ocurrencia.label('dia'),
+				SerieReserva.hora,
+				SerieReserva.duración_minutos,
 			)
+			.join(ocurrencias, true())
+			.where(
+				SerieReserva.dia_inicio <= hasta,
+				SerieReserva.hasta >= inicio,
+				dia_ocurrencia >= inicio,
+			)
+		)
 
-		criterios.append(Reserva.id_cancha == id_cancha)
+		if id_cancha is not None:
+			series_ocupadas = series_ocupadas.where(SerieReserva.id_cancha == id_cancha)
 
-	_agregar_criterio_de_rango_u_valor_date(criterios, columna=Reserva.dia, argumento=dia)
-	_agregar_criterio_de_rango_u_valor_int(criterios, columna=Reserva.hora, argumento=hora)
-	_agregar_criterio_de_rango_u_valor_int(criterios, columna=Reserva.duración_minutos, argumento=duración_minutos)
+		ocupadas = reservas.union_all(series_ocupadas)
 
-	if teléfono is not None:
-		teléfono = verificar_y_normalizar_teléfono(teléfono)
-		criterios.append(Reserva.teléfono == teléfono)
+	ocupadas = ocupadas.subquery('ocupadas')
 
-	if nombre_contacto is not None:
-		nombre_maqueta = (
-			str(nombre_contacto)
-			.replace('*', '%')
-			.replace('_', r'\_')
+	if por_hora:
+		# Una fila por cada hora que ocupa cada Reserva. Las horas desde 24 caen en los días siguientes
+		minuto_inicio = ocupadas.c.hora * 60
+		minuto_fin = minuto_inicio + ocupadas.c.duración_minutos
+		horas = (
+			func.generate_series(ocupadas.c.hora, (minuto_fin - 1) // 60)
+			.table_valued(column('h', Integer))
+			.render_derived(name='horas')
+			.lateral()
 		)
-		criterios.append(Reserva.nombre_contacto.ilike(nombre_maqueta, escape='\\'))
+		dia = ocupadas.c.dia + horas.c.h // 24
+		piezas = (
+			select(
+				ocupadas.c.id_cancha,
+				dia.label('dia'),
+				(horas.c.h % 24).label('hora'),
+				(func.least(minuto_fin, (horas.c.h + 1) * 60) - func.greatest(minuto_inicio, horas.c.h * 60)).label('minutos'),
+			)
+			.select_from(ocupadas)
+			.join(horas, true())
+			.where(dia.between(desde, hasta))
+			.subquery('piezas')
+		)
+		fuente, minutos = piezas, piezas.c.minutos
+	else:
+		fuente, minutos = ocupadas, ocupadas.c.duración_minutos
+
+	columnas = {
+		'cancha': fuente.c.id_cancha,
+		'dia': fuente.c.dia,
+		'dia_semana': cast(extract('isodow', fuente.c.dia), Integer),
+		'hora': fuente.c.hora,
+	}
+	grupos = [columnas[criterio].label(criterio) for criterio in agrupar]
 
-	stmt = select(Reserva) if not full and not nombre_cancha else (
-		select(Reserva, Cancha)
-		.join(Reserva.cancha)
+	stmt = (
+		select(*grupos, func.count().label('cantidad'), func.sum(minutos).label('minutos'))
+		.group_by(*(columnas[criterio] for criterio in agrupar))
+		.order_by(*(columnas[criterio] for criterio in agrupar))
 	)
 
-	if nombre_cancha is not None:
-		if not isinstance(nombre_cancha, str) or len(nombre_cancha) == 0:
-			raise HTTPException(
-				status.HTTP_400_BAD_REQUEST,
-				'El criterio de nombre de cancha debe ser un string no vacío',
-			)
+	if 'cancha' in agrupar or id_cancha is not None:
+		cantidad_canchas = 1
+	else:
+		cantidad_canchas = session.execute(select(func.count(Cancha.id))).scalar_one()
+
+	días = (hasta - desde).days + 1
+	# Cantidad de veces que cada día de la semana (1 a 7) aparece en el período
+	días_por_día_semana = {
+		(desde + timedelta(days=i)).isoweekday(): días // 7 + (1 if i < días % 7 else 0)
+		for i in range(7)
+	}
+	minutos_por_día = 60 if por_hora else MINUTOS_DIA
+
+	estadísticas = []
+
+	for fila in session.execute(stmt):
+		valores = fila._mapping
+
+		if 'dia' in agrupar:
+			días_grupo = 1
+		elif 'dia_semana' in agrupar:
+			días_grupo = días_por_día_semana[valores['dia_semana']]
+		else:
+			días_grupo = días
+
+		disponibles = cantidad_canchas * días_grupo * minutos_por_día
+
+		estadísticas.append(EstadísticaOcupación(
+			id_cancha=valores.get('cancha'),
+			dia=valores.get('dia'),
+			dia_semana=valores.get('dia_semana'),
+			hora=valores.get('hora'),
+			cantidad_reservas=fila.cantidad,
+			minutos_reservados=fila.minutos,
+			ocupación_porcentaje=round(100 * fila.minutos / disponibles, 2) if disponibles > 0 else 0,
+		))
+
+	return estadísticas
+
+def get_grilla(session: _Session,
+	dia: date,
+	ids_cancha: Optional[list[int]] = None,
+	resolución_minutos: int = 15,
+	series: bool = True,
+) -> GrillaDía:
+	"""
+	Arma, para cada Cancha indicada (o todas), un mapa de bits de la ocupación del día en franjas de resolución_minutos.
+	El bit más significativo del primer byte corresponde a la franja que empieza a las 00:00. Un bit en 1 indica que
+	alguna Reserva (o, si series es True, alguna ocurrencia de serie) ocupa al menos parte de esa franja
+	"""
+
+	if not isinstance(dia, date) or isinstance(dia, datetime):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El día de la grilla debe ser una fecha',
+		)
+
+	if resolución_minutos not in RESOLUCIONES_GRILLA:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			f'La resolución de la grilla debe ser una de: {", ".join(str(r) for r in RESOLUCIONES_GRILLA)} minutos',
+		)
+
+	ids_existentes = _ids_canchas_existentes(session, ids_cancha)
+	inicio_día = datetime.combine(dia, time())
+
+	# Una sola consulta por rango sobre periodo, que también trae las Reservas del día anterior que terminan en este
+	stmt = (
+		select(Reserva.id_cancha, Reserva.dia, Reserva.hora, Reserva.duración_minutos)
+		.where(Reserva.periodo.overlaps(Range(inicio_día, inicio_día + timedelta(days=1))))
+	)
+
+	if ids_cancha is not None:
+		stmt = stmt.where(Reserva.id_cancha.in_(ids_existentes))
+
+	ocupadas: list[Row | OcurrenciaSerie] = list(session.execute(stmt))
+
+	if series:
+		ocupadas.extend(series_reservas.ocurrencias_en_ventana(
+			session,
+			ids_existentes if ids_cancha is not None else None,
+			dia - timedelta(days=1),
+			dia,
+		))
+
+	franjas = MINUTOS_DIA // resolución_minutos
+	mapas = {id_cancha: bytearray(-(-franjas // 8)) for id_cancha in ids_existentes}
+
+	for ocupada in ocupadas:
+		mapa = mapas.get(ocupada.id_cancha)
+
+		if mapa is None:
+			continue
+
+		inicio = (ocupada.dia - dia).days * MINUTOS_DIA + 60 * ocupada.hora
+		fin = min(inicio + ocupada.duración_minutos, MINUTOS_DIA)
+
+		for franja in range(max(inicio, 0) // resolución_minutos, -(-fin // resolución_minutos)):
+			mapa[franja >> 3] |= 0x80 >> (franja & 7)
+
+	return GrillaDía(
+		dia=dia,
+		resolución_minutos=resolución_minutos,
+		canchas=[
+			GrillaCancha(id_cancha=id_cancha, ocupación=urlsafe_b64encode(mapa).decode())
+			for id_cancha, mapa in mapas.items()
+		],
+	)
+
+def _consulta_reservas(
+	id_cancha: Optional[int] = None,
+	rango: Optional[tuple[int, int]] = None,
+	dia: Optional[date | tuple[date, date]] = None,
+	hora: Optional[int | tuple[int, int]] = None,
+	duración_minutos: Optional[int | tuple[int, int]] = None,
+	teléfono: Optional[str] = None,
+	nombre_contacto: Optional[str] = None,
+	nombre_cancha: Optional[str] = None,
+	full: bool = False,
+	límite: Optional[int] = None,
+	después_de: Optional[tuple[date, int, int]] = None,
+	filas: bool = False,
+) -> tuple[Select, dict]:
+	"""Valida los criterios y devuelve la sentencia preparada para su forma junto con los parámetros para ejecutarla"""
+
+	if id_cancha and not isinstance(id_cancha, int):
+		raise HTTPException(
+			status_code=status.HTTP_400_BAD_REQUEST,
+			detail='La ID de Cancha debe ser un entero',
+		)
 
-		nombre_maqueta = (
-			nombre_cancha
-			.replace('*', '%')
-			.replace('_', r'\_')
+	if nombre_cancha is not None and (not isinstance(nombre_cancha, str) or len(nombre_cancha) == 0):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El criterio de nombre de cancha debe ser un string no vacío',
 		)
-		criterios.append(Cancha.nombre.ilike(nombre_maqueta, escape='\\'))
 
-	if len(criterios) > 0:
-		stmt = stmt.where(and_(*criterios))
+	filtros, parámetros = consultas.filtros_reservas(
+		id_cancha=id_cancha or None,
+		dia=dia,
+		hora=hora,
+		duración_minutos=duración_minutos,
+		teléfono=verificar_y_normalizar_teléfono(teléfono) if teléfono is not None else None,
+		nombre_contacto=nombre_contacto,
+		nombre_cancha=nombre_cancha,
+	)
 
 	if rango is not None:
 		if (
@@ -413,20 +1201,229 @@ def get_reservas(session: _Session,
 		):
 			raise TypeError('El rango debe ser una tupla de 2 enteros')
 
-		stmt = (stmt
-			.order_by(Reserva.id)
-			.offset(rango[0])
-			.limit(rango[1] - rango[0])
+		parámetros.update(consultas.parámetros_rango(rango))
+
+	paginada = _verificar_paginación(rango, límite, después_de)
+
+	if paginada:
+		parámetros['limite'] = límite
+
+		if después_de is not None:
+			parámetros['despues_dia'], parámetros['despues_hora'], parámetros['despues_id'] = después_de
+
+	stmt = consultas.sentencia_reservas(filtros,
+		full=full,
+		rango=rango is not None,
+		paginada=paginada,
+		después_de=después_de is not None,
+		filas=filas,
+	)
+
+	return stmt, parámetros
+
+def get_reservas(session: _Session,
+	id_cancha: Optional[int] = None,
+	rango: Optional[tuple[int, int]] = None,
+	dia: Optional[date | tuple[date, date]] = None,
+	hora: Optional[int | tuple[int, int]] = None,
+	duración_minutos: Optional[int | tuple[int, int]] = None,
+	teléfono: Optional[str] = None,
+	nombre_contacto: Optional[str] = None,
+	nombre_cancha: Optional[str] = None,
+	full: bool = False,
+	límite: Optional[int] = None,
+	después_de: Optional[tuple[date, int, int]] = None,
+	series: bool = False,
+) -> list[Reserva | OcurrenciaSerie] | list[ReservaCompleta]:
+	"""
+	Devuelve una lista de objetos que representan Canchas encontradas en la BDD.
+	Si se indica un límite, devuelve como mucho esa cantidad de Reservas ordenadas por (dia, hora, id),
+	empezando después de la clave indicada en después_de.
+	Si series es True, también incluye las ocurrencias de series que cumplan los criterios,
+	ordenadas junto a las Reservas por (dia, hora)
+	"""
+
+	if series and (rango is not None or límite is not None or después_de is not None):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'No se puede paginar una consulta que incluye las ocurrencias de series de reservas',
 		)
 
+	stmt, parámetros = _consulta_reservas(
+		id_cancha=id_cancha,
+		rango=rango,
+		dia=dia,
+		hora=hora,
+		duración_minutos=duración_minutos,
+		teléfono=teléfono,
+		nombre_contacto=nombre_contacto,
+		nombre_cancha=nombre_cancha,
+		full=full,
+		límite=límite,
+		después_de=después_de,
+	)
 
 	if full:
-		resultado = session.execute(stmt).fetchall()
-		return [ReservaCompleta(reserva=reserva, cancha=cancha) for reserva, cancha in resultado]
+		resultado = session.execute(stmt, parámetros).fetchall()
+		reservas = [ReservaCompleta(reserva=reserva, cancha=cancha) for reserva, cancha in resultado]
+	else:
+		reservas = list(session.execute(stmt, parámetros).scalars().all())
 
-	resultado = session.execute(stmt).scalars().all()
-	return list(resultado)
+	if not series:
+		return reservas
+
+	reservas.extend(series_reservas.get_ocurrencias(session,
+		id_cancha=id_cancha,
+		dia=dia,
+		hora=hora,
+		duración_minutos=duración_minutos,
+		teléfono=teléfono,
+		nombre_contacto=nombre_contacto,
+		nombre_cancha=nombre_cancha,
+		full=full,
+	))
+	reservas.sort(key=lambda r: (r.reserva.dia, r.reserva.hora) if full else (r.dia, r.hora))
+
+	return reservas
+
+def get_reservas_por_teléfono(session: _Session,
+	teléfono: str,
+	desde: Optional[date] = None,
+	límite: int = 20,
+	series: bool = True,
+) -> list[Reserva | OcurrenciaSerie]:
+	"""
+	Devuelve hasta límite Reservas del teléfono indicado: primero las próximas (desde el día indicado, por defecto hoy)
+	en orden cronológico y, si no alcanzan, las anteriores de la más reciente a la más antigua.
+	Si series es True, también incluye las ocurrencias de las series del teléfono
+	"""
+
+	if not isinstance(límite, int) or not 1 <= límite <= _MÁXIMO_RESERVAS_POR_TELÉFONO:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			f'El límite debe ser un entero entre 1 y {_MÁXIMO_RESERVAS_POR_TELÉFONO}',
+		)
+
+	teléfono = verificar_y_normalizar_teléfono(teléfono)
+
+	if desde is None:
+		desde = date.today()
+
+	parámetros = {'telefono': teléfono, 'desde': desde, 'limite': límite}
+	series_teléfono = (
+		list(session.execute(select(SerieReserva).where(SerieReserva.teléfono == teléfono)).scalars()) if series else []
+	)
+
+	próximas: list[Reserva | OcurrenciaSerie] = list(
+		session.execute(consultas.sentencia_reservas_por_teléfono(próximas=True), parámetros).scalars()
+	)
+	próximas.extend(ocurrencia for serie in series_teléfono for ocurrencia in serie.ocurrencias(desde)[:límite])
+	próximas.sort(key=lambda r: (r.dia, r.hora))
+
+	if len(próximas) >= límite:
+		return próximas[:límite]
+
+	faltantes = límite - len(próximas)
+	anteriores: list[Reserva | OcurrenciaSerie] = list(session.execute(
+		consultas.sentencia_reservas_por_teléfono(próximas=False),
+		{**parámetros, 'limite': faltantes},
+	).scalars())
+	anteriores.extend(
+		ocurrencia
+		for serie in series_teléfono
+		for ocurrencia in serie.ocurrencias(hasta=desde - timedelta(days=1))[-faltantes:]
+	)
+	anteriores.sort(key=lambda r: (r.dia, r.hora), reverse=True)
+
+	return próximas + anteriores[:faltantes]
+
+def get_filas_reservas(session: _Session, **criterios) -> list[Row]:
+	"""
+	Acepta los mismos criterios que get_reservas (salvo series), pero devuelve filas planas con las columnas de
+	consultas.CAMPOS_RESERVA, seguidas de las de consultas.CAMPOS_CANCHA si full es True.
+	No construye entidades del ORM, así que sirve para lecturas que solo serializan los resultados
+	"""
+
+	stmt, parámetros = _consulta_reservas(**criterios, filas=True)
+	return list(session.execute(stmt, parámetros))
 
+def iterar_reservas(session: _Session,
+	tamaño_lote: int = 1000,
+	**criterios,
+) -> Iterator[Reserva] | Iterator[ReservaCompleta]:
+	"""
+	Acepta los mismos criterios que get_reservas, pero recorre los resultados con un cursor del lado del servidor,
+	trayéndolos de a tamaño_lote filas en lugar de cargarlos todos en memoria.
+	Los criterios se validan antes de devolver el iterador. La sesión debe seguir abierta mientras se lo recorre
+	"""
+
+	stmt, parámetros = _consulta_reservas(**criterios)
+	resultado = session.execute(stmt, parámetros, execution_options={'stream_results': True, 'yield_per': tamaño_lote})
+
+	if criterios.get('full', False):
+		return (ReservaCompleta(reserva=reserva, cancha=cancha) for reserva, cancha in resultado)
+
+	return iter(resultado.scalars())
+
+
+def _modificación_concurrente(entidad: str) -> HTTPException:
+	return HTTPException(
+		status.HTTP_412_PRECONDITION_FAILED,
+		f'La {entidad} fue modificada por otra petición. Vuelve a obtenerla antes de modificarla',
+	)
+
+def update_cancha(session: _Session,
+	id_cancha: int,
+	nombre: Optional[str] = None,
+	techada: Optional[bool] = None,
+	versión: Optional[int] = None,
+) -> Cancha | None:
+	"""
+	Modifica una Cancha con una sola sentencia UPDATE ... RETURNING y la devuelve, o None si no existe.
+	Si se indica una versión y la Cancha ya tiene otra, no la modifica y lanza 412
+	"""
+
+	objetivo = select(Cancha.versión).where(Cancha.id == id_cancha).cte('objetivo')
+	valores = {'versión': Cancha.versión + 1}
+
+	if nombre is not None:
+		valores['nombre'] = nombre
+
+	if techada is not None:
+		valores['techada'] = techada
+
+	stmt_actualizar = update(Cancha).where(Cancha.id == id_cancha).values(valores)
+
+	if versión is not None:
+		stmt_actualizar = stmt_actualizar.where(Cancha.versión == versión)
+
+	actualizada = stmt_actualizar.returning(*Cancha.__table__.columns).cte('actualizada')
+	fila_fija = select(literal(1).label('fila')).subquery('fila_fija')
+	stmt = (
+		select(*actualizada.c, select(objetivo.c.versión).scalar_subquery().label('versión_previa'))
+		.select_from(fila_fija.outerjoin(actualizada, true()))
+	)
+
+	fila = session.execute(stmt).one()
+
+	if fila.id is not None:
+		_registrar_cambios(session, Cancha.__tablename__)
+
+	session.commit()
+
+	if fila.versión_previa is None:
+		caché_canchas.invalidar(id_cancha)
+		return None
+
+	if fila.id is None:
+		raise _modificación_concurrente('cancha')
+
+	db_cancha = Cancha(**{columna.key: getattr(fila, columna.key) for columna in Cancha.__table__.columns})
+	make_transient_to_detached(db_cancha)
+	db_cancha = session.merge(db_cancha, load=False)
+	caché_canchas.guardar(CanchaSchema.model_validate(db_cancha))
+
+	return db_cancha
 
 def update_reserva(session: _Session,
 	id_reserva: Optional[int] = None,
@@ -435,40 +1432,163 @@ def update_reserva(session: _Session,
 	duración_minutos: Optional[int] = None,
 	teléfono: Optional[str] = None,
 	nombre_contacto: Optional[str] = None,
+	versión: Optional[int] = None,
 ) -> Reserva | None:
-	db_reserva = get_reserva(session, id_reserva)
+	"""
+	Modifica una Reserva y la devuelve, o None si no existe. La búsqueda de solapamientos con el nuevo horario
+	y la modificación se resuelven en una sola sentencia. Si se indica una versión y la Reserva ya tiene otra,
+	no la modifica y lanza 412. Si hay solapamientos, lanza 409 como create_reserva
+	"""
 
-	if db_reserva is None:
-		return None
+	_verificar_valores_horario(None, dia, hora, duración_minutos, parcial=True)
+
+	if teléfono is not None:
+		teléfono = verificar_y_normalizar_teléfono(teléfono)
 
-	verificar_horario_reserva(session,
-		dia=dia if dia is not None else db_reserva.dia,
-		hora=hora if hora is not None else db_reserva.hora,
-		duración_minutos=duración_minutos if duración_minutos is not None else db_reserva.duración_minutos,
-		id_cancha=db_reserva.id_cancha,
-		id_reserva=id_reserva,
+	stmt = _sentencia_modificar_reserva(id_reserva, dia, hora, duración_minutos, teléfono, nombre_contacto, versión)
+	# Como _bloquear_horarios, sobre la Cancha de la Reserva, que no se conoce antes de leerla
+	stmt_bloquear = (
+		select(func.pg_advisory_xact_lock_shared(_CLASE_BLOQUEO_HORARIOS, Reserva.id_cancha))
+		.where(Reserva.id == id_reserva)
 	)
 
-	if dia is not None:
-		db_reserva.dia = dia
+	# Como en create_reserva, una reserva solapada confirmada por otra transacción entre la búsqueda y la modificación
+	# hace que la restricción de exclusión rechace la sentencia, y al repetirla ya se informa como conflicto
+	for intento in range(2):
+		try:
+			session.execute(stmt_bloquear)
+			fila = session.execute(stmt).one()
 
-	if hora is not None:
-		db_reserva.hora = hora
+			if fila.id is not None:
+				_registrar_cambios(session, Reserva.__tablename__)
 
-	if duración_minutos is not None:
-		db_reserva.duración_minutos = duración_minutos
+			session.commit()
+			break
+		except IntegrityError as exc:
+			session.rollback()
+			pgcode = getattr(exc.orig, 'pgcode', None)
 
-	if teléfono is not None:
-		teléfono = verificar_y_normalizar_teléfono(teléfono)
-		db_reserva.teléfono = teléfono
+			if pgcode == _PGCODE_VIOLACIÓN_EXCLUSIÓN and intento == 0:
+				continue
 
-	if nombre_contacto is not None:
-		db_reserva.nombre_contacto = nombre_contacto
+			if pgcode == _PGCODE_VIOLACIÓN_EXCLUSIÓN:
+				raise _conflicto_de_horario([]) from exc
 
-	session.commit()
+			raise
+
+	if fila.versión_previa is None:
+		return None
+
+	if fila.id is None:
+		if versión is not None and fila.versión_previa != versión:
+			raise _modificación_concurrente('reserva')
+
+		if fila.conflictos or fila.conflictos_series:
+			raise _conflicto_de_horario(fila.conflictos or [], fila.conflictos_series or [])
+
+		# Nada se solapaba, así que otra petición modificó la Reserva mientras se ejecutaba la sentencia
+		raise _modificación_concurrente('reserva')
+
+	db_reserva = Reserva(**{columna.key: getattr(fila, columna.key) for columna in Reserva.__table__.columns})
+	make_transient_to_detached(db_reserva)
+	db_reserva = session.merge(db_reserva, load=False)
 
 	return db_reserva
 
+def _sentencia_modificar_reserva(
+	id_reserva: int,
+	dia: Optional[date],
+	hora: Optional[int],
+	duración_minutos: Optional[int],
+	teléfono: Optional[str],
+	nombre_contacto: Optional[str],
+	versión: Optional[int],
+) -> Select:
+	"""
+	WITH objetivo AS (SELECT id, id_cancha, versión, <nuevo horario> FROM reservas WHERE id = :id),
+	conflictos AS (SELECT id FROM reservas, objetivo WHERE <misma cancha, otra reserva> AND periodo && objetivo.periodo),
+	conflictos_series AS (SELECT id FROM series_reservas, objetivo WHERE <alguna ocurrencia se solapa>),
+	actualizada AS (UPDATE reservas SET ..., versión = versión + 1 WHERE id = :id [AND versión = :v]
+		AND NOT EXISTS (conflictos...) RETURNING *)
+	SELECT actualizada.*, (SELECT versión FROM objetivo) AS versión_previa,
+		(SELECT array_agg(id) FROM conflictos...) AS conflictos...
+	"""
+
+	def nuevo(columna, valor):
+		return literal(valor, columna.type) if valor is not None else columna
+
+	nuevo_dia = nuevo(Reserva.dia, dia)
+	nueva_hora = nuevo(Reserva.hora, hora)
+	nueva_duración = nuevo(Reserva.duración_minutos, duración_minutos)
+	inicio = nuevo_dia + func.make_interval(0, 0, 0, 0, nueva_hora)
+
+	objetivo = (
+		select(
+			Reserva.id,
+			Reserva.id_cancha,
+			Reserva.versión,
+			nuevo_dia.label('dia'),
+			(60 * nueva_hora).label('minuto_inicio'),
+			(60 * nueva_hora + nueva_duración).label('minuto_fin'),
+			func.tsrange(inicio, inicio + func.make_interval(0, 0, 0, 0, 0, nueva_duración), type_=TSRANGE).label('periodo'),
+		)
+		.where(Reserva.id == id_reserva)
+		.cte('objetivo')
+	)
+
+	conflictos = (
+		select(Reserva.id)
+		.where(
+			Reserva.id_cancha == objetivo.c.id_cancha,
+			Reserva.id != objetivo.c.id,
+			Reserva.periodo.overlaps(objetivo.c.periodo),
+		)
+		.cte('conflictos')
+	)
+
+	conflictos_series = (
+		select(SerieReserva.id)
+		.where(series_reservas.condición_conflicto(
+			objetivo.c.id_cancha,
+			objetivo.c.dia,
+			objetivo.c.minuto_inicio,
+			objetivo.c.minuto_fin,
+		))
+		.cte('conflictos_series')
+	)
+
+	valores = {
+		'dia': dia,
+		'hora': hora,
+		'duración_minutos': duración_minutos,
+		'teléfono': teléfono,
+		'nombre_contacto': nombre_contacto,
+	}
+	stmt_actualizar = (
+		update(Reserva)
+		.where(
+			Reserva.id == id_reserva,
+			~exists(select(conflictos.c.id)),
+			~exists(select(conflictos_series.c.id)),
+		)
+		.values({clave: valor for clave, valor in valores.items() if valor is not None} | {'versión': Reserva.versión + 1})
+	)
+
+	if versión is not None:
+		stmt_actualizar = stmt_actualizar.where(Reserva.versión == versión)
+
+	actualizada = stmt_actualizar.returning(*Reserva.__table__.columns).cte('actualizada')
+	fila_fija = select(literal(1).label('fila')).subquery('fila_fija')
+
+	return (
+		select(
+			*actualizada.c,
+			select(objetivo.c.versión).scalar_subquery().label('versión_previa'),
+			select(func.array_agg(conflictos.c.id)).scalar_subquery().label('conflictos'),
+			select(func.array_agg(conflictos_series.c.id)).scalar_subquery().label('conflictos_series'),
+		)
+		.select_from(fila_fija.outerjoin(actualizada, true()))
+	)
 
 def delete_cancha(session: _Session,
 	id_cancha: int,
@@ -478,10 +1598,13 @@ def delete_cancha(session: _Session,
 	db_cancha_por_eliminar = session.query(Cancha).filter(Cancha.id == id_cancha).first()
 
 	if db_cancha_por_eliminar is None:
+		caché_canchas.invalidar(id_cancha)
 		raise HTTPException(status.HTTP_404_NOT_FOUND, f'No se encontró una cancha de ID {id_cancha} a eliminar')
 
 	session.delete(db_cancha_por_eliminar)
+	_registrar_cambios(session, Cancha.__tablename__, Reserva.__tablename__, SerieReserva.__tablename__)
 	session.commit()
+	caché_canchas.invalidar(id_cancha)
 
 	return db_cancha_por_eliminar
 
@@ -496,46 +1619,81 @@ def delete_reserva(session: _Session,
 		raise HTTPException(status.HTTP_404_NOT_FOUND, f'No se encontró una reserva de ID {id_reserva} a eliminar')
 
 	session.delete(db_reserva_por_eliminar)
+	_registrar_cambios(session, Reserva.__tablename__)
 	session.commit()
 
 	return db_reserva_por_eliminar
 
-def delete_canchas(session: _Session,
-	rango: Optional[tuple[int, int]] = None,
-	nombre: Optional[str] = None,
-	techada: Optional[bool] = None,
-) -> list[Cancha]:
-	"""Elimina Canchas que coincidan con los criterios indicados y las devuelve en una lista"""
-
-	criterios = []
+def _verificar_tamaño_lote(tamaño_lote: Optional[int], rango: Optional[tuple[int, int]]):
+	if tamaño_lote is None:
+		return
 
-	if nombre is not None:
-		if len(nombre) == 0:
-			raise HTTPException(
+	if not isinstance(tamaño_lote, int) or tamaño_lote <= 0:
+		raise HTTPException(
 			status.HTTP_400_BAD_REQUEST,
-			'No puedes buscar un nombre vacío',
+			'El tamaño de lote debe ser un entero positivo',
 		)
 
-		nombre_maqueta = (
-			nombre
-			.replace('*', '%')
-			.replace('_', r'\_')
+	if rango is not None:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'No puedes combinar un rango de resultados (qmin/qmax) con la eliminación en lotes',
 		)
-		criterios.append(Cancha.nombre.ilike(nombre_maqueta))
 
-	if techada is not None:
-		if not isinstance(techada, bool):
-			raise HTTPException(
-				status.HTTP_422_UNPROCESSABLE_ENTITY,
-				'El criterio de si la cancha está techada debe ser True, False o None',
-			)
+def _eliminar_en_lotes(session: _Session,
+	stmt: Delete,
+	parámetros: dict,
+	tamaño_lote: Optional[int],
+	devolver: consultas.TipoDevolución,
+	tablas: tuple[str, ...],
+	al_confirmar: Optional[Callable[[list[int]], None]] = None,
+) -> Iterator[list]:
+	"""
+	Ejecuta un borrado de a tamaño_lote filas (o todas juntas si es None), confirmando cada lote en su propia transacción
+	para no retener los bloqueos de todo el borrado. Cada lote no vacío incrementa la versión de las tablas indicadas en su
+	misma transacción. Devuelve lo eliminado en cada lote y, ya confirmado, llama a al_confirmar con sus IDs
+	"""
+
+	if tamaño_lote is not None:
+		parámetros = {**parámetros, 'lote': tamaño_lote}
+
+	while True:
+		resultado = session.execute(stmt, parámetros)
+		lote = resultado.all() if devolver == 'filas' else resultado.scalars().all()
+
+		if len(lote) > 0:
+			_registrar_cambios(session, *tablas)
 
-		criterios.append(Cancha.techada == techada)
+		session.commit()
 
-	subselect = select(Cancha.id)
+		if len(lote) > 0:
+			if al_confirmar is not None:
+				al_confirmar([elemento if devolver == 'ids' else elemento.id for elemento in lote])
 
-	if len(criterios) > 0:
-		subselect = subselect.where(and_(*criterios))
+			yield lote
+
+		if tamaño_lote is None or len(lote) < tamaño_lote:
+			return
+
+def _preparar_borrado_canchas(
+	rango: Optional[tuple[int, int]] = None,
+	nombre: Optional[str] = None,
+	techada: Optional[bool] = None,
+	tamaño_lote: Optional[int] = None,
+) -> tuple[consultas.FiltrosCanchas, dict]:
+	if nombre is not None and len(nombre) == 0:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'No puedes buscar un nombre vacío',
+		)
+
+	if techada is not None and not isinstance(techada, bool):
+		raise HTTPException(
+			status.HTTP_422_UNPROCESSABLE_ENTITY,
+			'El criterio de si la cancha está techada debe ser True, False o None',
+		)
+
+	filtros, parámetros = consultas.filtros_canchas(nombre=nombre, techada=techada)
 
 	if rango is not None:
 		if (
@@ -548,25 +1706,71 @@ def delete_canchas(session: _Session,
 				'El rango debe ser una tupla de 2 enteros',
 			)
 
-		subselect = (subselect
-			.order_by(Cancha.id)
-			.offset(rango[0])
-			.limit(rango[1] - rango[0])
-		)
+		parámetros.update(consultas.parámetros_rango(rango))
 
-	stmt = (
-		delete(Cancha)
-		.where(Cancha.id.in_(subselect))
-		.returning(Cancha)
-		.execution_options(synchronize_session='fetch')
+	_verificar_tamaño_lote(tamaño_lote, rango)
+
+	return filtros, parámetros
+
+def _eliminar_canchas(session: _Session,
+	devolver: consultas.TipoDevolución,
+	rango: Optional[tuple[int, int]] = None,
+	nombre: Optional[str] = None,
+	techada: Optional[bool] = None,
+	tamaño_lote: Optional[int] = None,
+) -> Iterator[list]:
+	filtros, parámetros = _preparar_borrado_canchas(rango=rango, nombre=nombre, techada=techada, tamaño_lote=tamaño_lote)
+	stmt = consultas.sentencia_borrar_canchas(filtros,
+		rango=rango is not None,
+		lote=tamaño_lote is not None,
+		devolver=devolver,
 	)
 
-	resultado = session.execute(stmt).scalars().all()
+	def al_confirmar(ids_cancha: list[int]):
+		for id_cancha in ids_cancha:
+			caché_canchas.invalidar(id_cancha)
+
+	# Las Reservas y series de las Canchas se eliminan en cascada
+	tablas = (Cancha.__tablename__, Reserva.__tablename__, SerieReserva.__tablename__)
+
+	return _eliminar_en_lotes(session, stmt, parámetros, tamaño_lote, devolver, tablas, al_confirmar)
+
+def delete_canchas(session: _Session,
+	rango: Optional[tuple[int, int]] = None,
+	nombre: Optional[str] = None,
+	techada: Optional[bool] = None,
+	tamaño_lote: Optional[int] = None,
+) -> list[Cancha]:
+	"""
+	Elimina Canchas que coincidan con los criterios indicados, junto con sus Reservas y series,
+	y las devuelve en una lista.
+	Con tamaño_lote, elimina de a esa cantidad de Canchas por transacción
+	"""
+
+	lotes = _eliminar_canchas(session, 'entidades', rango=rango, nombre=nombre, techada=techada, tamaño_lote=tamaño_lote)
+	return [cancha for lote in lotes for cancha in lote]
+
+def delete_canchas_cantidad(session: _Session, **criterios) -> int:
+	"""Acepta los mismos criterios que delete_canchas, pero solo devuelve la cantidad de Canchas eliminadas"""
+	return sum(len(lote) for lote in _eliminar_canchas(session, 'ids', **criterios))
+
+def delete_serie(session: _Session,
+	id_serie: int,
+) -> SerieReserva:
+	"""Busca una serie de Reservas en la BDD con la ID especificada, la elimina junto con sus ocurrencias y la devuelve"""
+
+	db_serie = session.get(SerieReserva, id_serie)
+
+	if db_serie is None:
+		raise HTTPException(status.HTTP_404_NOT_FOUND, f'No se encontró una serie de reservas de ID {id_serie} a eliminar')
+
+	session.delete(db_serie)
+	_registrar_cambios(session, SerieReserva.__tablename__)
 	session.commit()
 
-	return list(resultado)
+	return db_serie
 
-def delete_reservas(session: _Session,
+def _preparar_borrado_reservas(
 	rango: Optional[tuple[int, int]] = None,
 	id_cancha: Optional[int] = None,
 	dia: Optional[date | tuple[date, date]] = None,
@@ -575,62 +1779,35 @@ def delete_reservas(session: _Session,
 	teléfono: Optional[str] = None,
 	nombre_contacto: Optional[str] = None,
 	nombre_cancha: Optional[str] = None,
-) -> list[Reserva]:
-	"""Elimina Canchas que coincidan con los criterios indicados y las devuelve en una lista"""
-
-	criterios = []
-
-	if id_cancha is not None:
-		if not isinstance(id_cancha, int):
-			raise HTTPException(
-				status.HTTP_400_BAD_REQUEST,
-				'La ID de Cancha de la Reserva debe ser un entero',
-			)
-
-		criterios.append(Reserva.id_cancha == id_cancha)
-
-	_agregar_criterio_de_rango_u_valor_date(criterios, columna=Reserva.dia, argumento=dia)
-	_agregar_criterio_de_rango_u_valor_int(criterios, columna=Reserva.hora, argumento=hora)
-	_agregar_criterio_de_rango_u_valor_int(criterios, columna=Reserva.duración_minutos, argumento=duración_minutos)
-
-	if teléfono is not None:
-		teléfono = verificar_y_normalizar_teléfono(teléfono)
-		criterios.append(Reserva.teléfono == teléfono)
-
-	if nombre_contacto is not None:
-		if not isinstance(nombre_contacto, str) or len(nombre_contacto) == 0:
-			raise HTTPException(
-				status.HTTP_400_BAD_REQUEST,
-				'El criterio de nombre de contacto debe ser un string no vacío',
-			)
-
-		nombre_maqueta = (
-			nombre_contacto
-			.replace('*', '%')
-			.replace('_', r'\_')
+	tamaño_lote: Optional[int] = None,
+) -> tuple[consultas.FiltrosReservas, dict]:
+	if id_cancha is not None and not isinstance(id_cancha, int):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'La ID de Cancha de la Reserva debe ser un entero',
 		)
-		criterios.append(Reserva.nombre_contacto.ilike(nombre_maqueta, escape='\\'))
-
-	subselect = select(Reserva.id)
 
-	if nombre_cancha is not None:
-		if not isinstance(nombre_cancha, str) or len(nombre_cancha) == 0:
-			raise HTTPException(
-				status.HTTP_400_BAD_REQUEST,
-				'El criterio de nombre de cancha debe ser un string no vacío',
-			)
-
-		subselect = subselect.join(Cancha, Cancha.id == Reserva.id_cancha)
+	if nombre_contacto is not None and (not isinstance(nombre_contacto, str) or len(nombre_contacto) == 0):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El criterio de nombre de contacto debe ser un string no vacío',
+		)
 
-		nombre_maqueta = (
-			nombre_cancha
-			.replace('*', '%')
-			.replace('_', r'\_')
+	if nombre_cancha is not None and (not isinstance(nombre_cancha, str) or len(nombre_cancha) == 0):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El criterio de nombre de cancha debe ser un string no vacío',
 		)
-		criterios.append(Cancha.nombre.ilike(nombre_maqueta, escape='\\'))
 
-	if len(criterios) > 0:
-		subselect = subselect.where(and_(*criterios))
+	filtros, parámetros = consultas.filtros_reservas(
+		id_cancha=id_cancha,
+		dia=dia,
+		hora=hora,
+		duración_minutos=duración_minutos,
+		teléfono=verificar_y_normalizar_teléfono(teléfono) if teléfono is not None else None,
+		nombre_contacto=nombre_contacto,
+		nombre_cancha=nombre_cancha,
+	)
 
 	if rango is not None:
 		if (
@@ -643,20 +1820,60 @@ def delete_reservas(session: _Session,
 				'El rango de resultados debe ser una tupla de 2 enteros',
 			)
 
-		subselect = (subselect
-			.order_by(Reserva.id)
-			.offset(rango[0])
-			.limit(rango[1] - rango[0])
-		)
+		parámetros.update(consultas.parámetros_rango(rango))
 
-	stmt = (
-		delete(Reserva)
-		.where(Reserva.id.in_(subselect))
-		.returning(Reserva)
-		.execution_options(synchronize_session='fetch')
+	_verificar_tamaño_lote(tamaño_lote, rango)
+
+	return filtros, parámetros
+
+def _eliminar_reservas(session: _Session, devolver: consultas.TipoDevolución, **criterios) -> Iterator[list]:
+	filtros, parámetros = _preparar_borrado_reservas(**criterios)
+	tamaño_lote = criterios.get('tamaño_lote')
+	stmt = consultas.sentencia_borrar_reservas(filtros,
+		rango=criterios.get('rango') is not None,
+		lote=tamaño_lote is not None,
+		devolver=devolver,
 	)
 
-	resultado = session.execute(stmt).scalars().all()
-	session.commit()
+	return _eliminar_en_lotes(session, stmt, parámetros, tamaño_lote, devolver, (Reserva.__tablename__,))
 
-	return list(resultado)
+def delete_reservas(session: _Session,
+	rango: Optional[tuple[int, int]] = None,
+	id_cancha: Optional[int] = None,
+	dia: Optional[date | tuple[date, date]] = None,
+	hora: Optional[int | tuple[int, int]] = None,
+	duración_minutos: Optional[int | tuple[int, int]] = None,
+	teléfono: Optional[str] = None,
+	nombre_contacto: Optional[str] = None,
+	nombre_cancha: Optional[str] = None,
+	tamaño_lote: Optional[int] = None,
+) -> list[Reserva]:
+	"""
+	Elimina Reservas que coincidan con los criterios indicados y las devuelve en una lista.
+	Con tamaño_lote, elimina de a esa cantidad de Reservas por transacción
+	"""
+
+	lotes = _eliminar_reservas(session, 'entidades',
+		rango=rango,
+		id_cancha=id_cancha,
+		dia=dia,
+		hora=hora,
+		duración_minutos=duración_minutos,
+		teléfono=teléfono,
+		nombre_contacto=nombre_contacto,
+		nombre_cancha=nombre_cancha,
+		tamaño_lote=tamaño_lote,
+	)
+
+	return [reserva for lote in lotes for reserva in lote]
+
+def delete_reservas_cantidad(session: _Session, **criterios) -> int:
+	"""Acepta los mismos criterios que delete_reservas, pero solo devuelve la cantidad de Reservas eliminadas"""
+	return sum(len(lote) for lote in _eliminar_reservas(session, 'ids', **criterios))
+
+def iterar_reservas_eliminadas(session: _Session, **criterios) -> Iterator[list[Row]]:
+	"""
+	Acepta los mismos criterios que delete_reservas, pero elimina cada lote recién al recorrerlo y lo devuelve
+	como filas planas con las columnas de consultas.CAMPOS_RESERVA. Los criterios se validan antes de devolver el iterador
+	"""
+	return _eliminar_reservas(session, 'filas', **criterios)
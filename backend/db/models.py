@@ -1,8 +1,11 @@
-from datetime import date
-from typing import List
-from sqlalchemy import Integer, SmallInteger, String, Boolean, Date, ForeignKey
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import (
+	BigInteger, Integer, SmallInteger, String, Boolean, Date, DateTime, ForeignKey, CheckConstraint, Computed, DDL, Index,
+	event,
+)
+from sqlalchemy.dialects.postgresql import TSRANGE, ExcludeConstraint, Range
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from . import engine
 
 class Base(DeclarativeBase):
 	pass
@@ -13,8 +16,27 @@ class Cancha(Base):
 	id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 	nombre: Mapped[str] = mapped_column(String(40))
 	techada: Mapped[bool] = mapped_column(Boolean, nullable=False)
+	# Se incrementa con cada modificación, para detectar ediciones concurrentes (If-Match)
+	versión: Mapped[int] = mapped_column(Integer, nullable=False, server_default='1')
 
-	reservas: Mapped[List['Reserva']] = relationship('Reserva', cascade='all, delete-orphan', back_populates='cancha')
+	# La BDD elimina en cascada las Reservas y series de una Cancha eliminada, sin que el ORM tenga que cargarlas
+	reservas: Mapped[List['Reserva']] = relationship(
+		'Reserva',
+		cascade='all, delete-orphan',
+		back_populates='cancha',
+		passive_deletes=True,
+	)
+	series: Mapped[List['SerieReserva']] = relationship(
+		'SerieReserva',
+		cascade='all, delete-orphan',
+		back_populates='cancha',
+		passive_deletes=True,
+	)
+
+	__table_args__ = (
+		# Búsquedas de nombre con comodines (ILIKE)
+		Index('ix_canchas_nombre_trgm', 'nombre', postgresql_using='gin', postgresql_ops={'nombre': 'gin_trgm_ops'}),
+	)
 
 class Reserva(Base):
 	__tablename__ = 'reservas'
@@ -25,15 +47,125 @@ class Reserva(Base):
 	duración_minutos: Mapped[int] = mapped_column(Integer, nullable=False)
 	teléfono: Mapped[str] = mapped_column(String, nullable=False)
 	nombre_contacto: Mapped[str] = mapped_column(String, nullable=False)
-	id_cancha: Mapped[int] = mapped_column(ForeignKey('canchas.id'), nullable=False)
+	id_cancha: Mapped[int] = mapped_column(ForeignKey('canchas.id', ondelete='CASCADE'), nullable=False)
+	versión: Mapped[int] = mapped_column(Integer, nullable=False, server_default='1')
+	periodo: Mapped[Range[datetime]] = mapped_column(
+		TSRANGE,
+		Computed(
+			"tsrange(dia + hora * interval '1 hour', "
+			"dia + hora * interval '1 hour' + \"duración_minutos\" * interval '1 minute')",
+			persisted=True,
+		),
+	)
 
 	cancha: Mapped['Cancha'] = relationship('Cancha', back_populates='reservas')
 
+	__table_args__ = (
+		ExcludeConstraint(
+			('id_cancha', '='),
+			('periodo', '&&'),
+			name='reservas_sin_solapamiento',
+			using='gist',
+		),
+		Index('ix_reservas_cancha_dia_hora', 'id_cancha', 'dia', 'hora'),
+		# Paginación por clave (dia, hora, id) sin filtrar por cancha: cada página recorre solo sus filas en el índice
+		Index('ix_reservas_dia_hora_id', 'dia', 'hora', 'id'),
+		# Reservas de un cliente, ordenadas por fecha: una sola búsqueda por rango en el índice
+		Index('ix_reservas_telefono_dia_hora', 'teléfono', 'dia', 'hora'),
+		# Búsquedas de nombre de contacto con comodines (ILIKE)
+		Index(
+			'ix_reservas_nombre_contacto_trgm',
+			'nombre_contacto',
+			postgresql_using='gin',
+			postgresql_ops={'nombre_contacto': 'gin_trgm_ops'},
+		),
+	)
+
+class SerieReserva(Base):
+	"""
+	Reserva que se repite cada semanas_intervalo semanas, el mismo día de la semana que dia_inicio,
+	hasta el día hasta inclusive.
+	Se guarda una sola fila por serie y sus ocurrencias se calculan al consultarlas
+	"""
+
+	__tablename__ = 'series_reservas'
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True)
+	id_cancha: Mapped[int] = mapped_column(ForeignKey('canchas.id', ondelete='CASCADE'), nullable=False)
+	dia_inicio: Mapped[date] = mapped_column(Date, nullable=False)
+	hasta: Mapped[date] = mapped_column(Date, nullable=False)
+	semanas_intervalo: Mapped[int] = mapped_column(SmallInteger, nullable=False)
+	hora: Mapped[int] = mapped_column(SmallInteger, nullable=False)
+	duración_minutos: Mapped[int] = mapped_column(Integer, nullable=False)
+	teléfono: Mapped[str] = mapped_column(String, nullable=False)
+	nombre_contacto: Mapped[str] = mapped_column(String, nullable=False)
+
+	cancha: Mapped['Cancha'] = relationship('Cancha', back_populates='series')
+
+	__table_args__ = (
+		CheckConstraint('hasta >= dia_inicio', name='series_reservas_hasta_posterior'),
+		CheckConstraint('semanas_intervalo >= 1', name='series_reservas_intervalo_positivo'),
+		Index('ix_series_reservas_cancha_periodo', 'id_cancha', 'dia_inicio', 'hasta'),
+		Index('ix_series_reservas_telefono', 'teléfono'),
+	)
+
+	def fechas(self, desde: Optional[date] = None, hasta: Optional[date] = None) -> list[date]:
+		"""Devuelve las fechas de las ocurrencias de la serie comprendidas en [desde, hasta], ambos inclusive"""
+
+		paso = timedelta(weeks=self.semanas_intervalo)
+		dia = self.dia_inicio
+
+		if desde is not None and desde > dia:
+			# Primera ocurrencia en o después de desde, sin recorrer las anteriores
+			dia += paso * -(-(desde - dia).days // paso.days)
+
+		última = self.hasta if hasta is None else min(self.hasta, hasta)
+		fechas = []
+
+		while dia <= última:
+			fechas.append(dia)
+			dia += paso
+
+		return fechas
+
+	def ocurrencias(self, desde: Optional[date] = None, hasta: Optional[date] = None) -> list['OcurrenciaSerie']:
+		"""Expande las ocurrencias de la serie comprendidas en [desde, hasta], ambos inclusive"""
+		return [OcurrenciaSerie(self, dia) for dia in self.fechas(desde, hasta)]
+
+class OcurrenciaSerie:
+	"""Ocurrencia de una SerieReserva en un día. No se guarda en la BDD"""
+
+	id = None
+
+	def __init__(self, serie: SerieReserva, dia: date):
+		self.id_serie = serie.id
+		self.id_cancha = serie.id_cancha
+		self.dia = dia
+		self.hora = serie.hora
+		self.duración_minutos = serie.duración_minutos
+		self.teléfono = serie.teléfono
+		self.nombre_contacto = serie.nombre_contacto
+
+class VersiónTabla(Base):
+	"""
+	Contador de cambios de una tabla, que se incrementa al confirmar cada escritura hecha a través de crud.
+	Identifica el estado de los listados para responder peticiones condicionales (ETag/Last-Modified)
+	"""
+
+	__tablename__ = 'versiones_tablas'
+
+	tabla: Mapped[str] = mapped_column(String, primary_key=True)
+	versión: Mapped[int] = mapped_column(BigInteger, nullable=False)
+	modificada: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
 class ReservaCompleta:
-	reserva: Reserva
+	reserva: Reserva | OcurrenciaSerie
 	cancha: Cancha
-	def __init__(self, reserva: Reserva, cancha: Cancha):
+	def __init__(self, reserva: Reserva | OcurrenciaSerie, cancha: Cancha):
 		self.reserva = reserva
 		self.cancha = cancha
 
-Base.metadata.create_all(engine)
+# La restricción de exclusión compara id_cancha por igualdad dentro de un índice GiST, lo cual requiere btree_gist
+event.listen(Base.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+# Los índices GIN de trigramas aceleran los ILIKE con comodines, lo cual requiere pg_trgm
+event.listen(Base.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
@@ -0,0 +1,37 @@
+from bisect import bisect_left
+from datetime import date
+from typing import Optional
+
+MINUTOS_DIA = 60 * 24
+
+# (minuto_inicio, minuto_fin, id_reserva). minuto_fin puede exceder MINUTOS_DIA si la reserva termina al día siguiente
+Intervalo = tuple[int, int, int]
+
+def minuto_absoluto(dia: date, hora: int) -> int:
+	"""Minuto de inicio de un horario contado desde el origen del calendario, para comparar horarios de distintos días"""
+	return dia.toordinal() * MINUTOS_DIA + 60 * hora
+
+def buscar_solapamientos(
+	intervalos: list[Intervalo],
+	minuto_inicio: int,
+	minuto_fin: int,
+	id_reserva: Optional[int] = None,
+) -> list[int]:
+	"""Busca en una lista ordenada de intervalos disjuntos los que se solapan con [minuto_inicio, minuto_fin)"""
+
+	# Los intervalos que empiezan antes de minuto_fin están a la izquierda de esta posición. Al ser disjuntos,
+	# los que además terminan después de minuto_inicio forman un bloque contiguo al final de ese tramo
+	i = bisect_left(intervalos, (minuto_fin,))
+	solapamientos = []
+
+	while i > 0:
+		i -= 1
+		_, fin, id_intervalo = intervalos[i]
+
+		if fin <= minuto_inicio:
+			break
+
+		if id_intervalo != id_reserva:
+			solapamientos.append(id_intervalo)
+
+	return solapamientos
@@ -1,4 +1,5 @@
-from datetime import date
+from datetime import date, datetime
+from typing import Optional
 from pydantic import BaseModel, ConfigDict
 
 class CanchaBase(BaseModel):
@@ -10,6 +11,7 @@ class CanchaCreate(CanchaBase):
 
 class CanchaSchema(CanchaBase):
 	id: int
+	versión: int
 	model_config = ConfigDict(from_attributes=True)
 
 class ReservaBase(BaseModel):
@@ -25,8 +27,74 @@ class ReservaCreate(ReservaBase):
 
 class ReservaSchema(ReservaBase):
 	id: int
+	versión: int
 	model_config = ConfigDict(arbitrary_types_allowed=True, from_attributes=True)
 
+class OcurrenciaSerieSchema(ReservaBase):
+	id_serie: int
+	model_config = ConfigDict(from_attributes=True)
+
 class ReservaCompletaSchema(BaseModel):
-	reserva: ReservaSchema
+	reserva: ReservaSchema | OcurrenciaSerieSchema
 	cancha: CanchaSchema
+
+class SerieReservaSchema(BaseModel):
+	id: int
+	id_cancha: int
+	dia_inicio: date
+	hasta: date
+	semanas_intervalo: int
+	hora: int
+	duración_minutos: int
+	teléfono: str
+	nombre_contacto: str
+	model_config = ConfigDict(from_attributes=True)
+
+class SerieReservaCreate(BaseModel):
+	id_cancha: int
+	dia_inicio: date
+	hasta: date
+	semanas_intervalo: int = 1
+	hora: int
+	duración_minutos: int
+	teléfono: str
+	nombre_contacto: str
+
+class ResultadoReservaLote(BaseModel):
+	posición: int
+	status_code: int
+	id: Optional[int] = None
+	detalle: Optional[str] = None
+
+class ResultadoEliminación(BaseModel):
+	eliminadas: int
+
+class HuecoDisponible(BaseModel):
+	desde: datetime
+	hasta: datetime
+
+class DisponibilidadCancha(BaseModel):
+	id_cancha: int
+	huecos: list[HuecoDisponible]
+	horarios_reservables: list[datetime]
+
+class GrillaCancha(BaseModel):
+	id_cancha: int
+	# Mapa de bits de las franjas ocupadas, en base64 (URL-safe)
+	ocupación: str
+
+class GrillaDía(BaseModel):
+	dia: date
+	resolución_minutos: int
+	canchas: list[GrillaCancha]
+
+class EstadísticaOcupación(BaseModel):
+	"""Ocupación de un grupo. Solo se informan los campos por los que se agrupó"""
+
+	id_cancha: Optional[int] = None
+	dia: Optional[date] = None
+	dia_semana: Optional[int] = None
+	hora: Optional[int] = None
+	cantidad_reservas: int
+	minutos_reservados: int
+	ocupación_porcentaje: float
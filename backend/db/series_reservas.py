@@ -0,0 +1,180 @@
+"""
+Series de Reservas: condiciones SQL sobre sus ocurrencias, expansión de las ocurrencias para las consultas y búsqueda
+de los solapamientos de una serie nueva. Cada serie se guarda en una sola fila y sus ocurrencias se calculan al usarlas.
+Las escrituras, con sus bloqueos y versiones de tablas, quedan en crud
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import ColumnElement, Date, DateTime, and_, column, func, literal, or_, select
+from sqlalchemy.orm import Session as _Session
+from . import consultas
+from .models import OcurrenciaSerie, Reserva, ReservaCompleta, SerieReserva
+from .ocupacion import MINUTOS_DIA, buscar_solapamientos, minuto_absoluto
+from .schemas import SerieReservaCreate
+from .telefonos import verificar_y_normalizar_teléfono
+
+_MÁXIMO_DÍAS_SERIE = 366
+
+def verificar_periodo(serie: SerieReservaCreate):
+	"""Verifica la frecuencia de una serie nueva y que no dure más de _MÁXIMO_DÍAS_SERIE días"""
+
+	if not isinstance(serie.semanas_intervalo, int) or serie.semanas_intervalo < 1:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'La serie debe repetirse cada 1 o más semanas',
+		)
+
+	if serie.hasta < serie.dia_inicio or (serie.hasta - serie.dia_inicio).days > _MÁXIMO_DÍAS_SERIE:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			f'La serie debe terminar después de empezar y no puede durar más de {_MÁXIMO_DÍAS_SERIE} días',
+		)
+
+def ocurre_el(dia: date | ColumnElement[date]):
+	"""Condición SQL de que una SerieReserva tenga una ocurrencia en el día indicado, que puede ser una expresión SQL"""
+
+	if isinstance(dia, date):
+		dia = literal(dia, Date)
+
+	return and_(
+		SerieReserva.dia_inicio <= dia,
+		SerieReserva.hasta >= dia,
+		(dia - SerieReserva.dia_inicio) % (7 * SerieReserva.semanas_intervalo) == 0,
+	)
+
+def condición_conflicto(
+	id_cancha: int | ColumnElement[int],
+	dia: date | ColumnElement[date],
+	minuto_inicio: int | ColumnElement[int],
+	minuto_fin: int | ColumnElement[int],
+):
+	"""Condición SQL de que una SerieReserva de la Cancha tenga una ocurrencia que se solape con el horario indicado"""
+
+	# Las ocurrencias de series que pueden solaparse empiezan el día anterior, el mismo día o el siguiente
+	return and_(
+		SerieReserva.id_cancha == id_cancha,
+		or_(*(
+			and_(
+				ocurre_el(dia + timedelta(days=desfase) if isinstance(dia, date) else dia + desfase),
+				60 * SerieReserva.hora + desfase * MINUTOS_DIA < minuto_fin,
+				60 * SerieReserva.hora + desfase * MINUTOS_DIA + SerieReserva.duración_minutos > minuto_inicio,
+			)
+			for desfase in (-1, 0, 1)
+		)),
+	)
+
+def ocurrencias_en_ventana(session: _Session,
+	ids_cancha: Optional[Iterable[int]],
+	desde: date,
+	hasta: date,
+) -> list[OcurrenciaSerie]:
+	"""Expande las ocurrencias de las series de las Canchas indicadas (o de todas) comprendidas en [desde, hasta]"""
+
+	stmt = select(SerieReserva).where(SerieReserva.dia_inicio <= hasta, SerieReserva.hasta >= desde)
+
+	if ids_cancha is not None:
+		stmt = stmt.where(SerieReserva.id_cancha.in_(list(ids_cancha)))
+
+	return [ocurrencia for serie in session.execute(stmt).scalars() for ocurrencia in serie.ocurrencias(desde, hasta)]
+
+def get_ocurrencias(session: _Session,
+	id_cancha: Optional[int] = None,
+	dia: Optional[date | tuple[date, date]] = None,
+	hora: Optional[int | tuple[int, int]] = None,
+	duración_minutos: Optional[int | tuple[int, int]] = None,
+	teléfono: Optional[str] = None,
+	nombre_contacto: Optional[str] = None,
+	nombre_cancha: Optional[str] = None,
+	full: bool = False,
+) -> list[OcurrenciaSerie] | list[ReservaCompleta]:
+	"""Filtra las series con los mismos criterios que las Reservas y expande solo sus ocurrencias en los días pedidos"""
+
+	filtros, parámetros = consultas.filtros_reservas(
+		id_cancha=id_cancha or None,
+		dia=dia,
+		hora=hora,
+		duración_minutos=duración_minutos,
+		teléfono=verificar_y_normalizar_teléfono(teléfono) if teléfono is not None else None,
+		nombre_contacto=nombre_contacto,
+		nombre_cancha=nombre_cancha,
+	)
+	desde, hasta = parámetros.get('dia_min'), parámetros.get('dia_max')
+	ocurrencias = []
+
+	for serie, cancha in session.execute(consultas.sentencia_series(filtros), parámetros):
+		for ocurrencia in serie.ocurrencias(desde, hasta):
+			ocurrencias.append(ReservaCompleta(reserva=ocurrencia, cancha=cancha) if full else ocurrencia)
+
+	return ocurrencias
+
+def conflictos(session: _Session, serie: SerieReserva, fechas: list[date]) -> tuple[list[int], set[int]]:
+	"""
+	Busca las Reservas y las demás series de la Cancha que se solapan con alguna de las fechas de una serie nueva.
+	Devuelve las IDs de ambas. Quien llama debe tener bloqueados los horarios de la Cancha
+	"""
+
+	# Una sola consulta por rango para todas las ocurrencias, expandidas por la BDD
+	ocurrencias = (
+		func.generate_series(
+			datetime.combine(fechas[0], time(serie.hora)),
+			datetime.combine(fechas[-1], time(serie.hora)),
+			timedelta(weeks=serie.semanas_intervalo),
+		)
+		.table_valued(column('inicio', DateTime))
+		.render_derived(name='ocurrencias')
+	)
+	stmt_reservas = (
+		select(Reserva.id)
+		.distinct()
+		.join(ocurrencias, Reserva.periodo.overlaps(
+			func.tsrange(ocurrencias.c.inicio, ocurrencias.c.inicio + timedelta(minutes=serie.duración_minutos)),
+		))
+		.where(Reserva.id_cancha == serie.id_cancha)
+	)
+	conflictos_reservas = list(session.execute(stmt_reservas).scalars())
+
+	# Las ocurrencias de las demás series son disjuntas entre sí, así que se comparan con búsqueda binaria
+	ocupados = sorted(
+		(
+			inicio := minuto_absoluto(ocurrencia.dia, ocurrencia.hora),
+			inicio + ocurrencia.duración_minutos,
+			ocurrencia.id_serie,
+		)
+		for ocurrencia in ocurrencias_en_ventana(
+			session,
+			[serie.id_cancha],
+			fechas[0] - timedelta(days=1),
+			fechas[-1] + timedelta(days=1),
+		)
+	)
+	conflictos_series = {
+		id_serie
+		for dia in fechas
+		for id_serie in buscar_solapamientos(
+			ocupados,
+			minuto_absoluto(dia, serie.hora),
+			minuto_absoluto(dia, serie.hora) + serie.duración_minutos,
+		)
+	}
+
+	return conflictos_reservas, conflictos_series
+
+def get_serie(session: _Session,
+	id_serie: int,
+) -> SerieReserva | None:
+	"""Busca una serie de Reservas en la BDD con la ID especificada y la devuelve"""
+	return session.get(SerieReserva, id_serie)
+
+def get_series(session: _Session,
+	id_cancha: Optional[int] = None,
+) -> list[SerieReserva]:
+	"""Devuelve las series de Reservas registradas, opcionalmente solo las de una Cancha"""
+
+	stmt = select(SerieReserva).order_by(SerieReserva.id)
+
+	if id_cancha is not None:
+		stmt = stmt.where(SerieReserva.id_cancha == id_cancha)
+
+	return list(session.execute(stmt).scalars())
@@ -0,0 +1,86 @@
+import re
+from functools import lru_cache
+from typing import Iterable
+from fastapi import HTTPException, status
+from . import getenv_int
+
+PATRÓN_TELÉFONO = re.compile(r'^(?:(\+\d{1,2})\s?)?(?:(\d)\s?)?\(?(\d{3})\)?[\s.-]?(\d{3})[\s.-]?(\d{4})$')
+
+def _normalizar(teléfono: str) -> str:
+	teléfono = teléfono.strip()
+
+	if len(teléfono) == 0:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El número de teléfono debe ser un string y no puede estar vacío',
+		)
+
+	partes = PATRÓN_TELÉFONO.match(teléfono)
+
+	if partes is None:
+		raise HTTPException(
+			status.HTTP_422_UNPROCESSABLE_ENTITY,
+			f'"{teléfono}" no es un número de teléfono válido. Debe seguir la forma "(+XX)? (X)? XXX XXX-XXXX" o similares',
+		)
+
+	return ''.join(parte for parte in partes.groups() if parte is not None)
+
+class NormalizadorTeléfonos:
+	"""
+	Valida y normaliza números de teléfono con un patrón precompilado, recordando los últimos números válidos
+	normalizados (LRU), ya que las mismas personas reservan y buscan sus reservas una y otra vez.
+	Los números inválidos no se recuerdan: cada intento vuelve a producir su error
+	"""
+
+	def __init__(self, capacidad: int):
+		self.capacidad = capacidad
+		self._normalizar = lru_cache(maxsize=capacidad)(_normalizar) if capacidad > 0 else _normalizar
+
+	def normalizar(self, teléfono) -> str:
+		"""Devuelve el teléfono sin espacios ni separadores, o lanza HTTPException si no es válido"""
+
+		# Se verifica antes de buscar en la caché, que requiere claves hasheables
+		if not isinstance(teléfono, str):
+			raise HTTPException(
+				status.HTTP_400_BAD_REQUEST,
+				'El número de teléfono debe ser un string',
+			)
+
+		return self._normalizar(teléfono)
+
+	def normalizar_varios(self, teléfonos: Iterable) -> list[str | HTTPException]:
+		"""
+		Normaliza varios teléfonos de una vez, normalizando una sola vez cada número repetido. Devuelve, en el mismo orden,
+		el teléfono normalizado o la HTTPException que lo rechazó, para que cada elemento de un lote informe su propio error
+		"""
+
+		resultados: dict[str, str | HTTPException] = {}
+		normalizados: list[str | HTTPException] = []
+
+		for teléfono in teléfonos:
+			if isinstance(teléfono, str) and teléfono in resultados:
+				normalizados.append(resultados[teléfono])
+				continue
+
+			try:
+				resultado = self.normalizar(teléfono)
+			except HTTPException as exc:
+				resultado = exc
+
+			if isinstance(teléfono, str):
+				resultados[teléfono] = resultado
+
+			normalizados.append(resultado)
+
+		return normalizados
+
+	def limpiar(self):
+		"""Olvida los números recordados"""
+
+		if self.capacidad > 0:
+			self._normalizar.cache_clear()
+
+normalizador_teléfonos = NormalizadorTeléfonos(capacidad=getenv_int('CACHE_TELEFONOS_CAPACIDAD', 4096))
+
+def verificar_y_normalizar_teléfono(teléfono) -> str:
+	return normalizador_teléfonos.normalizar(teléfono)
@@ -0,0 +1,303 @@
+"""
+Instrumentación por petición: cantidad de consultas SQL, tiempo en la BDD, tiempo del handler y de
+validación/serialización. Se informa en la cabecera Server-Timing de cada respuesta y se acumula en
+métricas con formato de texto de Prometheus, servidas en GET /metrics
+"""
+
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from inspect import iscoroutinefunction
+from os import getenv
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Optional
+from fastapi import FastAPI, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import Engine, event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+_CLAVE_INICIOS = 'instrumentacion_inicios'
+
+def _leer_umbral_consulta_lenta() -> float:
+	valor = getenv('SQL_CONSULTA_LENTA_MS', '200').strip()
+
+	try:
+		return float(valor) / 1000
+	except ValueError as exc:
+		raise ValueError(f'SQL_CONSULTA_LENTA_MS debe ser un número. Recibido: {valor}') from exc
+
+@dataclass
+class Medición:
+	"""Tiempos acumulados durante una petición, en segundos"""
+
+	consultas: int = 0
+	tiempo_bdd: float = 0
+	tiempo_handler: float = 0
+	tiempo_ruta: float = 0
+	consultas_lentas: int = 0
+
+	@property
+	def tiempo_serialización(self) -> float:
+		"""Tiempo de la ruta fuera del handler: validación de parámetros, dependencias y serialización de la respuesta"""
+		return max(self.tiempo_ruta - self.tiempo_handler, 0)
+
+_medición_actual: ContextVar[Optional[Medición]] = ContextVar('medición_actual', default=None)
+
+def medición_actual() -> Medición | None:
+	return _medición_actual.get()
+
+# Métricas
+
+_BUCKETS_DURACIÓN = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+def _escapar(valor) -> str:
+	return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _formatear_etiquetas(nombres: tuple[str, ...], valores: tuple, extra: str = '') -> str:
+	pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+
+	if extra:
+		pares.append(extra)
+
+	return '{' + ','.join(pares) + '}' if len(pares) > 0 else ''
+
+class _Contador:
+	def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()):
+		self.nombre = nombre
+		self.ayuda = ayuda
+		self.etiquetas = etiquetas
+		self._valores: dict[tuple, float] = {}
+
+	def sumar(self, valores: tuple = (), cantidad: float = 1):
+		self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+	def exponer(self) -> list[str]:
+		líneas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} counter']
+
+		for valores, total in sorted(self._valores.items()):
+			líneas.append(f'{self.nombre}{_formatear_etiquetas(self.etiquetas, valores)} {total:g}')
+
+		return líneas
+
+class _Histograma:
+	def __init__(self, nombre: str, ayuda: str, buckets: tuple[float, ...], etiquetas: tuple[str, ...] = ()):
+		self.nombre = nombre
+		self.ayuda = ayuda
+		self.buckets = buckets
+		self.etiquetas = etiquetas
+		# Por cada combinación de etiquetas: conteos por bucket (no acumulados), suma y cantidad
+		self._series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+	def observar(self, valores: tuple, valor: float):
+		conteos, suma_y_cantidad = self._series.setdefault(valores, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+		conteos[bisect_left(self.buckets, valor)] += 1
+		suma_y_cantidad[0] += valor
+		suma_y_cantidad[1] += 1
+
+	def exponer(self) -> list[str]:
+		líneas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+
+		for valores, (conteos, (suma, cantidad)) in sorted(self._series.items()):
+			acumulado = 0
+
+			for límite, conteo in zip((*self.buckets, '+Inf'), conteos):
+				acumulado += conteo
+				le = 'le="' + (límite if isinstance(límite, str) else f'{límite:g}') + '"'
+				líneas.append(f'{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, valores, le)} {acumulado}')
+
+			líneas.append(f'{self.nombre}_sum{_formatear_etiquetas(self.etiquetas, valores)} {suma:g}')
+			líneas.append(f'{self.nombre}_count{_formatear_etiquetas(self.etiquetas, valores)} {cantidad}')
+
+		return líneas
+
+@dataclass
+class RegistroMétricas:
+	peticiones: _Contador = field(default_factory=lambda: _Contador(
+		'http_peticiones_total', 'Peticiones HTTP atendidas', ('metodo', 'ruta', 'status'),
+	))
+	duración: _Histograma = field(default_factory=lambda: _Histograma(
+		'http_peticion_duracion_segundos', 'Duración total de las peticiones HTTP', _BUCKETS_DURACIÓN, ('metodo', 'ruta'),
+	))
+	consultas: _Histograma = field(default_factory=lambda: _Histograma(
+		'sql_consultas_por_peticion', 'Consultas SQL ejecutadas por petición', _BUCKETS_CONSULTAS, ('metodo', 'ruta'),
+	))
+	tiempo_bdd: _Contador = field(default_factory=lambda: _Contador(
+		'sql_duracion_segundos_total', 'Tiempo acumulado en consultas SQL', ('metodo', 'ruta'),
+	))
+	consultas_lentas: _Contador = field(default_factory=lambda: _Contador(
+		'sql_consultas_lentas_total', 'Consultas SQL que superaron SQL_CONSULTA_LENTA_MS',
+	))
+	_lock: Lock = field(default_factory=Lock)
+
+	def registrar(self, método: str, ruta: str, status: int, duración: float, medición: Medición):
+		with self._lock:
+			self.peticiones.sumar((método, ruta, status))
+			self.duración.observar((método, ruta), duración)
+			self.consultas.observar((método, ruta), medición.consultas)
+			self.tiempo_bdd.sumar((método, ruta), medición.tiempo_bdd)
+
+	def registrar_consulta_lenta(self):
+		with self._lock:
+			self.consultas_lentas.sumar()
+
+	def exponer(self) -> str:
+		with self._lock:
+			métricas = (self.peticiones, self.duración, self.consultas, self.tiempo_bdd, self.consultas_lentas)
+			return '\n'.join(línea for métrica in métricas for línea in métrica.exponer()) + '\n'
+
+métricas = RegistroMétricas()
+
+# Consultas SQL
+
+_umbral_consulta_lenta = _leer_umbral_consulta_lenta()
+
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+	conn.info.setdefault(_CLAVE_INICIOS, []).append(perf_counter())
+
+def _después_de_consulta(conn, cursor, statement, parameters, context, executemany):
+	inicios = conn.info.get(_CLAVE_INICIOS)
+
+	if not inicios:
+		return
+
+	duración = perf_counter() - inicios.pop()
+	medición = _medición_actual.get()
+
+	if medición is not None:
+		medición.consultas += 1
+		medición.tiempo_bdd += duración
+
+	if duración >= _umbral_consulta_lenta:
+		métricas.registrar_consulta_lenta()
+
+		if medición is not None:
+			medición.consultas_lentas += 1
+
+		logger.warning('Consulta SQL lenta (%.1f ms): %s', duración * 1000, ' '.join(statement.split())[:1000])
+
+def _error_de_consulta(contexto):
+	# Una consulta fallida no dispara after_cursor_execute, así que se descarta su inicio
+	if contexto.connection is not None:
+		inicios = contexto.connection.info.get(_CLAVE_INICIOS)
+
+		if inicios:
+			inicios.pop()
+
+def instalar_eventos_sql():
+	"""Mide todas las consultas de todos los engines, incluido el sincrónico subyacente del engine asíncrono"""
+
+	if not event.contains(Engine, 'before_cursor_execute', _antes_de_consulta):
+		event.listen(Engine, 'before_cursor_execute', _antes_de_consulta)
+		event.listen(Engine, 'after_cursor_execute', _después_de_consulta)
+		event.listen(Engine, 'handle_error', _error_de_consulta)
+
+# Rutas y middleware
+
+def _medir_handler(endpoint: Callable) -> Callable:
+	if iscoroutinefunction(endpoint):
+		@wraps(endpoint)
+		async def endpoint_medido(*args, **kwargs):
+			inicio = perf_counter()
+
+			try:
+				return await endpoint(*args, **kwargs)
+			finally:
+				medición = _medición_actual.get()
+
+				if medición is not None:
+					medición.tiempo_handler += perf_counter() - inicio
+	else:
+		@wraps(endpoint)
+		def endpoint_medido(*args, **kwargs):
+			inicio = perf_counter()
+
+			try:
+				return endpoint(*args, **kwargs)
+			finally:
+				medición = _medición_actual.get()
+
+				if medición is not None:
+					medición.tiempo_handler += perf_counter() - inicio
+
+	return endpoint_medido
+
+class RutaInstrumentada(APIRoute):
+	"""Ruta que mide por separado el tiempo de su handler y el del procesamiento que FastAPI hace alrededor"""
+
+	def __init__(self, path: str, endpoint: Callable, **kwargs):
+		super().__init__(path, _medir_handler(endpoint), **kwargs)
+
+	def get_route_handler(self):
+		manejar = super().get_route_handler()
+
+		async def manejar_medido(request):
+			inicio = perf_counter()
+
+			try:
+				return await manejar(request)
+			finally:
+				medición = _medición_actual.get()
+
+				if medición is not None:
+					medición.tiempo_ruta += perf_counter() - inicio
+
+		return manejar_medido
+
+def _server_timing(medición: Medición, total: float) -> str:
+	return ', '.join((
+		f'bdd;dur={medición.tiempo_bdd * 1000:.2f};desc="{medición.consultas} consultas"',
+		f'handler;dur={medición.tiempo_handler * 1000:.2f}',
+		f'serializacion;dur={medición.tiempo_serialización * 1000:.2f}',
+		f'total;dur={total * 1000:.2f}',
+	))
+
+class MiddlewareInstrumentación:
+	"""Middleware ASGI que mide cada petición HTTP, agrega Server-Timing a la respuesta y actualiza las métricas"""
+
+	def __init__(self, app: ASGIApp):
+		self.app = app
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send):
+		if scope['type'] != 'http':
+			await self.app(scope, receive, send)
+			return
+
+		medición = Medición()
+		token = _medición_actual.set(medición)
+		inicio = perf_counter()
+		status = 500
+
+		async def enviar(mensaje: Message):
+			nonlocal status
+
+			if mensaje['type'] == 'http.response.start':
+				status = mensaje['status']
+				cabeceras = list(mensaje.get('headers', []))
+				cabeceras.append((b'server-timing', _server_timing(medición, perf_counter() - inicio).encode('latin-1')))
+				mensaje = {**mensaje, 'headers': cabeceras}
+
+			await send(mensaje)
+
+		try:
+			await self.app(scope, receive, enviar)
+		finally:
+			_medición_actual.reset(token)
+			# La plantilla de la ruta evita una serie de métricas distinta por cada ID consultada
+			ruta = getattr(scope.get('route'), 'path', None) or 'sin ruta'
+			métricas.registrar(scope['method'], ruta, status, perf_counter() - inicio, medición)
+
+def instalar(app: FastAPI):
+	"""Instala la instrumentación de consultas SQL y de peticiones en la aplicación, y expone GET /metrics"""
+
+	instalar_eventos_sql()
+	app.add_middleware(MiddlewareInstrumentación)
+
+	@app.get('/metrics', include_in_schema=False)
+	def exponer_métricas() -> Response:
+		return Response(métricas.exponer(), media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,16 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import db.models  # noqa: F401
+from db import cerrar_engines, create_models, estado_pools, getenv_bool
+from instrumentacion import RutaInstrumentada, instalar as instalar_instrumentación
 from routers import canchas, reservas
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	# Con el esquema administrado por migraciones, POSTGRES_CREAR_ESQUEMA=0 evita consultar la BDD al iniciar
+	if getenv_bool('POSTGRES_CREAR_ESQUEMA', True):
+		await run_in_threadpool(create_models)
+
+	yield
+
+	await cerrar_engines()
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = RutaInstrumentada
 
 @app.get('/', status_code=200)
 def raíz() -> str:
 	return 'Server en funcionamiento'
 
+@app.get('/estado/pools', status_code=200)
+def estado_de_pools() -> dict[str, dict[str, int]]:
+	return estado_pools()
+
 app.include_router(canchas.router)
 app.include_router(reservas.router)
+instalar_instrumentación(app)
 
 origins = ['http://127.0.0.1:3000', 'http://localhost:3000']
 app.add_middleware(
@@ -19,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "ETag", "X-Reservas-En-Conflicto", "X-Series-En-Conflicto"],
 )
 
 if __name__ == '__main__':
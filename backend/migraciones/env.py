@@ -0,0 +1,38 @@
+from logging.config import fileConfig
+from alembic import context
+from db import obtener_engine, obtener_pg_uri
+from db.models import Base
+
+config = context.config
+
+if config.config_file_name is not None:
+	fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+	"""Genera el SQL de las migraciones sin conectarse a la BDD (`alembic upgrade head --sql`)"""
+
+	context.configure(
+		url=obtener_pg_uri(),
+		target_metadata=target_metadata,
+		literal_binds=True,
+		dialect_opts={'paramstyle': 'named'},
+	)
+
+	with context.begin_transaction():
+		context.run_migrations()
+
+def run_migrations_online():
+	"""Aplica las migraciones sobre la BDD de POSTGRES_URI"""
+
+	with obtener_engine().connect() as connection:
+		context.configure(connection=connection, target_metadata=target_metadata)
+
+		with context.begin_transaction():
+			context.run_migrations()
+
+if context.is_offline_mode():
+	run_migrations_offline()
+else:
+	run_migrations_online()
@@ -0,0 +1,41 @@
+"""Esquema inicial de canchas y reservas
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+	# Mismo esquema que creaba la versión del servidor anterior a las migraciones, para poder marcar esas BDDs con 0001
+	op.create_table(
+		'canchas',
+		sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+		sa.Column('nombre', sa.String(length=40), nullable=False),
+		sa.Column('techada', sa.Boolean(), nullable=False),
+		sa.PrimaryKeyConstraint('id'),
+	)
+
+	op.create_table(
+		'reservas',
+		sa.Column('id', sa.Integer(), nullable=False),
+		sa.Column('dia', sa.Date(), nullable=False),
+		sa.Column('hora', sa.SmallInteger(), nullable=False),
+		sa.Column('duración_minutos', sa.Integer(), nullable=False),
+		sa.Column('teléfono', sa.String(), nullable=False),
+		sa.Column('nombre_contacto', sa.String(), nullable=False),
+		sa.Column('id_cancha', sa.Integer(), nullable=False),
+		sa.ForeignKeyConstraint(['id_cancha'], ['canchas.id']),
+		sa.PrimaryKeyConstraint('id'),
+	)
+
+def downgrade() -> None:
+	op.drop_table('reservas')
+	op.drop_table('canchas')
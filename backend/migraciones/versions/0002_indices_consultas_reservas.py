@@ -0,0 +1,70 @@
+"""Periodo de las reservas con su restricción de no solapamiento e índices para los patrones de consulta
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+	op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+	op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+	# Al ser una columna generada almacenada, Postgres calcula periodo para las reservas existentes al agregarla
+	op.add_column('reservas', sa.Column(
+		'periodo',
+		postgresql.TSRANGE(),
+		sa.Computed(
+			"tsrange(dia + hora * interval '1 hour', "
+			"dia + hora * interval '1 hour' + \"duración_minutos\" * interval '1 minute')",
+			persisted=True,
+		),
+		nullable=False,
+	))
+	# Falla si ya hay reservas solapadas en una misma cancha, que deben resolverse antes de migrar
+	op.create_exclude_constraint(
+		'reservas_sin_solapamiento',
+		'reservas',
+		('id_cancha', '='),
+		('periodo', '&&'),
+		using='gist',
+	)
+
+	# CONCURRENTLY evita bloquear las escrituras sobre tablas ya pobladas, pero no puede ejecutarse en una transacción
+	with op.get_context().autocommit_block():
+		op.create_index(
+			'ix_reservas_cancha_dia_hora', 'reservas', ['id_cancha', 'dia', 'hora'],
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+		op.create_index(
+			'ix_reservas_telefono', 'reservas', ['teléfono'],
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+		op.create_index(
+			'ix_reservas_nombre_contacto_trgm', 'reservas', ['nombre_contacto'],
+			postgresql_using='gin', postgresql_ops={'nombre_contacto': 'gin_trgm_ops'},
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+		op.create_index(
+			'ix_canchas_nombre_trgm', 'canchas', ['nombre'],
+			postgresql_using='gin', postgresql_ops={'nombre': 'gin_trgm_ops'},
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+
+def downgrade() -> None:
+	with op.get_context().autocommit_block():
+		op.drop_index('ix_canchas_nombre_trgm', table_name='canchas', postgresql_concurrently=True, if_exists=True)
+		op.drop_index('ix_reservas_nombre_contacto_trgm', table_name='reservas', postgresql_concurrently=True, if_exists=True)
+		op.drop_index('ix_reservas_telefono', table_name='reservas', postgresql_concurrently=True, if_exists=True)
+		op.drop_index('ix_reservas_cancha_dia_hora', table_name='reservas', postgresql_concurrently=True, if_exists=True)
+
+	op.drop_constraint('reservas_sin_solapamiento', 'reservas')
+	op.drop_column('reservas', 'periodo')
@@ -0,0 +1,37 @@
+"""Series de reservas recurrentes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+	op.create_table(
+		'series_reservas',
+		sa.Column('id', sa.Integer(), nullable=False),
+		sa.Column('id_cancha', sa.Integer(), nullable=False),
+		sa.Column('dia_inicio', sa.Date(), nullable=False),
+		sa.Column('hasta', sa.Date(), nullable=False),
+		sa.Column('semanas_intervalo', sa.SmallInteger(), nullable=False),
+		sa.Column('hora', sa.SmallInteger(), nullable=False),
+		sa.Column('duración_minutos', sa.Integer(), nullable=False),
+		sa.Column('teléfono', sa.String(), nullable=False),
+		sa.Column('nombre_contacto', sa.String(), nullable=False),
+		sa.CheckConstraint('hasta >= dia_inicio', name='series_reservas_hasta_posterior'),
+		sa.CheckConstraint('semanas_intervalo >= 1', name='series_reservas_intervalo_positivo'),
+		sa.ForeignKeyConstraint(['id_cancha'], ['canchas.id']),
+		sa.PrimaryKeyConstraint('id'),
+	)
+	op.create_index('ix_series_reservas_cancha_periodo', 'series_reservas', ['id_cancha', 'dia_inicio', 'hasta'])
+
+def downgrade() -> None:
+	op.drop_index('ix_series_reservas_cancha_periodo', table_name='series_reservas')
+	op.drop_table('series_reservas')
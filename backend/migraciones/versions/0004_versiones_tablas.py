@@ -0,0 +1,26 @@
+"""Versiones de las tablas para peticiones condicionales
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+	op.create_table(
+		'versiones_tablas',
+		sa.Column('tabla', sa.String(), nullable=False),
+		sa.Column('versión', sa.BigInteger(), nullable=False),
+		sa.Column('modificada', sa.DateTime(timezone=True), nullable=False),
+		sa.PrimaryKeyConstraint('tabla'),
+	)
+
+def downgrade() -> None:
+	op.drop_table('versiones_tablas')
@@ -0,0 +1,29 @@
+"""Eliminación en cascada de las reservas y series de una cancha en la BDD
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_CLAVES_FORÁNEAS = (
+	('reservas_id_cancha_fkey', 'reservas'),
+	('series_reservas_id_cancha_fkey', 'series_reservas'),
+)
+
+def _recrear_claves_foráneas(ondelete: str | None):
+	for nombre, tabla in _CLAVES_FORÁNEAS:
+		op.drop_constraint(nombre, tabla, type_='foreignkey')
+		op.create_foreign_key(nombre, tabla, 'canchas', ['id_cancha'], ['id'], ondelete=ondelete)
+
+def upgrade() -> None:
+	_recrear_claves_foráneas('CASCADE')
+
+def downgrade() -> None:
+	_recrear_claves_foráneas(None)
@@ -0,0 +1,41 @@
+"""Índices de las reservas y series de un teléfono, ordenadas por fecha
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+	# El índice compuesto también resuelve las búsquedas por igualdad de teléfono, así que reemplaza al anterior
+	with op.get_context().autocommit_block():
+		op.create_index(
+			'ix_reservas_telefono_dia_hora', 'reservas', ['teléfono', 'dia', 'hora'],
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+		op.create_index(
+			'ix_series_reservas_telefono', 'series_reservas', ['teléfono'],
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+		op.drop_index('ix_reservas_telefono', table_name='reservas', postgresql_concurrently=True, if_exists=True)
+
+def downgrade() -> None:
+	with op.get_context().autocommit_block():
+		op.create_index(
+			'ix_reservas_telefono', 'reservas', ['teléfono'],
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+		op.drop_index(
+			'ix_series_reservas_telefono', table_name='series_reservas',
+			postgresql_concurrently=True, if_exists=True,
+		)
+		op.drop_index(
+			'ix_reservas_telefono_dia_hora', table_name='reservas',
+			postgresql_concurrently=True, if_exists=True,
+		)
@@ -0,0 +1,23 @@
+"""Versión de cada cancha y reserva para detectar modificaciones concurrentes
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+	# Con un valor por defecto constante, Postgres agrega la columna sin reescribir las tablas
+	op.add_column('canchas', sa.Column('versión', sa.Integer(), server_default='1', nullable=False))
+	op.add_column('reservas', sa.Column('versión', sa.Integer(), server_default='1', nullable=False))
+
+def downgrade() -> None:
+	op.drop_column('reservas', 'versión')
+	op.drop_column('canchas', 'versión')
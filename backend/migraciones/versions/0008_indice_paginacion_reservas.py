@@ -0,0 +1,25 @@
+"""Índice para la paginación por clave de las reservas
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+from alembic import op
+
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+	# CONCURRENTLY evita bloquear las escrituras sobre tablas ya pobladas, pero no puede ejecutarse en una transacción
+	with op.get_context().autocommit_block():
+		op.create_index(
+			'ix_reservas_dia_hora_id', 'reservas', ['dia', 'hora', 'id'],
+			postgresql_concurrently=True, if_not_exists=True,
+		)
+
+def downgrade() -> None:
+	with op.get_context().autocommit_block():
+		op.drop_index('ix_reservas_dia_hora_id', table_name='reservas', postgresql_concurrently=True, if_exists=True)
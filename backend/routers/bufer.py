@@ -0,0 +1,70 @@
+"""
+Búfer en disco entre un hilo que produce fragmentos de una respuesta y el iterador que los envía al cliente.
+El productor nunca espera al cliente, y lo pendiente de enviar queda en un archivo temporal y no en memoria
+"""
+
+from tempfile import TemporaryFile
+from threading import Condition
+from typing import Iterator, Optional
+
+_BYTES_POR_LECTURA = 64 * 1024
+
+class BúferArchivo:
+	def __init__(self):
+		self._archivo = TemporaryFile()
+		self._condición = Condition()
+		self._escritos = 0
+		self._terminado = False
+		self._abandonado = False
+		self._error: Optional[BaseException] = None
+
+	def escribir(self, datos: bytes):
+		"""Agrega datos al final del búfer. Si el cliente ya dejó de leer, se descartan"""
+
+		with self._condición:
+			if self._abandonado:
+				return
+
+			self._archivo.seek(self._escritos)
+			self._archivo.write(datos)
+			self._escritos += len(datos)
+			self._condición.notify_all()
+
+	def terminar(self, error: Optional[BaseException] = None):
+		"""Indica que no se escribirá nada más. Con un error, el iterador lo lanza tras enviar lo ya escrito"""
+
+		with self._condición:
+			self._terminado = True
+			self._error = error
+			self._condición.notify_all()
+
+			if self._abandonado:
+				self._archivo.close()
+
+	def leer(self) -> Iterator[bytes]:
+		"""Devuelve lo escrito a medida que llega, hasta que el productor termine"""
+
+		leídos = 0
+
+		try:
+			while True:
+				with self._condición:
+					self._condición.wait_for(lambda: self._escritos > leídos or self._terminado)
+
+					if self._escritos == leídos:
+						if self._error is not None:
+							raise self._error
+
+						return
+
+					self._archivo.seek(leídos)
+					datos = self._archivo.read(min(self._escritos - leídos, _BYTES_POR_LECTURA))
+
+				leídos += len(datos)
+				yield datos
+		finally:
+			with self._condición:
+				self._abandonado = True
+
+				if self._terminado:
+					self._archivo.close()
@@ -1,23 +1,33 @@
+from datetime import datetime
 from typing import Optional, List
-from fastapi import APIRouter, HTTPException, status
-from db import MakeSession, crud
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from db import SesiónBDD, SesiónLectura, crud
 from db.models import Cancha
-from db.schemas import CanchaSchema, CanchaCreate
+from db.schemas import CanchaSchema, CanchaCreate, DisponibilidadCancha, ResultadoEliminación
+from instrumentacion import RutaInstrumentada
+from routers import condicional
 
-router = APIRouter(prefix='/canchas')
+router = APIRouter(prefix='/canchas', route_class=RutaInstrumentada)
 
 @router.get('/', status_code = status.HTTP_200_OK, response_model = List[CanchaSchema])
-def obtener_todas_las_canchas() -> list[Cancha]:
-	session = MakeSession()
-	canchas = crud.get_canchas(session)
-	session.close()
-	return canchas
+async def obtener_todas_las_canchas(
+	session: SesiónLectura,
+	request: Request,
+	response: Response,
+) -> Response | list[Cancha]:
+	validadores = condicional.Validadores.de_versiones(await session.run_sync(crud.get_versiones, Cancha.__tablename__))
+
+	if condicional.no_modificado(request, validadores):
+		return condicional.respuesta_no_modificada(validadores)
+
+	validadores.agregar(response.headers)
+
+	return await session.run_sync(crud.get_canchas)
 
 @router.get('/id/{id_cancha}', status_code = status.HTTP_200_OK, response_model = CanchaSchema)
-def obtener_cancha_por_id(id_cancha: int) -> Cancha:
-	session = MakeSession()
-	cancha = crud.get_cancha(session, id_cancha)
-	session.close()
+async def obtener_cancha_por_id(id_cancha: int, session: SesiónBDD, response: Response) -> CanchaSchema:
+	# El ETag se compara luego con If-Match, así que la versión se lee de la BDD principal y no de la caché ni la réplica
+	cancha = await session.run_sync(crud.get_cancha, id_cancha, False)
 
 	if cancha is None:
 		raise HTTPException(
@@ -25,57 +35,90 @@ def obtener_cancha_por_id(id_cancha: int) -> Cancha:
 			f'No se encontró ninguna cancha con la ID: {id_cancha}'
 		)
 
+	response.headers['ETag'] = condicional.etag_versión(cancha.versión)
+
 	return cancha
 
 @router.get('/q', status_code = status.HTTP_200_OK, response_model = List[CanchaSchema])
-def obtener_canchas_por_consulta(
+async def obtener_canchas_por_consulta(
+	session: SesiónLectura,
+	response: Response,
 	qmin: Optional[int] = None,
 	qmax: Optional[int] = None,
 	nombre: Optional[str] = None,
 	techada: Optional[bool] = None,
+	limite: Optional[int] = None,
+	cursor: Optional[str] = None,
 ) -> list[Cancha]:
-	session = MakeSession()
+	rango = crud.qparams_a_rango(qmin, qmax)
+	después_de = crud.cursor_a_clave(cursor, (int,))
 
-	try:
-		rango = crud.qparams_a_rango(qmin, qmax)
+	canchas = await session.run_sync(
+		crud.get_canchas,
+		nombre = nombre,
+		rango = rango,
+		techada = techada,
+		límite = limite,
+		después_de = después_de[0] if después_de is not None else None,
+	)
 
-		canchas = crud.get_canchas(
-			session,
-			nombre = nombre,
-			rango = rango,
-			techada = techada,
-		)
+	if limite is not None and len(canchas) == limite:
+		response.headers['X-Next-Cursor'] = crud.clave_a_cursor(canchas[-1].id)
+
+	return canchas
 
-		return canchas
-	finally:
-		session.close()
+@router.get('/id/{id_cancha}/disponibilidad', status_code = status.HTTP_200_OK, response_model = DisponibilidadCancha)
+async def obtener_disponibilidad_de_cancha(
+	session: SesiónBDD,
+	id_cancha: int,
+	desde: datetime,
+	hasta: datetime,
+	dur_mins: int = 60,
+) -> DisponibilidadCancha:
+	disponibilidades = await session.run_sync(
+		crud.get_disponibilidad,
+		desde = desde,
+		hasta = hasta,
+		duración_minutos = dur_mins,
+		ids_cancha = [id_cancha],
+	)
+
+	return disponibilidades[0]
+
+@router.get('/disponibilidad', status_code = status.HTTP_200_OK, response_model = List[DisponibilidadCancha])
+async def obtener_disponibilidad_de_canchas(
+	session: SesiónBDD,
+	desde: datetime,
+	hasta: datetime,
+	dur_mins: int = 60,
+	canchas: Optional[str] = None,
+) -> list[DisponibilidadCancha]:
+	return await session.run_sync(
+		crud.get_disponibilidad,
+		desde = desde,
+		hasta = hasta,
+		duración_minutos = dur_mins,
+		ids_cancha = crud.canchas_a_ids(canchas),
+	)
 
 @router.post('/', status_code = status.HTTP_201_CREATED, response_model = CanchaSchema)
-def crear_cancha(
+async def crear_cancha(
+	session: SesiónBDD,
 	nombre: str,
 	techada: bool = False
 ) -> Cancha:
-	session = MakeSession()
-	cancha = crud.create_cancha(session, CanchaCreate(nombre=nombre, techada=techada))
-	session.close()
-
-	return cancha
+	return await session.run_sync(crud.create_cancha, CanchaCreate(nombre=nombre, techada=techada))
 
 @router.patch('/id/{id_cancha}', status_code = status.HTTP_200_OK, response_model = CanchaSchema)
-def modificar_cancha(
+async def modificar_cancha(
+	session: SesiónBDD,
+	request: Request,
+	response: Response,
 	id_cancha: int,
 	nombre: Optional[str] = None,
 	techada: Optional[bool] = None,
 ) -> Cancha:
-	session = MakeSession()
-	cancha = crud.get_cancha(session, id_cancha=id_cancha)
-
-	if cancha is None:
-		session.close()
-		raise HTTPException(
-			status.HTTP_404_NOT_FOUND,
-			f'No se encontró ninguna cancha con la ID: {id_cancha}',
-		)
+	"""Con If-Match, solo modifica la cancha si su versión sigue siendo la del ETag indicado. Si no, responde 412"""
 
 	if nombre is None and techada is None:
 		raise HTTPException(
@@ -83,24 +126,27 @@ def modificar_cancha(
 			'No se instruyó ninguna modificación',
 		)
 
-	try:
-		if nombre is not None:
-			cancha.nombre = nombre
+	cancha = await session.run_sync(
+		crud.update_cancha,
+		id_cancha,
+		nombre=nombre,
+		techada=techada,
+		versión=condicional.versión_requerida(request),
+	)
 
-		if techada is not None:
-			cancha.techada = techada
+	if cancha is None:
+		raise HTTPException(
+			status.HTTP_404_NOT_FOUND,
+			f'No se encontró ninguna cancha con la ID: {id_cancha}',
+		)
 
-		session.commit()
-	finally:
-		session.close()
+	response.headers['ETag'] = condicional.etag_versión(cancha.versión)
 
 	return cancha
 
 @router.delete('/id/{id_cancha}', status_code = status.HTTP_200_OK, response_model = CanchaSchema)
-def eliminar_cancha_por_id(id_cancha: int) -> Cancha:
-	session = MakeSession()
-	cancha_eliminada = crud.delete_cancha(session, id_cancha=id_cancha)
-	session.close()
+async def eliminar_cancha_por_id(id_cancha: int, session: SesiónBDD) -> Cancha:
+	cancha_eliminada = await session.run_sync(crud.delete_cancha, id_cancha=id_cancha)
 
 	if cancha_eliminada is None:
 		raise HTTPException(
@@ -110,23 +156,23 @@ def eliminar_cancha_por_id(id_cancha: int) -> Cancha:
 
 	return cancha_eliminada
 
-@router.delete('/q', status_code = status.HTTP_200_OK, response_model = List[CanchaSchema])
-def eliminar_canchas_por_consulta(
+@router.delete('/q', status_code = status.HTTP_200_OK, response_model = List[CanchaSchema] | ResultadoEliminación)
+async def eliminar_canchas_por_consulta(
+	session: SesiónBDD,
 	qmin: Optional[int] = None,
 	qmax: Optional[int] = None,
 	nombre: Optional[str] = None,
 	techada: Optional[bool] = None,
-) -> list[Cancha]:
-	session = MakeSession()
-
-	try:
-		rango = crud.qparams_a_rango(qmin, qmax)
-		canchas_eliminadas = crud.delete_canchas(
-			session,
-			rango=rango,
-			nombre=nombre,
-			techada=techada,
-		)
-		return canchas_eliminadas
-	finally:
-		session.close()
+	lote: Optional[int] = None,
+	devolver: str = 'lista',
+) -> list[Cancha] | ResultadoEliminación:
+	"""Elimina las canchas que coincidan, junto con sus reservas y series"""
+
+	crud.verificar_devolución_borrado(devolver, ('lista', 'cantidad'))
+	rango = crud.qparams_a_rango(qmin, qmax)
+	criterios = dict(rango=rango, nombre=nombre, techada=techada, tamaño_lote=lote)
+
+	if devolver == 'cantidad':
+		return ResultadoEliminación(eliminadas=await session.run_sync(crud.delete_canchas_cantidad, **criterios))
+
+	return await session.run_sync(crud.delete_canchas, **criterios)
@@ -0,0 +1,106 @@
+"""
+Peticiones condicionales (If-None-Match / If-Modified-Since) para los listados. Los validadores se calculan a partir
+de las versiones de las tablas que registra crud, así que confirmar que nada cambió cuesta una sola consulta mínima.
+Las modificaciones de una cancha o reserva aceptan If-Match con el ETag de la versión de esa fila
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from fastapi import HTTPException, Request, Response, status
+from starlette.datastructures import MutableHeaders
+
+@dataclass(frozen=True)
+class Validadores:
+	etag: str
+	modificada: Optional[datetime] = None
+
+	@staticmethod
+	def de_versiones(versiones: dict[str, tuple[int, Optional[datetime]]], variante: str = '') -> 'Validadores':
+		"""
+		Arma los validadores de un listado a partir de las versiones de las tablas de las que depende.
+		La variante distingue las distintas representaciones de un mismo listado (p.ej.: full o formato)
+		"""
+
+		partes = [f'{tabla}.{versión}' for tabla, (versión, _) in sorted(versiones.items())]
+		momentos = [modificada for _, modificada in versiones.values() if modificada is not None]
+
+		return Validadores(
+			etag='"' + '-'.join(partes + ([variante] if variante else [])) + '"',
+			modificada=max(momentos) if len(momentos) > 0 else None,
+		)
+
+	def agregar(self, cabeceras: MutableHeaders):
+		cabeceras['ETag'] = self.etag
+		# Los clientes pueden guardar la respuesta, pero deben revalidarla antes de usarla
+		cabeceras['Cache-Control'] = 'no-cache'
+
+		if self.modificada is not None:
+			cabeceras['Last-Modified'] = format_datetime(self.modificada.astimezone(timezone.utc), usegmt=True)
+
+def _etags(valor: str) -> list[str]:
+	# Comparación débil: W/"x" equivale a "x"
+	return [etag.strip().removeprefix('W/') for etag in valor.split(',')]
+
+def no_modificado(request: Request, validadores: Validadores) -> bool:
+	"""
+	Indica si la representación que ya tiene el cliente sigue vigente.
+	If-None-Match tiene precedencia sobre If-Modified-Since
+	"""
+
+	if_none_match = request.headers.get('if-none-match')
+
+	if if_none_match is not None:
+		etags = _etags(if_none_match)
+		return '*' in etags or validadores.etag in etags
+
+	if_modified_since = request.headers.get('if-modified-since')
+
+	if if_modified_since is None or validadores.modificada is None:
+		return False
+
+	try:
+		desde = parsedate_to_datetime(if_modified_since)
+	except (TypeError, ValueError):
+		return False
+
+	if desde.tzinfo is None:
+		desde = desde.replace(tzinfo=timezone.utc)
+
+	# Last-Modified tiene resolución de segundos
+	return validadores.modificada.replace(microsecond=0) <= desde
+
+def respuesta_no_modificada(validadores: Validadores) -> Response:
+	respuesta = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+	validadores.agregar(respuesta.headers)
+	return respuesta
+
+def etag_versión(versión: int) -> str:
+	return f'"{versión}"'
+
+def versión_requerida(request: Request) -> Optional[int]:
+	"""
+	Devuelve la versión que exige If-Match para modificar una fila, o None si no se indicó o es *.
+	Los ETags de versión son fuertes, así que un ETag débil o ajeno nunca coincide y se responde 412
+	"""
+
+	if_match = request.headers.get('if-match')
+
+	if if_match is None:
+		return None
+
+	etags = [etag.strip() for etag in if_match.split(',')]
+
+	if '*' in etags:
+		return None
+
+	versiones = {etag[1:-1] for etag in etags if len(etag) > 2 and etag[0] == etag[-1] == '"'}
+
+	if len(versiones) != 1 or not next(iter(versiones)).isdigit():
+		raise HTTPException(
+			status.HTTP_412_PRECONDITION_FAILED,
+			'If-Match debe indicar el ETag de la versión actual',
+		)
+
+	return int(versiones.pop())
@@ -1,11 +1,27 @@
+import csv
+import io
+import json
 from datetime import date, datetime
-from typing import Optional, List
-from fastapi import APIRouter, HTTPException, status
-from db import MakeSession, crud
-from db.models import Reserva, ReservaCompleta
-from db.schemas import ReservaSchema, ReservaCreate, ReservaCompletaSchema
+from threading import Thread
+from typing import Iterator, Optional, List, Sequence
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import Row
+from db import MakeReadSession, MakeSession, SesiónBDD, SesiónLectura, crud, series_reservas
+from db.consultas import CAMPOS_CANCHA, CAMPOS_RESERVA
+from db.models import Cancha, OcurrenciaSerie, Reserva, ReservaCompleta, SerieReserva
+from db.schemas import (
+	EstadísticaOcupación, GrillaDía, OcurrenciaSerieSchema, ReservaSchema, ReservaCreate, ReservaCompletaSchema,
+	ResultadoEliminación, ResultadoReservaLote, SerieReservaCreate, SerieReservaSchema,
+)
+from instrumentacion import RutaInstrumentada
+from routers import condicional
+from routers.bufer import BúferArchivo
 
-router = APIRouter(prefix='/reservas')
+router = APIRouter(prefix='/reservas', route_class=RutaInstrumentada)
 
 def obtener_rango_u_valor_int(
 	x: str | None,
@@ -82,22 +98,138 @@ def obtener_rango_u_valor_date(
 
 	return (date_min, date_max)
 
+_TIPOS_EXPORTACIÓN = {
+	'ndjson': 'application/x-ndjson',
+	'csv': 'text/csv',
+}
+
+_FILAS_POR_FRAGMENTO = 500
+
+def _fragmentos_ndjson(reservas: Iterator[Reserva] | Iterator[ReservaCompleta], full: bool) -> Iterator[str]:
+	esquema = ReservaCompletaSchema if full else ReservaSchema
+	líneas = []
+
+	for reserva in reservas:
+		líneas.append(esquema.model_validate(reserva, from_attributes=True).model_dump_json())
+
+		if len(líneas) >= _FILAS_POR_FRAGMENTO:
+			yield '\n'.join(líneas) + '\n'
+			líneas.clear()
+
+	if len(líneas) > 0:
+		yield '\n'.join(líneas) + '\n'
+
+def _fragmentos_csv(reservas: Iterator[Reserva] | Iterator[ReservaCompleta], full: bool) -> Iterator[str]:
+	campos = list(ReservaSchema.model_fields)
+	búfer = io.StringIO()
+	escritor = csv.writer(búfer)
+	escritor.writerow(campos + ['nombre_cancha', 'techada'] if full else campos)
+
+	for i, elemento in enumerate(reservas, start=1):
+		reserva = elemento.reserva if full else elemento
+		fila = [getattr(reserva, campo) for campo in campos]
+
+		if full:
+			fila += [elemento.cancha.nombre, elemento.cancha.techada]
+
+		escritor.writerow(fila)
+
+		if i % _FILAS_POR_FRAGMENTO == 0:
+			yield búfer.getvalue()
+			búfer.seek(0)
+			búfer.truncate()
+
+	yield búfer.getvalue()
+
+def respuesta_json_filas(filas: Sequence[Row], full: bool) -> Response:
+	"""
+	Serializa filas planas de crud.get_filas_reservas directamente a JSON, con la misma forma que ReservaSchema
+	o ReservaCompletaSchema, sin construir entidades del ORM ni validar cada fila con pydantic
+	"""
+
+	if full:
+		n = len(CAMPOS_RESERVA)
+		contenido = [
+			{'reserva': dict(zip(CAMPOS_RESERVA, fila[:n])), 'cancha': dict(zip(CAMPOS_CANCHA, fila[n:]))}
+			for fila in filas
+		]
+	else:
+		contenido = [dict(zip(CAMPOS_RESERVA, fila)) for fila in filas]
+
+	return Response(orjson.dumps(contenido), media_type='application/json')
+
+def _verificar_formato(formato: str):
+	if formato != 'json' and formato not in _TIPOS_EXPORTACIÓN:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			f'El formato debe ser uno de: json, {", ".join(_TIPOS_EXPORTACIÓN)}. Recibido: {formato}',
+		)
+
+def exportar_reservas(formato: str, **criterios) -> StreamingResponse:
+	"""
+	Envía las reservas que coincidan con los criterios a medida que se leen de la BDD, en formato NDJSON o CSV.
+	Usa su propia sesión sincrónica sobre la réplica de lectura, que se cierra al terminar de enviarlas
+	"""
+
+	_verificar_formato(formato)
+	full = criterios.get('full', False)
+	session = MakeReadSession()
+
+	try:
+		reservas = crud.iterar_reservas(session, **criterios)
+	except Exception:
+		session.close()
+		raise
+
+	fragmentar = _fragmentos_ndjson if formato == 'ndjson' else _fragmentos_csv
+
+	def enviar() -> Iterator[str]:
+		try:
+			yield from fragmentar(reservas, full)
+		finally:
+			session.close()
+
+	return StreamingResponse(enviar(), media_type=_TIPOS_EXPORTACIÓN[formato])
+
 @router.get('/', status_code=status.HTTP_200_OK, response_model = List[ReservaSchema] | List[ReservaCompletaSchema])
-def obtener_todas_las_reservas(full: bool = False) -> list[Reserva] | list[ReservaCompleta]:
-	session = MakeSession()
-	reservas = crud.get_reservas(session, full=full)
-	session.close()
-	return reservas
+async def obtener_todas_las_reservas(
+	session: SesiónLectura,
+	request: Request,
+	full: bool = False,
+	formato: str = Query('json', alias='format'),
+) -> Response:
+	_verificar_formato(formato)
+
+	# Con full, el listado también cambia si cambian las Canchas
+	tablas = (Reserva.__tablename__, Cancha.__tablename__) if full else (Reserva.__tablename__,)
+	versiones = await session.run_sync(crud.get_versiones, *tablas)
+	validadores = condicional.Validadores.de_versiones(versiones, f'{formato}.full' if full else formato)
+
+	if condicional.no_modificado(request, validadores):
+		return condicional.respuesta_no_modificada(validadores)
+
+	if formato != 'json':
+		# El cursor del lado del servidor se recorre con el engine sincrónico, fuera del event loop
+		respuesta = await run_in_threadpool(exportar_reservas, formato, full=full)
+	else:
+		respuesta = respuesta_json_filas(await session.run_sync(crud.get_filas_reservas, full=full), full)
+
+	validadores.agregar(respuesta.headers)
+
+	return respuesta
 
 @router.get('/id/{id_reserva}',
 	status_code=status.HTTP_200_OK,
 	response_model = ReservaSchema | ReservaCompletaSchema,
 )
-def obtener_reserva_por_id(id_reserva: int, full: bool = False) -> Reserva | ReservaCompleta:
-	session = MakeSession()
-	reserva = crud.get_reserva(session, id_reserva) if not full else crud.get_reserva_completa(session, id_reserva)
-
-	session.close()
+async def obtener_reserva_por_id(
+	id_reserva: int,
+	session: SesiónBDD,
+	response: Response,
+	full: bool = False,
+) -> Reserva | ReservaCompleta:
+	# Se lee de la BDD principal, ya que el ETag se compara luego con If-Match y la réplica puede estar atrasada
+	reserva = await session.run_sync(crud.get_reserva_completa if full else crud.get_reserva, id_reserva)
 
 	if reserva is None:
 		raise HTTPException(
@@ -105,13 +237,18 @@ def obtener_reserva_por_id(id_reserva: int, full: bool = False) -> Reserva | Res
 			f'No se encontró ninguna reserva con la ID: {id_reserva}'
 		)
 
+	# El ETag identifica la versión de la Reserva, que es la que se compara con If-Match al modificarla
+	if not full:
+		response.headers['ETag'] = condicional.etag_versión(reserva.versión)
+
 	return reserva
 
 @router.get('/q',
 	status_code=status.HTTP_200_OK,
-	response_model = List[ReservaSchema] | List[ReservaCompletaSchema],
+	response_model = List[ReservaSchema | OcurrenciaSerieSchema] | List[ReservaCompletaSchema],
 )
-def obtener_reservas_por_consulta(
+async def obtener_reservas_por_consulta(
+	session: SesiónLectura,
 	id_cancha: Optional[int] = None,
 	qmin: Optional[int] = None,
 	qmax: Optional[int] = None,
@@ -122,34 +259,128 @@ def obtener_reservas_por_consulta(
 	nom_contacto: Optional[str] = None,
 	nom_cancha: Optional[str] = None,
 	full: bool = False,
-) -> list[Reserva] | list[ReservaCompleta]:
-	session = MakeSession()
-
-	try:
-		rango = crud.qparams_a_rango(qmin, qmax)
-
-		dia_rango_u_valor = obtener_rango_u_valor_date(dia, 'día')
-		hora_rango_u_valor = obtener_rango_u_valor_int(hora, 'hora')
-		dur_mins_rango_u_valor = obtener_rango_u_valor_int(dur_mins, 'duración en minutos')
-
-		reservas = crud.get_reservas(
-			session,
-			id_cancha=id_cancha,
-			rango=rango,
-			dia=dia_rango_u_valor,
-			hora=hora_rango_u_valor,
-			duración_minutos=dur_mins_rango_u_valor,
-			teléfono=tel,
-			nombre_contacto=nom_contacto,
-			nombre_cancha=nom_cancha,
-			full=full,
-		)
-		return reservas
-	finally:
-		session.close()
+	formato: str = Query('json', alias='format'),
+	limite: Optional[int] = None,
+	cursor: Optional[str] = None,
+	series: bool = False,
+) -> Response | list[Reserva | OcurrenciaSerie] | list[ReservaCompleta]:
+	rango = crud.qparams_a_rango(qmin, qmax)
+	después_de = crud.cursor_a_clave(cursor, (date, int, int))
+
+	dia_rango_u_valor = obtener_rango_u_valor_date(dia, 'día')
+	hora_rango_u_valor = obtener_rango_u_valor_int(hora, 'hora')
+	dur_mins_rango_u_valor = obtener_rango_u_valor_int(dur_mins, 'duración en minutos')
+
+	criterios = {
+		'id_cancha': id_cancha,
+		'rango': rango,
+		'dia': dia_rango_u_valor,
+		'hora': hora_rango_u_valor,
+		'duración_minutos': dur_mins_rango_u_valor,
+		'teléfono': tel,
+		'nombre_contacto': nom_contacto,
+		'nombre_cancha': nom_cancha,
+		'full': full,
+		'límite': limite,
+		'después_de': después_de,
+	}
+
+	if formato != 'json':
+		if series:
+			raise HTTPException(
+				status.HTTP_400_BAD_REQUEST,
+				'Las ocurrencias de series de reservas solo pueden consultarse en formato json',
+			)
+
+		return await run_in_threadpool(exportar_reservas, formato, **criterios)
+
+	if series:
+		return await session.run_sync(crud.get_reservas, **criterios, series=series)
+
+	filas = await session.run_sync(crud.get_filas_reservas, **criterios)
+	respuesta = respuesta_json_filas(filas, full)
+
+	if limite is not None and len(filas) == limite:
+		respuesta.headers['X-Next-Cursor'] = crud.clave_a_cursor(filas[-1].dia, filas[-1].hora, filas[-1].id)
+
+	return respuesta
+
+@router.get('/por-telefono/{tel}',
+	status_code=status.HTTP_200_OK,
+	response_model = List[ReservaSchema | OcurrenciaSerieSchema],
+)
+async def obtener_reservas_por_teléfono(
+	session: SesiónBDD,
+	tel: str,
+	desde: Optional[date] = None,
+	limite: int = 20,
+	series: bool = True,
+) -> list[Reserva | OcurrenciaSerie]:
+	"""
+	Reservas de un cliente: primero las próximas, en orden cronológico, y luego las pasadas,
+	de la más reciente a la más antigua
+	"""
+
+	return await session.run_sync(
+		crud.get_reservas_por_teléfono,
+		teléfono=tel,
+		desde=desde,
+		límite=limite,
+		series=series,
+	)
+
+@router.get('/grilla', status_code=status.HTTP_200_OK, response_model = GrillaDía)
+async def obtener_grilla_de_reservas(
+	session: SesiónLectura,
+	dia: date,
+	canchas: Optional[str] = None,
+	resolucion: int = 15,
+	series: bool = True,
+) -> GrillaDía:
+	"""
+	Ocupación del día de cada cancha (o de las indicadas en canchas, separadas por comas) como un mapa de bits en base64,
+	con un bit por franja de resolucion minutos desde las 00:00, empezando por el bit más significativo
+	"""
+
+	return await session.run_sync(
+		crud.get_grilla,
+		dia=dia,
+		ids_cancha=crud.canchas_a_ids(canchas),
+		resolución_minutos=resolucion,
+		series=series,
+	)
+
+@router.get('/stats',
+	status_code=status.HTTP_200_OK,
+	response_model = List[EstadísticaOcupación],
+	response_model_exclude_none=True,
+)
+async def obtener_estadísticas_de_reservas(
+	session: SesiónLectura,
+	desde: date,
+	hasta: date,
+	agrupar: str = 'cancha',
+	id_cancha: Optional[int] = None,
+	series: bool = True,
+) -> list[EstadísticaOcupación]:
+	"""
+	Minutos reservados, cantidad de reservas y porcentaje de ocupación entre desde y hasta, agrupados
+	por los criterios indicados en agrupar separados por comas: cancha, dia, dia_semana (1 = lunes) y hora.
+	Un agrupar vacío devuelve el total del período
+	"""
+
+	return await session.run_sync(
+		crud.get_estadísticas,
+		desde=desde,
+		hasta=hasta,
+		agrupar=tuple(criterio.strip() for criterio in agrupar.split(',') if len(criterio.strip()) > 0),
+		id_cancha=id_cancha,
+		series=series,
+	)
 
 @router.post('/cancha/{id_cancha}', status_code=status.HTTP_201_CREATED, response_model = ReservaSchema)
-def crear_reserva(
+async def crear_reserva(
+	session: SesiónBDD,
 	id_cancha: int,
 	dia: date,
 	hora: int,
@@ -157,33 +388,113 @@ def crear_reserva(
 	tel: str,
 	nom_contacto: str,
 ) -> Reserva:
-	session = MakeSession()
+	# La existencia de la Cancha se verifica en la misma sentencia que crea la Reserva
+	return await session.run_sync(crud.create_reserva, ReservaCreate(
+		id_cancha = id_cancha,
+		dia = dia,
+		hora = hora,
+		duración_minutos = dur_mins,
+		teléfono = tel,
+		nombre_contacto = nom_contacto,
+	))
+
+@router.post('/lote', status_code=status.HTTP_200_OK, response_model = List[ResultadoReservaLote])
+async def crear_reservas_en_lote(request: Request, session: SesiónBDD) -> list[ResultadoReservaLote]:
+	"""
+	Crea varias reservas a partir de un arreglo JSON o de un cuerpo NDJSON (una reserva por línea)
+	y devuelve el resultado de cada una según su posición en el cuerpo
+	"""
+
+	cuerpo = await request.body()
 
-	cancha = crud.get_cancha(session, id_cancha)
+	try:
+		if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+			elementos = [json.loads(línea) for línea in cuerpo.splitlines() if len(línea.strip()) > 0]
+		else:
+			elementos = json.loads(cuerpo)
+	except ValueError as exc:
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El cuerpo debe ser un arreglo JSON de reservas o una reserva JSON por línea (NDJSON)',
+		) from exc
 
-	if cancha is None:
-		session.close()
+	if not isinstance(elementos, list):
+		raise HTTPException(
+			status.HTTP_400_BAD_REQUEST,
+			'El cuerpo debe ser un arreglo JSON de reservas o una reserva JSON por línea (NDJSON)',
+		)
+
+	resultados: list[ResultadoReservaLote] = []
+	reservas: list[ReservaCreate] = []
+	posiciones: list[int] = []
+
+	for posición, elemento in enumerate(elementos):
+		try:
+			reservas.append(ReservaCreate.model_validate(elemento))
+			posiciones.append(posición)
+		except ValidationError as exc:
+			resultados.append(ResultadoReservaLote(
+				posición=posición,
+				status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+				detalle=str(exc),
+			))
+
+	resultados.extend(await session.run_sync(crud.create_reservas_lote, reservas, posiciones))
+
+	resultados.sort(key=lambda resultado: resultado.posición)
+
+	return resultados
+
+@router.post('/series/cancha/{id_cancha}', status_code=status.HTTP_201_CREATED, response_model = SerieReservaSchema)
+async def crear_serie_de_reservas(
+	session: SesiónBDD,
+	id_cancha: int,
+	dia: date,
+	hasta: date,
+	hora: int,
+	dur_mins: int,
+	tel: str,
+	nom_contacto: str,
+	cada_semanas: int = 1,
+) -> SerieReserva:
+	"""Reserva el mismo horario cada cada_semanas semanas, desde dia hasta la fecha hasta inclusive"""
+
+	return await session.run_sync(crud.create_serie, SerieReservaCreate(
+		id_cancha = id_cancha,
+		dia_inicio = dia,
+		hasta = hasta,
+		semanas_intervalo = cada_semanas,
+		hora = hora,
+		duración_minutos = dur_mins,
+		teléfono = tel,
+		nombre_contacto = nom_contacto,
+	))
+
+@router.get('/series', status_code=status.HTTP_200_OK, response_model = List[SerieReservaSchema])
+async def obtener_series_de_reservas(session: SesiónBDD, id_cancha: Optional[int] = None) -> list[SerieReserva]:
+	return await session.run_sync(series_reservas.get_series, id_cancha=id_cancha)
+
+@router.get('/series/id/{id_serie}', status_code=status.HTTP_200_OK, response_model = SerieReservaSchema)
+async def obtener_serie_de_reservas_por_id(id_serie: int, session: SesiónBDD) -> SerieReserva:
+	serie = await session.run_sync(series_reservas.get_serie, id_serie)
+
+	if serie is None:
 		raise HTTPException(
 			status.HTTP_404_NOT_FOUND,
-			f'No se encontró ninguna cancha con la ID: {id_cancha}, al intentar realizar una reserva'
+			f'No se encontró ninguna serie de reservas con la ID: {id_serie}'
 		)
 
-	try:
-		reserva_creada = crud.create_reserva(session, ReservaCreate(
-			id_cancha = id_cancha,
-			dia = dia,
-			hora = hora,
-			duración_minutos = dur_mins,
-			teléfono = tel,
-			nombre_contacto = nom_contacto,
-		))
-
-		return reserva_creada
-	finally:
-		session.close()
+	return serie
+
+@router.delete('/series/id/{id_serie}', status_code=status.HTTP_200_OK, response_model = SerieReservaSchema)
+async def quitar_serie_de_reservas_por_id(id_serie: int, session: SesiónBDD) -> SerieReserva:
+	return await session.run_sync(crud.delete_serie, id_serie=id_serie)
 
 @router.patch('/id/{id_reserva}', status_code=status.HTTP_200_OK, response_model = ReservaSchema)
-def modificar_reserva(
+async def modificar_reserva(
+	session: SesiónBDD,
+	request: Request,
+	response: Response,
 	id_reserva: int,
 	dia: Optional[date] = None,
 	hora: Optional[int] = None,
@@ -191,16 +502,7 @@ def modificar_reserva(
 	tel: Optional[str] = None,
 	nom_contacto: Optional[str] = None,
 ) -> Reserva:
-	session = MakeSession()
-
-	reserva = crud.get_reserva(session, id_reserva=id_reserva)
-
-	if reserva is None:
-		session.close()
-		raise HTTPException(
-			status.HTTP_404_NOT_FOUND,
-			f'No se encontró ninguna reserva con la ID: {id_reserva}'
-		)
+	"""Con If-Match, solo modifica la reserva si su versión sigue siendo la del ETag indicado. Si no, responde 412"""
 
 	if dia is None and hora is None and dur_mins is None and tel is None and nom_contacto is None:
 		raise HTTPException(
@@ -208,33 +510,30 @@ def modificar_reserva(
 			'No se instruyó ninguna modificación',
 		)
 
-	try:
-		if dia is not None:
-			reserva.dia = dia
-
-		if hora is not None:
-			reserva.hora = hora
-
-		if dur_mins is not None:
-			reserva.duración_minutos = dur_mins
+	reserva = await session.run_sync(
+		crud.update_reserva,
+		id_reserva=id_reserva,
+		dia=dia,
+		hora=hora,
+		duración_minutos=dur_mins,
+		teléfono=tel,
+		nombre_contacto=nom_contacto,
+		versión=condicional.versión_requerida(request),
+	)
 
-		if tel is not None:
-			reserva.teléfono = tel
-
-		if nom_contacto is not None:
-			reserva.nombre_contacto = nom_contacto
+	if reserva is None:
+		raise HTTPException(
+			status.HTTP_404_NOT_FOUND,
+			f'No se encontró ninguna reserva con la ID: {id_reserva}'
+		)
 
-		session.commit()
-	finally:
-		session.close()
+	response.headers['ETag'] = condicional.etag_versión(reserva.versión)
 
 	return reserva
 
 @router.delete('/id/{id_reserva}', status_code=status.HTTP_200_OK, response_model = ReservaSchema)
-def quitar_reserva_por_id(id_reserva: int) -> Reserva:
-	session = MakeSession()
-	reserva_eliminada = crud.delete_reserva(session, id_reserva=id_reserva)
-	session.close()
+async def quitar_reserva_por_id(id_reserva: int, session: SesiónBDD) -> Reserva:
+	reserva_eliminada = await session.run_sync(crud.delete_reserva, id_reserva=id_reserva)
 
 	if reserva_eliminada is None:
 		raise HTTPException(
@@ -244,8 +543,42 @@ def quitar_reserva_por_id(id_reserva: int) -> Reserva:
 
 	return reserva_eliminada
 
-@router.delete('/q', status_code=status.HTTP_200_OK, response_model = List[ReservaSchema])
-def quitar_reservas_por_consulta(
+def exportar_reservas_eliminadas(tamaño_lote: Optional[int], **criterios) -> StreamingResponse:
+	"""
+	Elimina las reservas que coincidan con los criterios de a un lote por transacción y envía cada lote en NDJSON apenas
+	se confirma. El borrado avanza en su propio hilo sin esperar al cliente, y los lotes pendientes de enviar se guardan
+	en disco, así que ni la memoria ni la conexión de escritura dependen de lo que tarde (o de si llega) a leerlos
+	"""
+
+	session = MakeSession()
+
+	try:
+		lotes = crud.iterar_reservas_eliminadas(session, tamaño_lote=tamaño_lote or _FILAS_POR_FRAGMENTO, **criterios)
+	except Exception:
+		session.close()
+		raise
+
+	búfer = BúferArchivo()
+
+	def eliminar():
+		try:
+			for lote in lotes:
+				búfer.escribir(b''.join(orjson.dumps(dict(zip(CAMPOS_RESERVA, fila))) + b'\n' for fila in lote))
+		except Exception as exc:
+			búfer.terminar(exc)
+			raise
+		else:
+			búfer.terminar()
+		finally:
+			session.close()
+
+	Thread(target=eliminar, name='exportar_reservas_eliminadas', daemon=True).start()
+
+	return StreamingResponse(búfer.leer(), media_type=_TIPOS_EXPORTACIÓN['ndjson'])
+
+@router.delete('/q', status_code=status.HTTP_200_OK, response_model = List[ReservaSchema] | ResultadoEliminación)
+async def quitar_reservas_por_consulta(
+	session: SesiónBDD,
 	id_cancha: Optional[int] = None,
 	qmin: Optional[int] = None,
 	qmax: Optional[int] = None,
@@ -255,27 +588,31 @@ def quitar_reservas_por_consulta(
 	tel: Optional[str] = None,
 	nom_contacto: Optional[str] = None,
 	nom_cancha: Optional[str] = None,
-) -> list[Reserva]:
-	session = MakeSession()
-
-	try:
-		rango = crud.qparams_a_rango(qmin, qmax)
-		dia_rango_u_valor = obtener_rango_u_valor_date(dia, 'día')
-		hora_rango_u_valor = obtener_rango_u_valor_int(hora, 'hora')
-		dur_mins_rango_u_valor = obtener_rango_u_valor_int(dur_mins, 'duración en minutos')
-
-		reservas = crud.delete_reservas(
-			session,
-			id_cancha=id_cancha,
-			rango=rango,
-			dia=dia_rango_u_valor,
-			hora=hora_rango_u_valor,
-			duración_minutos=dur_mins_rango_u_valor,
-			teléfono=tel,
-			nombre_contacto=nom_contacto,
-			nombre_cancha=nom_cancha,
-		)
-
-		return reservas
-	finally:
-		session.close()
+	lote: Optional[int] = None,
+	devolver: str = 'lista',
+) -> list[Reserva] | ResultadoEliminación | StreamingResponse:
+	crud.verificar_devolución_borrado(devolver, ('lista', 'cantidad', 'ndjson'))
+	rango = crud.qparams_a_rango(qmin, qmax)
+	dia_rango_u_valor = obtener_rango_u_valor_date(dia, 'día')
+	hora_rango_u_valor = obtener_rango_u_valor_int(hora, 'hora')
+	dur_mins_rango_u_valor = obtener_rango_u_valor_int(dur_mins, 'duración en minutos')
+
+	criterios = dict(
+		id_cancha=id_cancha,
+		rango=rango,
+		dia=dia_rango_u_valor,
+		hora=hora_rango_u_valor,
+		duración_minutos=dur_mins_rango_u_valor,
+		teléfono=tel,
+		nombre_contacto=nom_contacto,
+		nombre_cancha=nom_cancha,
+	)
+
+	if devolver == 'ndjson':
+		return await run_in_threadpool(exportar_reservas_eliminadas, lote, **criterios)
+
+	if devolver == 'cantidad':
+		eliminadas = await session.run_sync(crud.delete_reservas_cantidad, tamaño_lote=lote, **criterios)
+		return ResultadoEliminación(eliminadas=eliminadas)
+
+	return await session.run_sync(crud.delete_reservas, tamaño_lote=lote, **criterios)
@@ -1,4 +1,7 @@
+import json
+from base64 import urlsafe_b64decode
 from datetime import date
+from time import sleep
 from unittest import TestCase
 from fastapi import status
 from fastapi.testclient import TestClient
@@ -6,6 +9,13 @@ from main import app
 
 client = TestClient(app)
 
+def setUpModule():
+	# Mantiene un único event loop para todas las peticiones, ya que el pool asíncrono de conexiones queda ligado a él
+	client.__enter__()
+
+def tearDownModule():
+	client.__exit__(None, None, None)
+
 class TestAPI(TestCase):
 	"""Tests de endpoints base"""
 	def test_get(self):
@@ -16,6 +26,26 @@ class TestAPI(TestCase):
 
 		self.assertEqual(data, 'Server en funcionamiento')
 
+	def test_server_timing(self):
+		response = client.get('/canchas')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		server_timing = response.headers.get('server-timing')
+		response.close()
+
+		self.assertIsNotNone(server_timing)
+		self.assertIn('bdd;dur=', server_timing)
+		self.assertIn('handler;dur=', server_timing)
+		self.assertIn('serializacion;dur=', server_timing)
+
+	def test_metrics(self):
+		response = client.get('/metrics')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		texto = response.text
+		response.close()
+
+		self.assertIn('# TYPE http_peticiones_total counter', texto)
+		self.assertIn('sql_consultas_por_peticion_bucket', texto)
+
 class TestAPICanchas(TestCase):
 	"""Tests de los endpoints para Canchas"""
 	def test_get(self):
@@ -36,6 +66,30 @@ class TestAPICanchas(TestCase):
 			self.assertEqual(type(cancha['nombre']), str)
 			self.assertEqual(type(cancha['techada']), bool)
 
+	def test_get_etag(self):
+		response = client.get('/canchas/')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		etag = response.headers.get('etag')
+		response.close()
+
+		self.assertIsNotNone(etag)
+
+		response = client.get('/canchas/', headers={'If-None-Match': etag})
+		self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+		self.assertEqual(response.content, b'')
+		response.close()
+
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		response = client.get('/canchas/', headers={'If-None-Match': etag})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(response.headers.get('etag'), etag)
+		response.close()
+
+		client.delete(f'canchas/id/{idc}').close()
+
 	def test_get_id(self):
 		response = client.get('/canchas/id/2')
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -67,6 +121,47 @@ class TestAPICanchas(TestCase):
 			self.assertEqual(cancha['nombre'], 'cancha1')
 			self.assertEqual(cancha['techada'], True)
 
+	def test_get_query_cursor(self):
+		response = client.get('/canchas/q?limite=2')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		primera_página = response.json()
+		cursor = response.headers.get('X-Next-Cursor')
+		response.close()
+
+		self.assertLessEqual(len(primera_página), 2)
+
+		if cursor is None:
+			return
+
+		response = client.get(f'/canchas/q?limite=2&cursor={cursor}')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		segunda_página = response.json()
+		response.close()
+
+		for cancha in segunda_página:
+			self.assertGreater(cancha['id'], primera_página[-1]['id'])
+
+	def test_get_query_cursor_fails_rango(self):
+		response = client.get('/canchas/q?qmax=5&limite=2')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response.close()
+
+	def test_get_disponibilidad(self):
+		response = client.get('/canchas/disponibilidad?desde=2024-07-01T08:00&hasta=2024-07-01T12:00&dur_mins=60')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		data = response.json()
+		response.close()
+		self.assertIsInstance(data, list)
+
+		for disponibilidad in data:
+			self.assertIn('huecos', disponibilidad)
+			self.assertIn('horarios_reservables', disponibilidad)
+
+	def test_get_disponibilidad_fails_rango(self):
+		response = client.get('/canchas/disponibilidad?desde=2024-07-01T12:00&hasta=2024-07-01T08:00')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response.close()
+
 	def test_post(self):
 		responses = [
 			client.post('/canchas?nombre=CanchaPrueba1&techada=0'),
@@ -308,6 +403,179 @@ class TestAPIReservas(TestCase):
 
 		client.delete(f'canchas/id/{idc}').close()
 
+	def test_post_fails_solapamiento(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		response = client.post(
+			f'/reservas/cancha/{idc}?dia=2024-09-10&hora=18&dur_mins=90&tel=93434502306&nom_contacto=pocahontas'
+		)
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		id_reserva = response.json()['id']
+		response.close()
+
+		response = client.post(
+			f'/reservas/cancha/{idc}?dia=2024-09-10&hora=19&dur_mins=60&tel=93434205774&nom_contacto=rodrigo'
+		)
+		self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+		self.assertEqual(response.headers.get('x-reservas-en-conflicto'), str(id_reserva))
+		response.close()
+
+		client.delete(f'reservas/id/{id_reserva}').close()
+		client.delete(f'canchas/id/{idc}').close()
+
+	def test_series(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		response = client.post(
+			f'/reservas/series/cancha/{idc}?dia=2024-09-02&hasta=2024-09-30&cada_semanas=2'
+			'&hora=20&dur_mins=60&tel=93434502306&nom_contacto=pocahontas'
+		)
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		serie = response.json()
+		response.close()
+
+		self.assertEqual(serie['hasta'], '2024-09-30')
+
+		response = client.get(f'/reservas/q?id_cancha={idc}&dia=2024-09-01:2024-09-30&series=true')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual([r['dia'] for r in response.json()], ['2024-09-02', '2024-09-16', '2024-09-30'])
+		self.assertTrue(all(r['id_serie'] == serie['id'] for r in response.json()))
+		response.close()
+
+		response = client.post(
+			f'/reservas/cancha/{idc}?dia=2024-09-16&hora=20&dur_mins=30&tel=93434205774&nom_contacto=rodrigo'
+		)
+		self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+		self.assertEqual(response.headers.get('x-series-en-conflicto'), str(serie['id']))
+		response.close()
+
+		# Las semanas intermedias quedan libres
+		response = client.post(
+			f'/reservas/cancha/{idc}?dia=2024-09-09&hora=20&dur_mins=30&tel=93434205774&nom_contacto=rodrigo'
+		)
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		id_reserva = response.json()['id']
+		response.close()
+
+		response = client.post(
+			f'/reservas/series/cancha/{idc}?dia=2024-09-02&hasta=2024-09-30&hora=20'
+			'&dur_mins=60&tel=93434502306&nom_contacto=pocahontas'
+		)
+		self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+		self.assertEqual(response.headers.get('x-reservas-en-conflicto'), str(id_reserva))
+		self.assertEqual(response.headers.get('x-series-en-conflicto'), str(serie['id']))
+		response.close()
+
+		response = client.delete(f'/reservas/series/id/{serie["id"]}')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		response.close()
+
+		response = client.get(f'/reservas/series/id/{serie["id"]}')
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+		response.close()
+
+		client.delete(f'reservas/id/{id_reserva}').close()
+		client.delete(f'canchas/id/{idc}').close()
+
+	def test_stats(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		for dia, hora, duración in (('2031-03-03', 18, 90), ('2031-03-04', 10, 60)):
+			client.post(
+				f'/reservas/cancha/{idc}?dia={dia}&hora={hora}&dur_mins={duración}&tel=93434502306&nom_contacto=pocahontas'
+			).close()
+
+		response = client.get(f'/reservas/stats?desde=2031-03-03&hasta=2031-03-04&id_cancha={idc}&agrupar=cancha')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.json(), [{
+			'id_cancha': idc,
+			'cantidad_reservas': 2,
+			'minutos_reservados': 150,
+			'ocupación_porcentaje': round(100 * 150 / (2 * 24 * 60), 2),
+		}])
+		response.close()
+
+		response = client.get(f'/reservas/stats?desde=2031-03-03&hasta=2031-03-04&id_cancha={idc}&agrupar=dia,hora')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(
+			[(fila['dia'], fila['hora'], fila['minutos_reservados']) for fila in response.json()],
+			[('2031-03-03', 18, 60), ('2031-03-03', 19, 30), ('2031-03-04', 10, 60)],
+		)
+		response.close()
+
+		response = client.get('/reservas/stats?desde=2031-03-03&hasta=2031-03-04&agrupar=semana')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response.close()
+
+		client.delete(f'reservas/q?id_cancha={idc}').close()
+		client.delete(f'canchas/id/{idc}').close()
+
+	def test_grilla(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		# De 23:00 a 01:00 del día siguiente y de 10:00 a 11:00
+		client.post(f'/reservas/cancha/{idc}?dia=2031-07-01&hora=23&dur_mins=120&tel=93434502306&nom_contacto=juan').close()
+		client.post(f'/reservas/cancha/{idc}?dia=2031-07-02&hora=10&dur_mins=60&tel=93434502306&nom_contacto=juan').close()
+
+		response = client.get(f'/reservas/grilla?dia=2031-07-02&canchas={idc}&resolucion=60')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		data = response.json()
+		response.close()
+
+		self.assertEqual(data['resolución_minutos'], 60)
+		self.assertEqual(len(data['canchas']), 1)
+		self.assertEqual(data['canchas'][0]['id_cancha'], idc)
+
+		mapa = urlsafe_b64decode(data['canchas'][0]['ocupación'])
+		ocupadas = [franja for franja in range(24) if mapa[franja // 8] & (0x80 >> franja % 8)]
+		self.assertEqual(ocupadas, [0, 10])
+
+		response = client.get(f'/reservas/grilla?dia=2031-07-02&canchas={idc}&resolucion=7')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response.close()
+
+		client.delete(f'reservas/q?id_cancha={idc}').close()
+		client.delete(f'canchas/id/{idc}').close()
+
+	def test_por_telefono(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		for dia, hora in (('2031-06-10', 9), ('2031-06-02', 20), ('2031-05-20', 11), ('2031-06-02', 18)):
+			client.post(f'/reservas/cancha/{idc}?dia={dia}&hora={hora}&dur_mins=60&tel=93431112233&nom_contacto=juan').close()
+
+		response = client.get('/reservas/por-telefono/9 343 111-2233?desde=2031-06-01&limite=3')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(
+			[(reserva['dia'], reserva['hora']) for reserva in response.json()],
+			[('2031-06-02', 18), ('2031-06-02', 20), ('2031-06-10', 9)],
+		)
+		response.close()
+
+		# Las pasadas completan el límite después de las próximas
+		response = client.get('/reservas/por-telefono/93431112233?desde=2031-06-05')
+		self.assertEqual(
+			[(reserva['dia'], reserva['hora']) for reserva in response.json()],
+			[('2031-06-10', 9), ('2031-06-02', 20), ('2031-06-02', 18), ('2031-05-20', 11)],
+		)
+		response.close()
+
+		response = client.get('/reservas/por-telefono/93431112233?limite=0')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response.close()
+
+		client.delete(f'reservas/q?id_cancha={idc}').close()
+		client.delete(f'canchas/id/{idc}').close()
+
 	def test_patch(self):
 		response = client.patch('/reservas/id/12?dia=2024-12-12&hora=13&dur_mins=60&tel=3424202445&nom_contacto=sebastian')
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -332,6 +600,37 @@ class TestAPIReservas(TestCase):
 		self.assertEqual(data['teléfono'], '3434502306')
 		self.assertEqual(data['nombre_contacto'], 'maurisio')
 
+	def test_patch_if_match(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		response = client.post(f'/reservas/cancha/{idc}?dia=2031-09-01&hora=10&dur_mins=60&tel=93434502306&nom_contacto=juan')
+		idr = response.json()['id']
+		response.close()
+		client.post(f'/reservas/cancha/{idc}?dia=2031-09-01&hora=12&dur_mins=60&tel=93434502306&nom_contacto=juan').close()
+
+		response = client.get(f'/reservas/id/{idr}')
+		etag = response.headers['ETag']
+		response.close()
+
+		response = client.patch(f'/reservas/id/{idr}?nom_contacto=pedro', headers={'If-Match': etag})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(response.headers['ETag'], etag)
+		response.close()
+
+		# La versión del ETag anterior ya no es la actual
+		response = client.patch(f'/reservas/id/{idr}?nom_contacto=pablo', headers={'If-Match': etag})
+		self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+		response.close()
+
+		response = client.patch(f'/reservas/id/{idr}?hora=11&dur_mins=90')
+		self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+		response.close()
+
+		client.delete(f'reservas/q?id_cancha={idc}').close()
+		client.delete(f'canchas/id/{idc}').close()
+
 	def test_delete_id(self):
 		response = client.post('/canchas?nombre=temporal')
 		data = response.json()
@@ -383,6 +682,84 @@ class TestAPIReservas(TestCase):
 		client.delete(f'reservas/q?id_cancha={idc}')
 		client.delete(f'canchas/id/{idc}')
 
+	def test_delete_query_lotes(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		for hora in (8, 10, 12):
+			client.post(
+				f'/reservas/cancha/{idc}?dia=2031-05-05&hora={hora}&dur_mins=60&tel=93434502306&nom_contacto=juan'
+			).close()
+
+		response = client.delete(f'/reservas/q?id_cancha={idc}&hora=8:11&lote=1&devolver=cantidad')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.json(), {'eliminadas': 2})
+		response.close()
+
+		response = client.delete(f'/reservas/q?id_cancha={idc}&lote=1&qmax=1')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response.close()
+
+		response = client.delete(f'/reservas/q?id_cancha={idc}&devolver=todo')
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		response.close()
+
+		# La reserva que queda se elimina en cascada junto con la cancha
+		response = client.delete(f'/canchas/q?nombre=temporal&devolver=cantidad')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertGreaterEqual(response.json()['eliminadas'], 1)
+		response.close()
+
+		response = client.get(f'/reservas/q?id_cancha={idc}')
+		self.assertEqual(response.json(), [])
+		response.close()
+
+	def test_delete_query_ndjson(self):
+		response = client.post('/canchas?nombre=temporal')
+		idc = response.json()['id']
+		response.close()
+
+		for hora in (8, 10, 12):
+			client.post(
+				f'/reservas/cancha/{idc}?dia=2031-05-12&hora={hora}&dur_mins=60&tel=93434502306&nom_contacto=juan'
+			).close()
+
+		# Cada lote se envía apenas se confirma
+		with client.stream('DELETE', f'/reservas/q?id_cancha={idc}&lote=1&devolver=ndjson') as response:
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			horas = [json.loads(línea)['hora'] for línea in response.iter_lines() if línea]
+
+		self.assertEqual(sorted(horas), [8, 10, 12])
+
+		response = client.get(f'/reservas/q?id_cancha={idc}')
+		self.assertEqual(response.json(), [])
+		response.close()
+
+		for hora in (8, 10, 12):
+			client.post(
+				f'/reservas/cancha/{idc}?dia=2031-05-12&hora={hora}&dur_mins=60&tel=93434502306&nom_contacto=juan'
+			).close()
+
+		# El borrado no depende del cliente: sigue aunque deje de leer tras el primer lote
+		with client.stream('DELETE', f'/reservas/q?id_cancha={idc}&lote=1&devolver=ndjson') as response:
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			next(response.iter_lines())
+
+		for _ in range(50):
+			response = client.get(f'/reservas/q?id_cancha={idc}')
+			restantes = response.json()
+			response.close()
+
+			if restantes == []:
+				break
+
+			sleep(0.1)
+
+		self.assertEqual(restantes, [])
+
+		client.delete(f'canchas/id/{idc}').close()
+
 	def test_get_query_fails_dia_ab(self):
 		response = client.get('/reservas/q?dia=a:b')
 		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,7 +1,20 @@
+from datetime import date, datetime, timedelta
+from threading import Barrier, Thread
 from unittest import TestCase
-from db import MakeSession
-from db.crud import create_cancha, delete_cancha, get_cancha, get_canchas
-from db.schemas import CanchaCreate
+from unittest.mock import patch
+from fastapi import HTTPException, status
+from sqlalchemy import update
+from db import MakeSession, create_models, series_reservas
+from db.cache import caché_canchas
+from db.crud import (
+	create_cancha, create_reserva, create_reservas_lote, create_serie, delete_cancha, get_cancha, get_canchas,
+	get_disponibilidad, get_versiones,
+)
+from db.models import Cancha, Reserva
+from db.schemas import CanchaCreate, ReservaCreate, SerieReservaCreate
+
+def setUpModule():
+	create_models()
 
 class TestBDDCanchas(TestCase):
 	def test_add_remove(self):
@@ -82,3 +95,209 @@ class TestBDDCanchas(TestCase):
 		self.assertEqual(cancha.techada, False)
 
 		session.close()
+
+	def test_versión_sin_caché(self):
+		session = MakeSession()
+		cancha = create_cancha(session, CanchaCreate.model_construct(nombre = 'cacheada', techada = False))
+		versión = get_cancha(session, cancha.id).versión
+
+		# Otro proceso modifica la cancha sin pasar por la caché de este
+		otra = MakeSession()
+		otra.execute(update(Cancha).where(Cancha.id == cancha.id).values(nombre='modificada', versión=Cancha.versión + 1))
+		otra.commit()
+		otra.close()
+
+		self.assertEqual(get_cancha(session, cancha.id).versión, versión)
+		self.assertEqual(get_cancha(session, cancha.id, caché=False).versión, versión + 1)
+		# La lectura sin caché la renueva
+		self.assertEqual(get_cancha(session, cancha.id).nombre, 'modificada')
+
+		delete_cancha(session, id_cancha=cancha.id)
+		session.close()
+
+	def test_verificar_existencia_desde_caché(self):
+		session = MakeSession()
+		cancha = create_cancha(session, CanchaCreate.model_construct(nombre = 'cacheada', techada = False))
+		caché_canchas.invalidar(cancha.id)
+		desde = datetime(2032, 6, 1, 8)
+
+		get_disponibilidad(session, desde, desde + timedelta(hours=4), 60, ids_cancha=[cancha.id])
+		self.assertIsNotNone(caché_canchas.consultar(cancha.id))
+
+		with self.assertRaises(HTTPException) as contexto:
+			get_disponibilidad(session, desde, desde + timedelta(hours=4), 60, ids_cancha=[cancha.id, -1])
+
+		self.assertEqual(contexto.exception.status_code, status.HTTP_404_NOT_FOUND)
+
+		# Eliminarla la descarta de la caché
+		delete_cancha(session, id_cancha=cancha.id)
+		self.assertIsNone(caché_canchas.consultar(cancha.id))
+		self.assertRaises(HTTPException, get_disponibilidad, session, desde, desde + timedelta(hours=4), 60, [cancha.id])
+
+		session.close()
+
+class TestBDDReservas(TestCase):
+	def test_escrituras_de_otra_conexión(self):
+		# La otra sesión hace de otro worker: sus escrituras no pasan por este proceso
+		session = MakeSession()
+		otra_session = MakeSession()
+		cancha = create_cancha(session, CanchaCreate(nombre='temporal', techada=False))
+		reserva = ReservaCreate(
+			id_cancha=cancha.id,
+			dia=date(2032, 3, 1),
+			hora=18,
+			duración_minutos=60,
+			teléfono='93434502306',
+			nombre_contacto='juan',
+		)
+
+		ajena = Reserva(
+			id_cancha=cancha.id,
+			dia=reserva.dia,
+			hora=17,
+			duración_minutos=90,
+			teléfono='93434205774',
+			nombre_contacto='rodrigo',
+		)
+		otra_session.add(ajena)
+		otra_session.commit()
+
+		with self.assertRaises(HTTPException) as contexto:
+			create_reserva(session, reserva)
+
+		self.assertEqual(contexto.exception.status_code, status.HTTP_409_CONFLICT)
+		self.assertEqual(contexto.exception.headers['X-Reservas-En-Conflicto'], str(ajena.id))
+
+		# El horario liberado por la otra conexión queda disponible enseguida
+		otra_session.delete(ajena)
+		otra_session.commit()
+
+		self.assertEqual(create_reserva(session, reserva).hora, 18)
+
+		delete_cancha(session, id_cancha=cancha.id)
+		otra_session.close()
+		session.close()
+
+	def test_lote_con_escritura_concurrente(self):
+		session = MakeSession()
+		cancha = create_cancha(session, CanchaCreate(nombre='temporal', techada=False))
+		reservas = [
+			ReservaCreate(
+				id_cancha=cancha.id,
+				dia=date(2032, 3, 8),
+				hora=hora,
+				duración_minutos=60,
+				teléfono='93434502306',
+				nombre_contacto='juan',
+			)
+			for hora in (10, 12)
+		]
+		ocurrencias_en_ventana = series_reservas.ocurrencias_en_ventana
+
+		def registrar_ajena(*args):
+			# Otra conexión, que no toma los bloqueos, registra un horario del lote entre la búsqueda y la inserción
+			if not hasattr(registrar_ajena, 'ajena'):
+				otra_session = MakeSession()
+				registrar_ajena.ajena = Reserva(
+					id_cancha=cancha.id,
+					dia=reservas[0].dia,
+					hora=10,
+					duración_minutos=30,
+					teléfono='93434205774',
+					nombre_contacto='rodrigo',
+				)
+				otra_session.add(registrar_ajena.ajena)
+				otra_session.commit()
+				otra_session.close()
+
+			return ocurrencias_en_ventana(*args)
+
+		with patch.object(series_reservas, 'ocurrencias_en_ventana', registrar_ajena):
+			resultados = create_reservas_lote(session, reservas)
+
+		self.assertEqual(
+			[resultado.status_code for resultado in resultados],
+			[status.HTTP_409_CONFLICT, status.HTTP_201_CREATED],
+		)
+		self.assertIn(str(registrar_ajena.ajena.id), resultados[0].detalle)
+
+		delete_cancha(session, id_cancha=cancha.id)
+		session.close()
+
+	def test_versiones(self):
+		session = MakeSession()
+		cancha = create_cancha(session, CanchaCreate(nombre='temporal', techada=False))
+		reserva = ReservaCreate(
+			id_cancha=cancha.id,
+			dia=date(2032, 5, 3),
+			hora=10,
+			duración_minutos=60,
+			teléfono='93434502306',
+			nombre_contacto='juan',
+		)
+
+		versión, _ = get_versiones(session, Reserva.__tablename__)[Reserva.__tablename__]
+		create_reserva(session, reserva)
+
+		self.assertEqual(get_versiones(session, Reserva.__tablename__)[Reserva.__tablename__][0], versión + 1)
+
+		# Una reserva rechazada no cambia la versión
+		self.assertRaises(HTTPException, lambda: create_reserva(session, reserva))
+		self.assertEqual(get_versiones(session, Reserva.__tablename__)[Reserva.__tablename__][0], versión + 1)
+
+		delete_cancha(session, id_cancha=cancha.id)
+		session.close()
+
+	def test_serie_y_reserva_concurrentes(self):
+		session = MakeSession()
+		cancha = create_cancha(session, CanchaCreate(nombre='temporal', techada=False))
+		barrera = Barrier(2)
+
+		def crear(resultados: dict, clave: str, crear_entidad, entidad):
+			session_hilo = MakeSession()
+
+			try:
+				barrera.wait()
+				crear_entidad(session_hilo, entidad)
+				resultados[clave] = status.HTTP_201_CREATED
+			except HTTPException as exc:
+				resultados[clave] = exc.status_code
+			finally:
+				session_hilo.close()
+
+		# Cada ronda crea a la vez una serie y una reserva en el mismo horario: solo una de las 2 puede registrarse
+		for semana in range(10):
+			dia = date(2032, 4, 5) + timedelta(weeks=semana)
+			resultados = {}
+			serie = SerieReservaCreate(
+				id_cancha=cancha.id,
+				dia_inicio=dia,
+				hasta=dia,
+				hora=20,
+				duración_minutos=60,
+				teléfono='93434502306',
+				nombre_contacto='juan',
+			)
+			reserva = ReservaCreate(
+				id_cancha=cancha.id,
+				dia=dia,
+				hora=20,
+				duración_minutos=30,
+				teléfono='93434205774',
+				nombre_contacto='rodrigo',
+			)
+			hilos = [
+				Thread(target=crear, args=(resultados, 'serie', create_serie, serie)),
+				Thread(target=crear, args=(resultados, 'reserva', create_reserva, reserva)),
+			]
+
+			for hilo in hilos:
+				hilo.start()
+
+			for hilo in hilos:
+				hilo.join()
+
+			self.assertEqual(sorted(resultados.values()), [status.HTTP_201_CREATED, status.HTTP_409_CONFLICT], resultados)
+
+		delete_cancha(session, id_cancha=cancha.id)
+		session.close()
@@ -1,6 +1,13 @@
+from datetime import date
 from unittest import TestCase
 from fastapi import HTTPException
+from db import consultas
+from db.cache import CachéCanchas
 from db.crud import verificar_y_normalizar_teléfono
+from db.ocupacion import MINUTOS_DIA, buscar_solapamientos
+from db.schemas import CanchaSchema
+from db.telefonos import NormalizadorTeléfonos
+from routers.bufer import BúferArchivo
 
 class TestMisc(TestCase):
 	def test_verificar_y_normalizar_teléfono(self):
@@ -15,3 +22,142 @@ class TestMisc(TestCase):
 		self.assertRaises(HTTPException, lambda: verificar_y_normalizar_teléfono('54 9 343 450-2306'))
 		self.assertRaises(HTTPException, lambda: verificar_y_normalizar_teléfono('450-2306'))
 		self.assertRaises(HTTPException, lambda: verificar_y_normalizar_teléfono('Max Verstappen con Peluca'))
+
+	def test_normalizar_varios(self):
+		normalizador = NormalizadorTeléfonos(capacidad=2)
+		resultados = normalizador.normalizar_varios(['343 450 2306', '450-2306', None, '343 450 2306', '+54 343 450 2306'])
+
+		self.assertEqual(resultados[0], '3434502306')
+		self.assertIsInstance(resultados[1], HTTPException)
+		self.assertEqual(resultados[2].status_code, 400)
+		self.assertEqual(resultados[3:], ['3434502306', '+543434502306'])
+		self.assertRaises(HTTPException, lambda: normalizador.normalizar(['343 450 2306']))
+
+class TestBuscarSolapamientos(TestCase):
+	def test_solapamientos(self):
+		intervalos = [(60 * 18, 60 * 18 + 90, 1), (60 * 20, 60 * 21, 2)]
+
+		self.assertEqual(buscar_solapamientos(intervalos, 60 * 19, 60 * 19 + 30), [1])
+		self.assertEqual(buscar_solapamientos(intervalos, 60 * 17, 60 * 18), [])
+		self.assertEqual(buscar_solapamientos(intervalos, 60 * 19, 60 * 21, id_reserva=1), [2])
+		self.assertEqual(buscar_solapamientos(intervalos, 60 * 19 + 30, 60 * 20), [])
+
+	def test_solapamientos_entre_dias(self):
+		# Una reserva que empieza a las 23 del día anterior ocupa los primeros minutos del siguiente
+		intervalos = [(60 * 23 - MINUTOS_DIA, 60 * 25 - MINUTOS_DIA, 7), (60, 120, 8)]
+
+		self.assertEqual(buscar_solapamientos(intervalos, 0, 30), [7])
+		self.assertEqual(buscar_solapamientos(intervalos, 60, 90), [8])
+		self.assertEqual(sorted(buscar_solapamientos(intervalos, 0, 120)), [7, 8])
+
+class TestCachéCanchas(TestCase):
+	def test_vencimiento(self):
+		ahora = [0.0]
+		caché = CachéCanchas(ttl_segundos=10, capacidad=4, reloj=lambda: ahora[0])
+		cargas = []
+		def cargar(id_cancha: int) -> CanchaSchema:
+			cargas.append(id_cancha)
+			return CanchaSchema(id=id_cancha, nombre='Cancha', techada=False, versión=1)
+
+		self.assertEqual(caché.obtener(1, cargar).id, 1)
+		self.assertEqual(caché.obtener(1, cargar).id, 1)
+		self.assertEqual(cargas, [1])
+
+		ahora[0] = 11
+		caché.obtener(1, cargar)
+		self.assertEqual(cargas, [1, 1])
+
+		caché.invalidar(1)
+		caché.obtener(1, cargar)
+		self.assertEqual(cargas, [1, 1, 1])
+
+	def test_consultar(self):
+		ahora = [0.0]
+		caché = CachéCanchas(ttl_segundos=10, capacidad=2, reloj=lambda: ahora[0])
+
+		self.assertIsNone(caché.consultar(1))
+
+		caché.guardar(CanchaSchema(id=1, nombre='Cancha', techada=False, versión=1))
+		self.assertEqual(caché.consultar(1).id, 1)
+
+		ahora[0] = 11
+		self.assertIsNone(caché.consultar(1))
+		self.assertEqual(len(caché), 0)
+
+	def test_desalojo(self):
+		caché = CachéCanchas(ttl_segundos=10, capacidad=2)
+		cargar = lambda id_cancha: CanchaSchema(id=id_cancha, nombre='Cancha', techada=False, versión=1)
+
+		caché.obtener(1, cargar)
+		caché.obtener(2, cargar)
+		caché.obtener(1, cargar)
+		caché.obtener(3, cargar)
+
+		self.assertEqual(len(caché), 2)
+		self.assertIsNone(caché.obtener(2, lambda id_cancha: None))
+		self.assertEqual(caché.obtener(1, lambda id_cancha: None).id, 1)
+
+	def test_sin_guardar(self):
+		caché = CachéCanchas(ttl_segundos=10, capacidad=2)
+		cargar = lambda id_cancha: CanchaSchema(id=id_cancha, nombre='Cancha', techada=False, versión=1)
+
+		# Lo leído de una réplica no se guarda, pero lo ya guardado sí se devuelve
+		self.assertEqual(caché.obtener(1, cargar, guardar=False).id, 1)
+		self.assertEqual(len(caché), 0)
+
+		caché.obtener(2, cargar)
+		self.assertEqual(caché.obtener(2, lambda id_cancha: None, guardar=False).id, 2)
+
+class TestConsultas(TestCase):
+	def test_patrón_ilike(self):
+		self.assertEqual(consultas.patrón_ilike('cancha_*'), r'cancha\_%')
+
+	def test_sentencia_por_forma(self):
+		filtros_a, parámetros_a = consultas.filtros_reservas(id_cancha=1, hora=(10, 12), nombre_contacto='ana*')
+		filtros_b, parámetros_b = consultas.filtros_reservas(id_cancha=2, hora=(8, 9), nombre_contacto='juan')
+
+		self.assertEqual(filtros_a, filtros_b)
+		self.assertIs(consultas.sentencia_reservas(filtros_a), consultas.sentencia_reservas(filtros_b))
+		self.assertEqual(parámetros_a, {'id_cancha': 1, 'hora_min': 10, 'hora_max': 12, 'nombre_contacto': 'ana%'})
+
+		filtros_c, _ = consultas.filtros_reservas(id_cancha=1, hora=10, nombre_contacto='ana*')
+		self.assertIsNot(consultas.sentencia_reservas(filtros_a), consultas.sentencia_reservas(filtros_c))
+
+	def test_filtros_fails(self):
+		self.assertRaises(HTTPException, lambda: consultas.filtros_reservas(hora='10'))
+		self.assertRaises(HTTPException, lambda: consultas.filtros_reservas(dia=(date(2024, 1, 1), 3)))
+
+class TestBúferArchivo(TestCase):
+	def test_envía_a_medida_que_se_escribe(self):
+		búfer = BúferArchivo()
+		lectura = búfer.leer()
+
+		búfer.escribir(b'uno\n')
+		self.assertEqual(next(lectura), b'uno\n')
+
+		búfer.escribir(b'dos\n')
+		búfer.escribir(b'tres\n')
+		búfer.terminar()
+		self.assertEqual(b''.join(lectura), b'dos\ntres\n')
+
+	def test_cliente_que_deja_de_leer(self):
+		búfer = BúferArchivo()
+		lectura = búfer.leer()
+
+		búfer.escribir(b'uno\n')
+		next(lectura)
+		lectura.close()
+
+		# El productor sigue sin errores aunque ya nadie lea
+		búfer.escribir(b'dos\n')
+		búfer.terminar()
+
+	def test_error_del_productor(self):
+		búfer = BúferArchivo()
+		lectura = búfer.leer()
+
+		búfer.escribir(b'uno\n')
+		búfer.terminar(RuntimeError('falló el borrado'))
+
+		self.assertEqual(next(lectura), b'uno\n')
+		self.assertRaises(RuntimeError, next, lectura)